@@ -0,0 +1,136 @@
+# Per-worker summaries of outbound telemetry, one per aggregation window
+
+import logging
+import threading
+import time
+
+from priority import ALERT, TELEMETRY
+from state_store import parse_count, parse_fall
+
+AGGREGATION_WINDOW = 10.0   # Seconds of readings summarised per worker
+
+log = logging.getLogger(__name__)
+
+
+class WorkerWindow:
+    __slots__ = ("hr_last", "hr_min", "hr_max", "battery", "fall", "status", "received_at")
+
+    def __init__(self):
+        self.hr_last = self.hr_min = self.hr_max = None     # bpm as ints
+        self.battery = self.fall = self.status = None
+        self.received_at = None     # perf_counter() of the newest reading
+
+
+class AggregationWindow(threading.Thread):
+    """Collects each worker's readings and sends one summary per window.
+
+    The summary is the last, min and max heart rate ("heartrate", "hrmin",
+    "hrmax"), and the latest battery, falldetect and status. Fall events
+    bypass the window: offer() refuses a fall, the all-clear after one
+    and any other alert-lane reading, and the caller sends those straight
+    away. Every `window` seconds the summaries are passed
+    to emit(reading, received_at) with reading = (floor, worker, sensor,
+    value).
+    """
+
+    def __init__(self, emit, window=AGGREGATION_WINDOW):
+        super().__init__(daemon=True, name="aggregation-window")
+        self.emit = emit
+        self.window = window
+
+        self.absorbed = 0           # Readings folded into a summary
+        self.emitted = 0            # Summary readings sent
+        self.windows = 0
+
+        self._workers = {}          # (floor, worker) -> WorkerWindow
+        self._fallen = {}           # (floor, worker) -> last fall state sent
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def stats(self):
+        return {
+            "window": self.window,
+            "pending_workers": len(self._workers),
+            "absorbed": self.absorbed,
+            "emitted": self.emitted,
+            "windows": self.windows,
+        }
+
+    def offer(self, reading, lane=TELEMETRY, received_at=None):
+        """Fold a reading into its worker's window. False means send it now."""
+        floor, worker, sensor, value = reading
+        key = (floor, worker)
+        if received_at is None:
+            received_at = time.perf_counter()
+        with self._lock:
+            window = self._workers.get(key)
+            if sensor == "falldetect":
+                try:
+                    fallen = parse_fall(value)
+                except ValueError:
+                    return False
+                if fallen or self._fallen.get(key, False):
+                    # A fall, or the all-clear after one. Drop the older
+                    # value still in the window so it cannot land after this.
+                    self._fallen[key] = fallen
+                    if window is not None:
+                        window.fall = None
+                    return False
+                self._fallen[key] = False
+            elif lane == ALERT:
+                if sensor == "status" and window is not None:
+                    window.status = None
+                return False
+            elif sensor not in ("heartrate", "battery", "status"):
+                return False
+
+            if window is None:
+                window = self._workers[key] = WorkerWindow()
+            if sensor == "heartrate":
+                try:
+                    bpm = parse_count(value)
+                except (ValueError, OverflowError):
+                    return False
+                window.hr_last = bpm
+                if window.hr_min is None or bpm < window.hr_min:
+                    window.hr_min = bpm
+                if window.hr_max is None or bpm > window.hr_max:
+                    window.hr_max = bpm
+            elif sensor == "battery":
+                window.battery = value
+            elif sensor == "falldetect":
+                window.fall = value
+            else:
+                window.status = value
+            window.received_at = received_at
+            self.absorbed += 1
+        return True
+
+    def flush(self):
+        """End the current window, returns [(reading, received_at)] to send."""
+        with self._lock:
+            workers, self._workers = self._workers, {}
+        summaries = []
+        for (floor, worker), window in workers.items():
+            if window.hr_last is not None:
+                for sensor, bpm in (("heartrate", window.hr_last), ("hrmin", window.hr_min),
+                                    ("hrmax", window.hr_max)):
+                    summaries.append(((floor, worker, sensor, str(bpm)), window.received_at))
+            for sensor, value in (("battery", window.battery), ("falldetect", window.fall),
+                                  ("status", window.status)):
+                if value is not None:
+                    summaries.append(((floor, worker, sensor, value), window.received_at))
+        self.windows += 1
+        self.emitted += len(summaries)
+        return summaries
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.wait(self.window):
+            for reading, received_at in self.flush():
+                try:
+                    self.emit(reading, received_at)
+                except Exception as e:
+                    log.error("Failed to send summary %s: %s", reading, e)
@@ -0,0 +1,156 @@
+# Heart rate anomaly scores against each worker's own baseline, shared by both apps
+#
+# A fixed limit (see rules.py) misses a heart rate climbing fast from a
+# worker's usual level while still under it. Each worker keeps an
+# exponentially weighted mean and variance of their heart rate, and a
+# two-sided CUSUM of how many standard deviations the samples stray from
+# that mean. A sample is a few float operations on one slot of
+# array-backed columns, whatever the number of workers, and a worker
+# takes five doubles and two ints however long they have reported.
+#
+# The score is the larger of |z| / Z_LIMIT and CUSUM / CUSUM_LIMIT, so 1
+# or more is anomalous: z catches a sudden jump, the CUSUM a steady climb
+# that is never far off in any one sample.
+
+import logging
+import math
+import threading
+from array import array
+from collections import deque
+
+from rules import event_ids
+
+ALPHA = 0.02            # EWMA weight of a new sample, about 100 s of memory at the sketches' 2 s
+WARMUP = 30             # Samples before a worker is scored
+MIN_STD = 2.0           # bpm, floor on the baseline's standard deviation (readings are whole bpm)
+Z_LIMIT = 5.0           # |z| of one sample that scores 1
+CUSUM_SLACK = 0.5       # Standard deviations per sample the CUSUM lets through as noise
+CUSUM_LIMIT = 10.0      # CUSUM that scores 1
+CLEAR_SCORE = 0.5       # An anomaly clears once the score is back under this
+FLAGGED_WEIGHT = 0.1    # Fraction of ALPHA a flagged worker's samples count for in their baseline
+RECENT_EVENTS = 1000    # Fired/cleared events kept for /api/alerts
+RULE = "heartrate_anomaly"
+
+log = logging.getLogger(__name__)
+
+
+class AnomalyDetector:
+    """Scores each heart rate sample against the worker's own baseline.
+
+    on_event(event) is called from the thread that fed the sample when a
+    worker's score reaches 1, and again when it is back under CLEAR_SCORE.
+    Events have the same keys as rules.RulesEngine's, plus the score.
+    """
+
+    def __init__(self, on_event=None, alpha=ALPHA, warmup=WARMUP):
+        self.on_event = on_event
+        self.alpha = alpha
+        self.warmup = warmup
+        self.samples = 0
+        self.keys = []                  # Slot -> (site, floor, worker)
+        self._slots = {}                # (site, floor, worker) -> slot
+        self._mean = array("d")         # EWMA of the heart rate
+        self._var = array("d")          # EWMA variance
+        self._high = array("d")         # CUSUM of climbs, in standard deviations
+        self._low = array("d")          # CUSUM of drops
+        self._score = array("d")
+        self._count = array("l")        # Samples seen
+        self._firing = array("b")
+        self._events = deque(maxlen=RECENT_EVENTS)
+        self._active = {}               # key -> fired event
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _add(self, key, value):
+        self._slots[key] = len(self.keys)
+        self.keys.append(key)
+        self._mean.append(value)
+        self._var.append(0.0)
+        self._high.append(0.0)
+        self._low.append(0.0)
+        self._score.append(0.0)
+        self._count.append(1)
+        self._firing.append(0)
+
+    def update(self, key, value, timestamp):
+        """Score one heart rate sample of the worker `key` and fold it into
+        their baseline. Returns the score, or None while still warming up."""
+        event = None
+        with self._lock:
+            self.samples += 1
+            slot = self._slots.get(key)
+            if slot is None:
+                self._add(key, value)
+                return None
+            count = self._count[slot] + 1
+            self._count[slot] = count
+            mean = self._mean[slot]
+            var = self._var[slot]
+            diff = value - mean
+            z = diff / max(math.sqrt(var), MIN_STD)
+            # Plain running mean and variance until there are 1/alpha samples.
+            # While flagged the baseline barely moves, or the return to
+            # normal would look like an anomaly the other way; it still
+            # comes round to a level that lasts.
+            alpha = max(self.alpha, 1.0 / count)
+            if self._firing[slot]:
+                alpha *= FLAGGED_WEIGHT
+            step = alpha * diff
+            self._mean[slot] = mean + step
+            self._var[slot] = (1.0 - alpha) * (var + diff * step)
+            if count <= self.warmup:
+                return None
+
+            high = min(max(0.0, self._high[slot] + z - CUSUM_SLACK), 2 * CUSUM_LIMIT)
+            low = min(max(0.0, self._low[slot] - z - CUSUM_SLACK), 2 * CUSUM_LIMIT)
+            self._high[slot] = high
+            self._low[slot] = low
+            score = max(abs(z) / Z_LIMIT, max(high, low) / CUSUM_LIMIT)
+            self._score[slot] = score
+            if score >= 1.0 and not self._firing[slot]:
+                self._firing[slot] = 1
+                event = self._record(key, True, value, score, timestamp,
+                                     f"heart rate {value:g} bpm, {z:+.1f} sd from usual {mean:.0f}")
+            elif score < CLEAR_SCORE and self._firing[slot]:
+                self._firing[slot] = 0
+                event = self._record(key, False, value, score, timestamp,
+                                     f"heart rate {value:g} bpm, back near usual {mean:.0f}")
+        if event is not None and self.on_event is not None:
+            try:
+                self.on_event(event)
+            except Exception:
+                log.exception("Anomaly handler failed for %s", key)
+        return score
+
+    def _record(self, key, fired, value, score, now, message):
+        site, floor, worker = key
+        event = {"id": next(event_ids), "rule": RULE, "state": "fired" if fired else "cleared",
+                 "site": site, "floor": floor, "worker": worker, "at": now, "value": value,
+                 "score": round(score, 2), "message": message}
+        if fired:
+            self._active[key] = event
+        else:
+            self._active.pop(key, None)
+        self._events.append(event)
+        return event
+
+    def baseline(self, key):
+        """(mean, standard deviation, score, samples) of a worker, or None."""
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                return None
+            return (self._mean[slot], math.sqrt(self._var[slot]), self._score[slot], self._count[slot])
+
+    def active(self):
+        """Workers anomalous now, oldest event first."""
+        return sorted(list(self._active.values()), key=lambda event: event["id"])
+
+    def events(self, since=0):
+        """Fired and cleared events after event id `since`, oldest first."""
+        return [event for event in list(self._events) if event["id"] > since]
+
+    def stats(self):
+        return {"workers": len(self), "active": len(self._active), "samples": self.samples}
@@ -1,14 +1,32 @@
 # SITE A SETUP
-# Change line 13 to MQTT broker IP
-# Change line 12 to COM port connected to TX LoRa
+# Set BROKER_ADD to the MQTT broker IP
+# Set PORT to the COM port connected to TX LoRa
 
-from flask import Flask, render_template, jsonify, request, redirect, url_for, flash, session, after_this_request
+from flask import Flask, Response, render_template, jsonify, request, redirect, url_for, flash, session, after_this_request
 import paho.mqtt.client as mqtt
+import asyncio
 import threading
 import serial
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
+import logging
 import os
+import time
 import dotenv
+from aggregator import AggregationWindow
+from anomaly import AnomalyDetector
+from archive import Archive
+from async_engine import AsyncMqtt, AsyncSerialReader, WsgiServer, consume, run_async
+from deadband import DeadbandFilter
+from events import EventBroker
+from history import History
+from liveness import LIVE, LivenessTracker
+from log_setup import setup_logging
+from metrics import CONTENT_TYPE, Registry
+from priority import ALERT, TELEMETRY, AsyncLaneQueue, classify_topic, lane_stats, lane_trackers, parse_actl
+from rules import FallUnanswered, RulesEngine, Threshold
+from serial_link import LoRaForwarder
+from snapshot_cache import SnapshotCache, pick_encoding
+from state_store import SENSOR_FIELDS, WorkerStateStore
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
@@ -20,7 +38,43 @@ app.config.update(
 )
 PORT = 'COM4'                       # Change to the COM port connected to TX LoRa
 BROKER_ADD = "192.168.0.111"        # Change
+SITE_ID = "SITE_A"                  # Must match node_id in LORA_SITEA.ino
+ARCHIVE_PATH = "archive_site.db"    # SQLite archive of readings and incidents, None to disable
+HISTORY_SIZE = 3600                 # Readings kept per worker and sensor for /api/history
+SNAPSHOT_INTERVAL = 0.0             # Min seconds between /api/data re-serialisations, 0 = every change
+FRAME_ENCODING = True               # Pack several readings per LoRa packet, False for one ASCII line each
+ACK_TIMEOUT = 9.0                   # Max seconds to wait for the TX sketch (4 tries x 2 s ACK window)
+SERIAL_RETRY = 1.0                  # Seconds between reads of the TX LoRa port after a read error
+AGGREGATION_WINDOW = 10.0           # Seconds of telemetry summarised per worker before sending, None to send every reading
+HEARTRATE_DEADBAND = 2              # bpm a heart rate must move before it is sent again
+HEARTRATE_RELATIVE = 0.03           # ... or this fraction of the last one sent, if larger
+BATTERY_STEP = 5                    # Percent battery must move before it is sent again
+KEYFRAME_INTERVAL = 60.0            # Seconds after which an unchanged reading is sent anyway, None = send all
+LOG_LEVEL = "INFO"                  # DEBUG logs every reading, sent payload and serial line
+LOG_LEVELS = {}                     # Per-subsystem levels, e.g. {"site.readings": "DEBUG"}
+ASYNC_MODE = False                  # MQTT, serial and HTTP on one asyncio loop, see async_engine.py
+LIVENESS_TIMEOUTS = {               # Per sensor, seconds of silence before a worker is (stale, offline);
+    "heartrate": (10, 60),          # the sketches publish every 2 s. None to disable.
+    "battery": (10, 60),
+    "falldetect": (10, 60),
+}
+ALERT_RULES = (                     # Evaluated every second over all workers, see rules.py. None to disable.
+    Threshold("heartrate_high", "heartrate", above=120, hold=30),
+    Threshold("heartrate_low", "heartrate", below=50, hold=30),
+    Threshold("battery_low", "battery", below=15),
+    FallUnanswered("fall_unanswered", within=60),
+)
+HEARTRATE_ANOMALIES = True          # Score heart rates against each worker's own baseline, see anomaly.py
 ser = None
+broker = EventBroker()              # Pushes updates to dashboards on /api/stream
+forwarder = LoRaForwarder(frames=FRAME_ENCODING,    # Writes readings to the TX LoRa off the MQTT thread
+                          ack_timeout=ACK_TIMEOUT)
+store_latency = lane_trackers()     # Per lane, MQTT receipt to store update
+
+log = logging.getLogger("site")
+mqtt_log = logging.getLogger("site.mqtt")
+reading_log = logging.getLogger("site.readings")
+serial_log = logging.getLogger("site.serial")
 
 # Setup Flask-Login
 login_manager = LoginManager()
@@ -47,85 +101,240 @@ def load_user(user_id):
             return user
     return None
 
-data_store = {
-    # Floor ID → Worker ID → Sensor type → Value
-    # Example data
-    # "1": {
-    #     "worker1": {
-    #         "falldetect": "0",
-    #         "heartrate": "75",
-    #         "battery": "90"
-    #     }
-    # }
-}
+# Latest reading per worker. This app only ever holds its own site, keyed as
+# SITE_ID -> floor -> worker, e.g. store.get("SITE_A", "1", "2").heartrate
+store = WorkerStateStore()
+snapshot_cache = SnapshotCache(store, SITE_ID, SNAPSHOT_INTERVAL)
+history = History(HISTORY_SIZE)     # Recent readings per worker and sensor
+archive = None                      # Archive once started, see start_archive
+aggregator = None                   # AggregationWindow once started, see start_aggregator
+mqtt_queue = None                   # AsyncLaneQueue of received messages in ASYNC_MODE
+liveness = None                     # LivenessTracker once started, see start_liveness
+alerts = None                       # RulesEngine once started, see start_alerts
+anomalies = None                    # AnomalyDetector once started, see start_anomalies
+deadband = (DeadbandFilter(HEARTRATE_DEADBAND, HEARTRATE_RELATIVE, BATTERY_STEP, KEYFRAME_INTERVAL)
+            if KEYFRAME_INTERVAL else None)     # Drops readings that have not changed enough
+
+# Served on /metrics
+metrics = Registry()
+mqtt_messages = metrics.counter("site_mqtt_messages_total", "MQTT messages received, by sensor topic", ("sensor",))
+parse_errors = metrics.counter("site_parse_errors_total", "Messages that could not be used, by stage", ("stage",))
+serial_lines = metrics.counter("site_serial_lines_total", "Lines printed by the TX LoRa, by type", ("type",))
+on_message_seconds = metrics.histogram("site_on_message_seconds", "Time spent in on_message")
+api_data_seconds = metrics.histogram("site_api_data_seconds", "Time to build an /api/data response", ("kind",))
+metrics.callback("site_store_workers", "Workers in the state store", lambda: len(store))
+metrics.callback("site_workers_liveness", "Tracked workers by liveness state",
+                 lambda: None if liveness is None else {(state,): count for state, count in liveness.counts().items()},
+                 ("state",))
+metrics.callback("site_alerts_active", "Alerts firing now, by rule",
+                 lambda: None if alerts is None else {(rule,): count for rule, count in alerts.counts().items()},
+                 ("rule",))
+metrics.callback("site_heartrate_anomalies_active", "Workers whose heart rate is anomalous now",
+                 lambda: None if anomalies is None else len(anomalies.active()))
+metrics.callback("site_forwarder_queue_depth", "Readings waiting for the TX LoRa", forwarder.depth)
+metrics.callback("site_mqtt_queue_depth", "Messages waiting to be handled (ASYNC_MODE)",
+                 lambda: None if mqtt_queue is None else len(mqtt_queue))
+metrics.callback("site_mqtt_queue_dropped_total", "Telemetry dropped from a full message queue (ASYNC_MODE)",
+                 lambda: None if mqtt_queue is None else mqtt_queue.dropped, type="counter")
+metrics.callback("site_forwarder_frames_total", "Payloads written to the TX LoRa",
+                 lambda: forwarder.frames_sent, type="counter")
 
 @app.after_request
 def add_no_cache_headers(response):
     """Add headers to prevent browser caching."""
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate, max-age=0"
+    if response.get_etag()[0]:
+        # Versioned responses may be kept, but must be revalidated every time
+        response.headers["Cache-Control"] = "no-cache, must-revalidate, max-age=0"
+    else:
+        response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate, max-age=0"
     response.headers["Pragma"] = "no-cache"
     response.headers["Expires"] = "0"
     return response
 
 # Callback when the client connects to the broker
 def on_connect(client, userdata, flags, rc):
-    print(f"Connected with result code {rc}")
     if rc == 0:
-        print("Successfully connected to MQTT broker")
+        mqtt_log.info("Connected to MQTT broker")
         # Subscribe to specific topics
-        topics = ["/+/+/falldetect", "/+/+/heartrate", "/+/+/battery"]
+        topics = ["/+/+/falldetect", "/+/+/heartrate", "/+/+/battery", "/+/+/status", "actl"]
         for topic in topics:
             client.subscribe(topic)
-            print(f"Subscribed to {topic}")
+            mqtt_log.info("Subscribed to %s", topic)
+    else:
+        mqtt_log.error("Failed to connect, return code %s", rc)
+
+# Lane of an MQTT message. An "OK" fall status is only news, and an
+# alert, when the store has the worker down as fallen.
+def topic_lane(topic, message):
+    if topic == "actl":
+        actl = parse_actl(message)
+        ids = None if actl is None else actl[:2]
     else:
-        print(f"Failed to connect, return code {rc}")
+        parts = topic.split("/")
+        ids = parts[1:3] if len(parts) == 4 and parts[3] == "falldetect" else None
+    record = None if ids is None else store.get(SITE_ID, *ids)
+    return classify_topic(topic, message, None if record is None else record.fallen)
+
+# What an alert for this message supersedes in the queues: the same topic.
+# actl carries a worker's fall state, so it counts as their falldetect topic.
+def topic_key(topic, message):
+    if topic == "actl":
+        actl = parse_actl(message)
+        return topic if actl is None else f"/{actl[0]}/{actl[1]}/falldetect"
+    return topic
 
 # Callback when a message is received
 def on_message(client, userdata, msg):
-    global ser
-    topic_parts = msg.topic.split("/")
-    
+    process_message(msg, time.perf_counter())
+
+# In ASYNC_MODE messages wait on mqtt_queue first, received_at is still their arrival
+def process_message(msg, received_at):
+    started = time.perf_counter()
+    mqtt_messages.inc((msg.topic.rpartition("/")[2],))
+    handle_mqtt_message(msg, received_at)
+    on_message_seconds.observe(time.perf_counter() - started)
+
+def handle_mqtt_message(msg, received_at):
     try:
         message = msg.payload.decode('utf-8')
         topic = msg.topic  # e.g., "/floor1/worker23/heartrate/75"
+        lane = topic_lane(topic, message)
+
+        if topic == "actl":
+            # Consolidated JSON from the worker sketches. Only a fall is news,
+            # the rest repeats the per-sensor topics
+            actl = parse_actl(message)
+            if actl is None:
+                parse_errors.inc(("actl",))
+                return
+            if lane != ALERT:
+                return
+            floor_id, worker_id, status = actl
+            record = store.get(SITE_ID, floor_id, worker_id)
+            if record is not None and record.fallen == (status == "Fallen"):
+                return      # Already seen on the falldetect topic
+            topic = f"/{floor_id}/{worker_id}/falldetect"
+            message = status
 
         payload = topic + "/" + message
-        print("Payload: " + payload)
-        
-        if ser is not None:
-            ser.write((payload + "\n").encode())  # Send raw topic + newline
-            print(f"Sent to serial: {payload}")
+        reading_log.debug("Payload: %s", payload)
+        topic_parts = topic.split("/")
+        reading = (topic_parts[1], topic_parts[2], topic_parts[3], message) if len(topic_parts) == 4 else None
+
+        # Queue for the TX LoRa, the forwarder thread does the actual write.
+        # Routine telemetry waits for the worker's summary at the end of the window.
+        if reading is None or aggregator is None or not aggregator.offer(reading, lane, received_at):
+            forward(topic, payload, lane, received_at, reading)
+
+        if len(topic_parts) >= 4:
+            floor_id = topic_parts[1]  # Correct extraction from topic
+            worker_id = topic_parts[2]  # Correct extraction from topic
+            sensor_type = topic_parts[3]
+
+            # Store the data
+            record = store.update(SITE_ID, floor_id, worker_id, sensor_type, message)
+            if record is None:
+                reading_log.warning("Ignored invalid reading: %s", payload)
+                parse_errors.inc(("reading",))
+                return
+            history.record(SITE_ID, floor_id, worker_id, sensor_type, record.reading(sensor_type), record.updated)
+            if archive is not None:
+                archive.record(SITE_ID, floor_id, worker_id, sensor_type, message, record.updated)
+            if liveness is not None:
+                liveness.seen((SITE_ID, floor_id, worker_id), sensor_type, record.updated)
+            if anomalies is not None and sensor_type == "heartrate":
+                score = anomalies.update((SITE_ID, floor_id, worker_id), record.heartrate, record.updated)
+                if score is not None:
+                    store.set_anomaly(SITE_ID, floor_id, worker_id, score)
+            if alerts is not None:
+                alerts.observe(record, sensor_type)
+            broker.publish("update", {"floor": floor_id, "worker": worker_id, "data": record.as_dict()})
+            store_latency[lane].record(time.perf_counter() - received_at)
+
+            # Process the message based on the sensor type
+            if sensor_type == "falldetect" and record.fallen:
+                reading_log.warning("ALERT! Worker %s on floor %s has fallen!", worker_id, floor_id)
+            elif sensor_type == "heartrate":
+                reading_log.debug("Worker %s on floor %s has heart rate: %s bpm", worker_id, floor_id, message)
+            elif sensor_type == "battery":
+                reading_log.debug("Worker %s on floor %s has battery level: %s%%", worker_id, floor_id, message)
+            elif sensor_type == "status":
+                reading_log.debug("Worker %s on floor %s status: %s", worker_id, floor_id, message)
     except Exception as e:
-        print(f"Error: {e}")
-    
-    if len(topic_parts) >= 4:
-        floor_id = topic_parts[1]  # Correct extraction from topic
-        worker_id = topic_parts[2]  # Correct extraction from topic
-        sensor_type = topic_parts[3]
-        
-        # Initialize nested dictionaries if they don't exist
-        if floor_id not in data_store:
-            data_store[floor_id] = {}
-        if worker_id not in data_store[floor_id]:
-            data_store[floor_id][worker_id] = {}
-            
-        # Store the data
-        data_store[floor_id][worker_id][sensor_type] = message
-
-        # Process the message based on the sensor type
-        if sensor_type == "falldetect":
-            print(f"ALERT! Worker {worker_id} on floor {floor_id} has fallen!")
-        elif sensor_type == "heartrate":
-            print(f"Worker {worker_id} on floor {floor_id} has heart rate: {msg.payload.decode()} bpm")
-        elif sensor_type == "battery":
-            print(f"Worker {worker_id} on floor {floor_id} has battery level: {msg.payload.decode()}%")
+        mqtt_log.error("Failed to handle message on %s: %s", msg.topic, e)
+        parse_errors.inc(("mqtt",))
+
+def start_archive(path=ARCHIVE_PATH):
+    global archive
+    archive = Archive(path)
+    archive.start()
+    return archive
+
+# A worker went stale or offline, or is back: mark it in the store, where
+# /api/data picks it up, and push it to the dashboards
+def on_liveness_change(key, state, silent):
+    site, floor_id, worker_id = key
+    record = store.set_liveness(site, floor_id, worker_id, None if state == LIVE else state, silent)
+    if record is None:
+        return
+    if state == LIVE:
+        reading_log.info("Worker %s on floor %s is reporting again", worker_id, floor_id)
+    else:
+        reading_log.warning("Worker %s on floor %s is %s, nothing from %s", worker_id, floor_id,
+                            state, ", ".join(silent))
+    broker.publish("liveness", {"floor": floor_id, "worker": worker_id, "data": record.as_dict()})
+
+def start_liveness(timeouts=LIVENESS_TIMEOUTS):
+    global liveness
+    liveness = LivenessTracker(timeouts, on_liveness_change)
+    liveness.start()
+    return liveness
+
+# An alert rule or heart rate anomaly fired or cleared for a worker: log it
+# and push it to the dashboards
+def on_alert(event):
+    if event["state"] == "fired":
+        reading_log.warning("ALERT %s: worker %s on floor %s, %s", event["rule"], event["worker"],
+                            event["floor"], event["message"])
+    else:
+        reading_log.info("Cleared %s: worker %s on floor %s", event["rule"], event["worker"], event["floor"])
+    broker.publish("alert", event)
+
+def start_alerts(rules=ALERT_RULES):
+    global alerts
+    alerts = RulesEngine(rules, on_alert)
+    alerts.start()
+    return alerts
+
+def start_anomalies():
+    global anomalies
+    anomalies = AnomalyDetector(on_alert)
+    return anomalies
+
+# Queue one reading of a window summary for the TX LoRa
+def send_summary(reading, received_at):
+    floor_id, worker_id, sensor_type, value = reading
+    topic = f"/{floor_id}/{worker_id}/{sensor_type}"
+    forward(topic, f"{topic}/{value}", TELEMETRY, received_at, reading)
+
+# Queue one reading for the TX LoRa unless it has not changed enough to send
+def forward(topic, payload, lane, received_at, reading):
+    if deadband is not None and reading is not None and not deadband.check(reading, lane):
+        return
+    forwarder.submit(topic, payload, lane, received_at, reading)
+
+def start_aggregator(window=AGGREGATION_WINDOW):
+    global aggregator
+    aggregator = AggregationWindow(send_summary, window)
+    aggregator.start()
+    return aggregator
 
 def mqtt_loop():
     try:
-        print("Starting MQTT loop...")
+        mqtt_log.info("Starting MQTT loop")
         client.loop_forever()
     except KeyboardInterrupt:
-        print("Exiting")
+        mqtt_log.info("Exiting")
         client.disconnect()
 
 # Create MQTT client
@@ -136,30 +345,78 @@ client.on_message = on_message
 # Set authentication credentials
 client.username_pw_set("iot_proj", "1234")
 
-print("Connecting to MQTT broker...")
-# Connect to the broker (change IP)
-client.connect(BROKER_ADD, 1883, 60)
+# Connect to the broker and run the MQTT client loop in a background thread.
+# Called from __main__, so importing this module (benchmarks, load tests)
+# does not need a broker.
+def start_mqtt(address=BROKER_ADD):
+    mqtt_log.info("Connecting to MQTT broker at %s", address)
+    client.connect(address, 1883, 60)
+    mqtt_thread = threading.Thread(target=mqtt_loop, daemon=True)
+    mqtt_thread.start()
+    return mqtt_thread
 
-# Start the MQTT client loop in a background thread
-mqtt_thread = threading.Thread(target=mqtt_loop, daemon=True)
-mqtt_thread.start()
+# ASYNC_MODE: paho, the TX LoRa's output and HTTP share one event loop.
+# Messages are queued by lane so a burst of telemetry is shed, oldest
+# first, before alerts wait.
+async def serve_async(host="localhost", port=5000):
+    global mqtt_queue
+    mqtt_queue = AsyncLaneQueue()
+
+    def queue_message(client, userdata, msg):
+        message = msg.payload.decode('utf-8', 'replace')
+        mqtt_queue.put((msg, time.perf_counter()), topic_lane(msg.topic, message), topic_key(msg.topic, message))
+
+    client.on_message = queue_message
+    tasks = [consume(mqtt_queue, lambda lane, item: process_message(*item)),
+             AsyncMqtt(client).run(BROKER_ADD)]
+    if ser is not None:
+        tasks.append(AsyncSerialReader(PORT, handle_serial_line, port=ser).run())
+    server = WsgiServer(app, {"/api/stream": (broker, snapshot_cache.snapshot)})
+    tasks.append((await server.serve(host, port)).serve_forever())
+    await asyncio.gather(*tasks)
 
 # Read and print COM port to log LoRa messages
 def serial_reader():
     global ser
     if ser is None:
-        print("Serial port not available.")
+        serial_log.error("Serial port not available")
         return
 
-    print("Started serial reader thread...")
+    serial_log.info("Started serial reader thread")
+    # Keep reading whatever happens: the forwarder waits on the ACKs seen here
     while True:
         try:
-            line = ser.readline().decode('utf-8').strip()
-            if line:
-                print(f"Serial: {line}")
+            raw = ser.readline()
+        except Exception as e:
+            serial_log.error("Error reading from serial: %s", e)
+            time.sleep(SERIAL_RETRY)
+            continue
+        try:
+            handle_serial_line(raw)
         except Exception as e:
-            print(f"Error reading from serial: {e}")
-            break
+            serial_log.error("Failed to handle serial line %r: %s", raw, e)
+            serial_lines.inc(("error",))
+
+# One line printed by the TX LoRa
+def handle_serial_line(raw):
+    line = raw.decode('utf-8', 'replace').strip()
+    if not line:
+        return
+    serial_log.debug("Serial: %s", line)
+    # The sketch is done with the last payload and can take the next
+    if line == "ACK received":
+        serial_lines.inc(("ack",))
+        forwarder.ack()
+    elif line == "Failed":
+        serial_lines.inc(("failed",))
+        serial_log.warning("TX LoRa gave up on a payload after its retries")
+        forwarder.ack(ok=False)
+    elif line == "Retrying...":
+        serial_lines.inc(("retrying",))
+    elif line.startswith("Sent raw: "):
+        serial_lines.inc(("sent",))
+    else:
+        serial_lines.inc(("other",))
 
 @app.route('/api/check-session')
 def check_session():
@@ -178,12 +435,11 @@ def login():
                 login_user(users[username])
                 next_page = request.args.get('next')
                 
-                # Debug print
-                print(f"Login successful for {username}, redirecting to: {next_page or '/'}")
+                log.info("Login successful for %s, redirecting to: %s", username, next_page or '/')
                 
                 return redirect(next_page or url_for('main'))
             except Exception as e:
-                print(f"Error during login: {e}")
+                log.error("Error during login: %s", e)
                 flash(f"An error occurred during login: {e}")
         else:
             flash('Invalid username or password')
@@ -206,23 +462,168 @@ def logout():
 @app.route("/")
 @login_required
 def main():
-    return render_template("dashboard.html", data=data_store)
+    return render_template("dashboard.html", data=snapshot_cache.snapshot())
 
-# API endpoint to get lastest data
+# API endpoint to get lastest data. ?since=<version> returns only the workers
+# changed after that version, and If-None-Match gets a 304 when nothing did
 @app.route("/api/data")
 @login_required
 def get_data():
-    return jsonify(data_store)
+    started = time.perf_counter()
+    # The ETag is the snapshot version, so an unchanged store costs a 304
+    since = request.args.get("since", type=int)
+    if since is None:
+        # Full state comes pre-serialised from the cache
+        encoding = pick_encoding(request.accept_encodings)
+        version, body = snapshot_cache.get(encoding)
+    else:
+        version = snapshot_cache.version
+    etag = snapshot_cache.etag(version)
 
-if __name__ == "__main__":
+    if request.if_none_match.contains(etag):
+        response, kind = Response(status=304), "not_modified"
+    elif since is None:
+        response, kind = Response(body, mimetype="application/json"), "full"
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+    elif since > version:
+        # Client's version is from before a restart, send everything
+        response = jsonify({"version": version, "full": True, "changed": snapshot_cache.snapshot()})
+        kind = "full"
+    else:
+        response = jsonify({"version": version, "changed": snapshot_cache.snapshot(since=since)})
+        kind = "delta"
+    response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+    response.headers["X-Data-Version"] = str(version)
+    response.headers["X-Data-Epoch"] = snapshot_cache.epoch
+    api_data_seconds.observe(time.perf_counter() - started, (kind,))
+    return response
+
+# Prometheus scrape endpoint. Not behind the login so a scraper can read
+# it; the app only listens on localhost.
+@app.route("/metrics")
+def get_metrics():
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+# Serial forwarding queue: depth, coalesced readings and send latency
+@app.route("/api/forwarder-stats")
+@login_required
+def get_forwarder_stats():
+    stats = forwarder.stats()
+    if aggregator is not None:
+        stats["aggregation"] = aggregator.stats()
+    if deadband is not None:
+        stats["deadband"] = deadband.stats()
+    return jsonify(stats)
+
+# Site A stage of the alert pipeline, per priority lane. The Central app
+# reports the serial-to-store stage of the same path.
+@app.route("/api/latency")
+@login_required
+def get_latency():
+    return jsonify({
+        "mqtt_to_store": lane_stats(store_latency),
+        "mqtt_to_serial": lane_stats(forwarder.latency),
+    })
+
+# Reading history for one worker: /api/history/<site>/<floor>/<worker>?sensor=heartrate
+# from/to are unix seconds, step buckets the points into min/max/avg
+@app.route("/api/history/<site>/<floor>/<worker>")
+@login_required
+def get_history(site, floor, worker):
+    sensor = request.args.get("sensor", "heartrate")
+    if sensor not in SENSOR_FIELDS or site != SITE_ID:
+        return jsonify({"error": "unknown worker or sensor"}), 404
+    points = history.query(site, floor, worker, sensor,
+                           start=request.args.get("from", type=float),
+                           end=request.args.get("to", type=float),
+                           step=request.args.get("step", type=float))
+    if points is None:
+        return jsonify({"error": "unknown worker or sensor"}), 404
+    return jsonify({"site": site, "floor": floor, "worker": worker, "sensor": sensor, "points": points})
+
+# Fall incidents from the archive, newest first. Filters: site, floor, worker,
+# from/to (unix seconds)
+@app.route("/api/incidents")
+@login_required
+def get_incidents():
+    if archive is None:
+        return jsonify({"error": "archive disabled"}), 503
+    return jsonify(archive.incidents(site=request.args.get("site"),
+                                     floor=request.args.get("floor"),
+                                     worker=request.args.get("worker"),
+                                     start=request.args.get("from", type=float),
+                                     end=request.args.get("to", type=float)))
+
+# Archived reading statistics and incident count for one worker
+@app.route("/api/workers/<site>/<floor>/<worker>/summary")
+@login_required
+def get_worker_summary(site, floor, worker):
+    if archive is None:
+        return jsonify({"error": "archive disabled"}), 503
+    return jsonify(archive.summary(site, floor, worker,
+                                   start=request.args.get("from", type=float),
+                                   end=request.args.get("to", type=float)))
+
+# Alerts and heart rate anomalies firing now, and the fired/cleared events
+# after event id `since`
+@app.route("/api/alerts")
+@login_required
+def get_alerts():
+    sources = [source for source in (alerts, anomalies) if source is not None]
+    if not sources:
+        return jsonify({"error": "alert rules disabled"}), 503
+    since = request.args.get("since", 0, type=int)
+    return jsonify({"active": sorted((event for source in sources for event in source.active()),
+                                     key=lambda event: event["id"]),
+                    "events": sorted((event for source in sources for event in source.events(since)),
+                                     key=lambda event: event["id"]),
+                    "stats": {"rules": None if alerts is None else alerts.stats(),
+                              "anomalies": None if anomalies is None else anomalies.stats()}})
+
+# Push stream: one snapshot, then only the per-worker changes
+@app.route("/api/stream")
+@login_required
+def stream_data():
+    return Response(broker.stream(snapshot_cache.snapshot), mimetype="text/event-stream",
+                    headers={"X-Accel-Buffering": "no"})
+
+# TX LoRa port, forwarder, aggregation, archive, liveness, alert rules and
+# anomaly scores: what both run modes need
+def start_services():
+    global ser
     try:
         ser = serial.Serial(PORT, 9600, timeout=1)
-        print(f"Serial port {PORT} opened successfully")    
+        serial_log.info("Serial port %s opened", PORT)
     except Exception as e:
-        print(f"Failed to open serial port: {e}")
+        serial_log.error("Failed to open serial port: %s", e)
         ser = None
 
+    forwarder.port = ser
+    forwarder.start()
+    if AGGREGATION_WINDOW:
+        start_aggregator()
+    if ARCHIVE_PATH is not None:
+        start_archive()
+    if LIVENESS_TIMEOUTS:
+        start_liveness()
+    if ALERT_RULES:
+        start_alerts()
+    if HEARTRATE_ANOMALIES:
+        start_anomalies()
+
+# Thread mode ingest: the TX LoRa reader and the MQTT client loop
+def start_ingest():
     serial_thread = threading.Thread(target=serial_reader, daemon=True)
     serial_thread.start()
-        
-    app.run(host="localhost", debug=False)
\ No newline at end of file
+    start_mqtt()
+
+if __name__ == "__main__":
+    setup_logging(LOG_LEVEL, LOG_LEVELS)
+    start_services()
+    if ASYNC_MODE:
+        run_async(serve_async)
+    else:
+        start_ingest()
+        app.run(host="localhost", debug=False)
\ No newline at end of file
@@ -0,0 +1,205 @@
+# SQLite archive of readings and fall incidents, written in batches off the
+# ingest path
+
+import logging
+import sqlite3
+import threading
+from collections import deque
+
+from state_store import parse_fall
+
+BATCH_SIZE = 500            # Max rows per transaction
+FLUSH_INTERVAL = 1.0        # Max seconds a reading waits before it is written
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    site TEXT NOT NULL,
+    floor TEXT NOT NULL,
+    worker TEXT NOT NULL,
+    sensor TEXT NOT NULL,
+    value REAL,
+    ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS readings_worker_ts ON readings (site, floor, worker, ts);
+
+CREATE TABLE IF NOT EXISTS incidents (
+    id INTEGER PRIMARY KEY,
+    site TEXT NOT NULL,
+    floor TEXT NOT NULL,
+    worker TEXT NOT NULL,
+    fallen_ts REAL NOT NULL,
+    responding_ts REAL,
+    cleared_ts REAL
+);
+CREATE INDEX IF NOT EXISTS incidents_worker_ts ON incidents (site, floor, worker, fallen_ts);
+"""
+
+
+def connect(path):
+    db = sqlite3.connect(path, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+class Archive(threading.Thread):
+    """Queues readings in memory and writes them to SQLite from its own thread.
+
+    Readings are inserted with executemany, one transaction per batch. A
+    falldetect change from OK to Fallen opens an incident, and back to OK
+    clears it. The sketches publish a "Responding" status when a nearby
+    worker goes to help, so the first "Responding" on the same floor marks
+    the open incidents there as acknowledged.
+    record() never touches the database, so ingest never waits on it.
+    """
+
+    def __init__(self, path, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, max_pending=100000):
+        super().__init__(daemon=True, name="archive")
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self.written = 0
+        self.dropped = 0                # Readings lost to a full queue
+        self.batches = 0
+        self.errors = 0
+
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._stop_event = threading.Event()
+        self._fallen = {}               # (site, floor, worker) -> open incident id
+
+        db = connect(path)
+        db.executescript(SCHEMA)
+        for row in db.execute("SELECT id, site, floor, worker FROM incidents WHERE cleared_ts IS NULL"):
+            self._fallen[row[1:]] = row[0]
+        db.close()
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "errors": self.errors,
+        }
+
+    def record(self, site, floor, worker, sensor, value, timestamp):
+        with self._cond:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append((site, floor, worker, sensor, value, timestamp))
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def stop(self):
+        self._stop_event.set()
+        with self._cond:
+            self._cond.notify()
+        self.join()
+
+    def _write_batch(self, db, batch):
+        rows = []
+        for site, floor, worker, sensor, value, timestamp in batch:
+            key = (site, floor, worker)
+            if sensor == "falldetect":
+                try:
+                    fallen = parse_fall(value)
+                except ValueError:
+                    continue
+                rows.append((site, floor, worker, sensor, float(fallen), timestamp))
+                if fallen and key not in self._fallen:
+                    cursor = db.execute(
+                        "INSERT INTO incidents (site, floor, worker, fallen_ts) VALUES (?, ?, ?, ?)",
+                        (site, floor, worker, timestamp))
+                    self._fallen[key] = cursor.lastrowid
+                elif not fallen and key in self._fallen:
+                    db.execute("UPDATE incidents SET cleared_ts = ? WHERE id = ?",
+                               (timestamp, self._fallen.pop(key)))
+            elif sensor == "status":
+                if value == "Responding":
+                    db.execute(
+                        "UPDATE incidents SET responding_ts = ? "
+                        "WHERE site = ? AND floor = ? AND cleared_ts IS NULL AND responding_ts IS NULL",
+                        (timestamp, site, floor))
+            else:
+                try:
+                    rows.append((site, floor, worker, sensor, float(value), timestamp))
+                except ValueError:
+                    continue
+        db.executemany("INSERT INTO readings VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def run(self):
+        db = connect(self.path)
+        while True:
+            with self._cond:
+                if len(self._pending) < self.batch_size and not self._stop_event.is_set():
+                    self._cond.wait(self.flush_interval)
+                batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            if batch:
+                try:
+                    with db:    # One transaction per batch
+                        self._write_batch(db, batch)
+                    self.written += len(batch)
+                    self.batches += 1
+                except sqlite3.Error as e:
+                    self.errors += 1
+                    log.error("Archive write failed: %s", e)
+            elif self._stop_event.is_set():
+                break
+        db.close()
+
+    # Queries run on their own connection; WAL lets them read while the writer writes
+
+    def incidents(self, site=None, floor=None, worker=None, start=None, end=None, limit=1000):
+        where, args = [], []
+        for column, value in (("site", site), ("floor", floor), ("worker", worker)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                args.append(value)
+        if start is not None:
+            where.append("fallen_ts >= ?")
+            args.append(start)
+        if end is not None:
+            where.append("fallen_ts <= ?")
+            args.append(end)
+        sql = "SELECT site, floor, worker, fallen_ts, responding_ts, cleared_ts FROM incidents"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY fallen_ts DESC LIMIT ?"
+        args.append(limit)
+
+        db = connect(self.path)
+        try:
+            rows = db.execute(sql, args).fetchall()
+        finally:
+            db.close()
+        return [{
+            "site": site, "floor": floor, "worker": worker,
+            "fallen_ts": fallen_ts, "responding_ts": responding_ts, "cleared_ts": cleared_ts,
+            "seconds_to_response": None if responding_ts is None else responding_ts - fallen_ts,
+        } for site, floor, worker, fallen_ts, responding_ts, cleared_ts in rows]
+
+    def summary(self, site, floor, worker, start=None, end=None):
+        where = "site = ? AND floor = ? AND worker = ? AND ts >= ? AND ts <= ?"
+        args = (site, floor, worker,
+                float("-inf") if start is None else start,
+                float("inf") if end is None else end)
+        db = connect(self.path)
+        try:
+            sensors = {
+                sensor: {"count": count, "min": low, "max": high, "avg": avg, "last_ts": last}
+                for sensor, count, low, high, avg, last in db.execute(
+                    "SELECT sensor, COUNT(*), MIN(value), MAX(value), AVG(value), MAX(ts) "
+                    f"FROM readings WHERE {where} GROUP BY sensor", args)
+            }
+            falls = db.execute(
+                "SELECT COUNT(*) FROM incidents WHERE site = ? AND floor = ? AND worker = ? "
+                "AND fallen_ts >= ? AND fallen_ts <= ?", args).fetchone()[0]
+        finally:
+            db.close()
+        return {"site": site, "floor": floor, "worker": worker, "sensors": sensors, "incidents": falls}
@@ -0,0 +1,361 @@
+# Single-process asyncio run mode: MQTT, serial and HTTP on one event loop
+#
+# The default thread mode runs paho's loop_forever, a blocking serial
+# reader and the threaded Flask dev server side by side, and every
+# reading crosses threads (and the GIL) on its way to the store. Here the
+# event loop watches the MQTT socket, the serial port and the HTTP
+# listener itself, ingest work is handed over on AsyncLaneQueues, and
+# nothing waits on a lock. The apps switch with ASYNC_MODE.
+#
+# What stays on threads: disk writers (archive, telemetry log), the
+# Site A LoRa forwarder (stop-and-wait writes) and serial ports without
+# a file descriptor (Windows COM ports, loop://), which are read by a
+# SerialLineReader that only passes lines to the loop. On Windows the
+# loop must be a SelectorEventLoop for add_reader, see run_async().
+
+import asyncio
+import io
+import logging
+import os
+import sys
+import time
+from urllib.parse import unquote_to_bytes
+import paho.mqtt.client as mqtt
+import serial
+from serial_link import MAX_LINE, RateMeter, SerialLineReader, reader_stats
+
+CONSUME_BATCH = 64          # Items handled before a consumer lets other tasks run
+MAX_HEADER = 65536          # Longest HTTP request head accepted
+MAX_BODY = 1 << 20          # Largest HTTP request body accepted
+
+log = logging.getLogger(__name__)
+
+
+async def consume(lanes, handle, batch=CONSUME_BATCH):
+    """Calls handle(lane, item) for everything put on an AsyncLaneQueue."""
+    while True:
+        for _ in range(batch):
+            lane, item = await lanes.get()
+            try:
+                handle(lane, item)
+            except Exception:
+                log.exception("Failed to handle %r", item)
+        # get() does not suspend while items are waiting, so step aside
+        # now and then or a burst would starve the HTTP and MQTT tasks
+        await asyncio.sleep(0)
+
+
+class AsyncMqtt:
+    """Runs a paho client on the event loop instead of loop_forever().
+
+    paho keeps doing the protocol; the loop calls loop_read/loop_write
+    when its socket is ready and loop_misc (keepalive pings) once a
+    second. Reconnects with exponential backoff like loop_forever does.
+    """
+
+    def __init__(self, client, min_backoff=1, max_backoff=60):
+        self.client = client
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.connects = 0
+        self._loop = None
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_register_write
+        client.on_socket_unregister_write = self._on_unregister_write
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._loop.add_reader(sock, client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._loop.remove_reader(sock)
+        self._loop.remove_writer(sock)
+
+    def _on_register_write(self, client, userdata, sock):
+        self._loop.add_writer(sock, client.loop_write)
+
+    def _on_unregister_write(self, client, userdata, sock):
+        self._loop.remove_writer(sock)
+
+    async def run(self, host, port=1883, keepalive=60):
+        self._loop = asyncio.get_running_loop()
+        backoff = self.min_backoff
+        while True:
+            try:
+                # Blocks the loop for the TCP connect, only at start and after
+                # a drop. Must run here: it opens the socket on the loop.
+                if self.connects:
+                    self.client.reconnect()
+                else:
+                    self.client.connect(host, port, keepalive)
+                self.connects += 1
+            except OSError as e:
+                log.error("Failed to connect to MQTT broker at %s: %s", host, e)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            connected = False
+            while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+                connected = connected or self.client.is_connected()
+                await asyncio.sleep(1)
+            if connected:
+                log.warning("Disconnected from MQTT broker, reconnecting")
+                backoff = self.min_backoff
+            else:
+                log.error("No answer from MQTT broker at %s", host)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+
+class AsyncSerialReader:
+    """Hands each line from a serial port to on_line(raw bytes) on the loop.
+
+    Ports with a file descriptor (ttys and ptys) are watched by the loop
+    and read without blocking. Others are read by a SerialLineReader
+    thread that passes lines over with call_soon_threadsafe. stats() has
+    the same keys as SerialLineReader.stats().
+    """
+
+    def __init__(self, url, on_line, baudrate=9600, port=None, min_backoff=0.5, max_backoff=30):
+        self.url = url
+        self.on_line = on_line
+        self.baudrate = baudrate
+        self.port = port
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.thread = None              # SerialLineReader for ports without a descriptor
+
+        self.lines_read = 0
+        self.lines_dropped = 0
+        self.bytes_read = 0
+        self.reconnects = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_line_at = None
+        self.line_rate = RateMeter()
+        self._loop = None
+        self._fd = None
+        self._pending = b""
+        self._discarding = False
+        self._reopening = None
+
+    @property
+    def connected(self):
+        if self.thread is not None:
+            return self.thread.connected
+        return self._fd is not None
+
+    def stats(self):
+        if self.thread is not None:
+            return self.thread.stats()
+        return reader_stats(self)
+
+    def _error(self, message):
+        self.errors += 1
+        self.last_error = message
+        log.error(message)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        backoff = self.min_backoff
+        while self.port is None:
+            try:
+                self.port = serial.serial_for_url(self.url, self.baudrate, timeout=1)
+            except (serial.SerialException, OSError, ValueError) as e:
+                self._error(f"Failed to open serial port {self.url}: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+        try:
+            fd = self.port.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            fd = None
+        if fd is None or sys.platform == "win32":
+            on_line = lambda line: self._loop.call_soon_threadsafe(self.on_line, line)
+            self.thread = SerialLineReader(self.url, on_line, self.baudrate, port=self.port)
+            self.thread.start()
+            return
+        self._fd = fd
+        self._loop.add_reader(fd, self._readable)
+        log.info("Serial port %s opened", self.url)
+
+    def _dropped(self, message):
+        self._loop.remove_reader(self._fd)
+        self._fd = None
+        self._error(message)
+        if self._pending:
+            self.lines_dropped += 1
+            self._pending = b""
+        port, self.port = self.port, None
+        try:
+            port.close()
+        except Exception:
+            pass
+        self._reopening = self._loop.create_task(self._reopen())
+
+    async def _reopen(self):
+        await asyncio.sleep(self.min_backoff)
+        self.reconnects += 1
+        await self.run()
+
+    def _readable(self):
+        try:
+            data = os.read(self._fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._dropped(f"Serial port {self.url} dropped: {e}")
+            return
+        if not data:
+            self._dropped(f"Serial port {self.url} closed")
+            return
+        self.bytes_read += len(data)
+
+        lines = (self._pending + data).split(b"\n")
+        self._pending = lines.pop()
+        for line in lines:
+            if self._discarding:
+                self._discarding = False    # Tail of an oversized line
+                continue
+            self.lines_read += 1
+            self.last_line_at = time.monotonic()
+            self.line_rate.add()
+            try:
+                self.on_line(line + b"\n")
+            except Exception as e:
+                self.lines_dropped += 1
+                self._error(f"Failed to handle line from {self.url}: {e}")
+        if len(self._pending) >= MAX_LINE:
+            # No newline in sight, discard rather than grow forever
+            self.lines_dropped += 1
+            self._pending = b""
+            self._discarding = True
+
+
+class WsgiServer:
+    """HTTP/1.1 for a Flask app on the event loop.
+
+    Views run inline on the loop, so they have to be quick, which the
+    dashboard endpoints are (/api/data comes from the snapshot cache).
+    `streams` maps SSE paths to (broker, snapshot): the view still runs,
+    for its login check and headers, but the loop streams the updates
+    with EventBroker.astream instead of the view's blocking generator.
+    """
+
+    def __init__(self, app, streams=None):
+        self.app = app
+        self.streams = streams or {}
+        self.requests = 0
+        self.streaming = 0
+
+    async def serve(self, host, port):
+        self.host, self.port = host, port
+        server = await asyncio.start_server(self._connection, host, port, limit=MAX_HEADER)
+        log.info("Serving HTTP on %s:%d", host, port)
+        return server
+
+    def _environ(self, method, target, version, headers, body, peer):
+        path, _, query = target.partition("?")
+        environ = {
+            "REQUEST_METHOD": method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": unquote_to_bytes(path).decode("latin-1"),
+            "QUERY_STRING": query,
+            "SERVER_NAME": self.host,
+            "SERVER_PORT": str(self.port),
+            "SERVER_PROTOCOL": version,
+            "REMOTE_ADDR": peer[0] if peer else "",
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": False,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in headers:
+            key = name.upper().replace("-", "_")
+            if key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                environ[key] = value
+            else:
+                key = "HTTP_" + key
+                environ[key] = environ[key] + "," + value if key in environ else value
+        return environ
+
+    def _call(self, environ):
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [status, headers]
+
+        body = self.app(environ, start_response)
+        return started[0], started[1], body
+
+    async def _connection(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        try:
+            while await self._request(reader, writer, peer):
+                pass
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _request(self, reader, writer, peer):
+        """Serves one request, returns whether the connection stays open."""
+        head = await reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, version = lines[0].split(" ", 2)
+        headers = [tuple(part.strip() for part in line.split(":", 1)) for line in lines[1:] if ":" in line]
+        fields = {name.lower(): value for name, value in headers}
+        length = int(fields.get("content-length", 0))
+        if length > MAX_BODY:
+            writer.write(b"HTTP/1.1 413 Payload Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            return False
+        body = await reader.readexactly(length) if length else b""
+        connection = fields.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+
+        self.requests += 1
+        environ = self._environ(method, target, version, headers, body, peer)
+        status, response_headers, iterable = self._call(environ)
+        stream = self.streams.get(environ["PATH_INFO"]) if status.startswith("200") else None
+        try:
+            if stream is None:
+                chunks = b"".join(iterable)
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+        out = [f"HTTP/1.1 {status}\r\n"]
+        out.extend(f"{name}: {value}\r\n" for name, value in response_headers
+                   if name.lower() not in ("content-length", "connection"))
+        if stream is not None:
+            out.append("Connection: close\r\n\r\n")
+            writer.write("".join(out).encode("latin-1"))
+            await self._stream(writer, *stream)
+            return False
+        out.append(f"Content-Length: {len(chunks)}\r\n")
+        out.append("Connection: keep-alive\r\n\r\n" if keep_alive else "Connection: close\r\n\r\n")
+        writer.write("".join(out).encode("latin-1") + chunks)
+        await writer.drain()
+        return keep_alive
+
+    async def _stream(self, writer, broker, snapshot):
+        self.streaming += 1
+        messages = broker.astream(snapshot)
+        try:
+            async for message in messages:
+                writer.write(message.encode())
+                await writer.drain()
+        finally:
+            self.streaming -= 1
+            await messages.aclose()     # Unsubscribes now, not when collected
+
+
+def run_async(main):
+    """asyncio.run(main()). On Windows on a SelectorEventLoop, which add_reader needs."""
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    return asyncio.run(main())
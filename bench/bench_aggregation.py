@@ -0,0 +1,137 @@
+# Serial bytes and LoRa packets sent by Site A with and without the
+# aggregation window and deadband filter, for a synthetic site
+#
+#   python bench/bench_aggregation.py [--workers 200] [--seconds 300] [--window 10]
+#
+# Every worker publishes heartrate, battery, falldetect and status every
+# 2 s, like the worker sketches. Heart rates wander a few bpm per reading. About one worker in 500 falls per round
+# and gets back up a few rounds later; someone nearby reports
+# "Responding". Link time assumes 9600-baud 8N1 serial and one stop-and-wait round trip
+# (ROUND_TRIP seconds) per packet.
+
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aggregator import AggregationWindow
+from deadband import DeadbandFilter
+from frame_codec import encode_frames
+from priority import ALERT, classify_topic
+from serial_link import FRAME_BATCH
+
+PUBLISH_INTERVAL = 2.0
+BAUD = 9600
+BITS_PER_BYTE = 10
+ROUND_TRIP = 0.1            # Seconds of airtime + ACK per packet with no retries
+
+
+def publish(workers, seconds, seed=0):
+    """(time, lane, reading) per MQTT message, in arrival order."""
+    rng = random.Random(seed)
+    fallen = {}                 # worker -> rounds left on the ground
+    was_fallen = {}             # worker -> fall status last published, as the store has it
+    heartrate = {worker: rng.randint(70, 110) for worker in range(1, workers + 1)}
+    messages = []
+    for step in range(int(seconds / PUBLISH_INTERVAL)):
+        now = step * PUBLISH_INTERVAL
+        for worker in range(1, workers + 1):
+            floor = str(1 + worker % 5)
+            worker_id = str(worker)
+            if worker not in fallen and rng.random() < 0.002:
+                fallen[worker] = rng.randint(2, 6)
+            status = "Responding" if (worker - 1) in fallen else rng.choice(("online", "OK"))
+            heartrate[worker] = min(160, max(50, heartrate[worker] + rng.uniform(-3, 3)))
+            # Heart rate as the sketches print it, Arduino's String(float)
+            for sensor, value in (("heartrate", "%.2f" % heartrate[worker]),
+                                  ("battery", str(100 - step // 30)),
+                                  ("falldetect", "Fallen" if worker in fallen else "OK"),
+                                  ("status", status)):
+                lane = classify_topic(f"/{floor}/{worker_id}/{sensor}", value, was_fallen.get(worker))
+                messages.append((now, lane, (floor, worker_id, sensor, value)))
+            was_fallen[worker] = worker in fallen
+        for worker in list(fallen):
+            fallen[worker] -= 1
+            if not fallen[worker]:
+                del fallen[worker]
+    return messages
+
+
+def packets(readings, frames):
+    """Payloads the forwarder writes for readings queued together."""
+    if not frames:
+        return [f"/{f}/{w}/{s}/{v}" for f, w, s, v in readings]
+    payloads = []
+    for i in range(0, len(readings), FRAME_BATCH):
+        batch = sorted(readings[i:i + FRAME_BATCH], key=lambda reading: reading[:2])
+        payloads.extend(encode_frames(batch))
+    return payloads
+
+
+def run(messages, window, frames, deadband):
+    """Payloads the forwarder writes, in order, and the deadband filter used."""
+    deadband = DeadbandFilter() if deadband else None
+
+    def sent(readings, lane, now):
+        if deadband is None:
+            return readings
+        return [reading for reading in readings if deadband.check(reading, lane, now)]
+
+    if window is None:
+        alerts = [reading for now, lane, reading in messages if lane == ALERT and sent([reading], lane, now)]
+        telemetry = [reading for now, lane, reading in messages if lane != ALERT and sent([reading], lane, now)]
+        return packets(alerts, frames) + packets(telemetry, frames), deadband
+
+    payloads = []
+    aggregator = AggregationWindow(emit=None, window=window)
+    next_flush = window
+    for now, lane, reading in messages:
+        while now >= next_flush:
+            summaries = [r for r, _ in aggregator.flush()]
+            payloads.extend(packets(sent(summaries, None, next_flush), frames))
+            next_flush += window
+        if not aggregator.offer(reading, lane, now):
+            payloads.extend(packets(sent([reading], lane, now), frames))
+    payloads.extend(packets(sent([r for r, _ in aggregator.flush()], None, next_flush), frames))
+    return payloads, deadband
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=300)
+    parser.add_argument("--window", type=float, default=10.0)
+    args = parser.parse_args()
+
+    messages = publish(args.workers, args.seconds)
+    print(f"{args.workers} workers, {args.seconds:.0f} s, {len(messages)} readings, "
+          f"{sum(lane == ALERT for _, lane, _ in messages)} in the alert lane")
+    print(f"{'mode':>16} {'packets':>9} {'serial KB':>10} {'link s/s':>9} {'-packets':>9} {'-bytes':>8}")
+
+    baseline = None
+    suppression = []
+    for name, window, frames, deadband in (("per reading", None, False, False),
+                                           ("frames", None, True, False),
+                                           ("deadband", None, False, True),
+                                           (f"window {args.window:g}s", args.window, False, False),
+                                           ("window+frames", args.window, True, False),
+                                           ("all three", args.window, True, True)):
+        payloads, deadband = run(messages, window, frames, deadband)
+        if deadband is not None:
+            suppression.append((name, deadband.stats()))
+        serial_bytes = sum(len(p) + 1 for p in payloads)
+        link = (serial_bytes * BITS_PER_BYTE / BAUD + len(payloads) * ROUND_TRIP) / args.seconds
+        if baseline is None:
+            baseline = len(payloads), serial_bytes
+        print(f"{name:>16} {len(payloads):>9} {serial_bytes / 1024:>10.1f} {link:>9.2f} "
+              f"{1 - len(payloads) / baseline[0]:>9.1%} {1 - serial_bytes / baseline[1]:>8.1%}")
+    print("link s/s: seconds of link time per second of site time, above 1.0 the link falls behind")
+    for name, stats in suppression:
+        print(f"{name}: suppressed {stats['suppressed']}, forwarded {stats['forwarded']}, "
+              f"{stats['keyframes']} keyframes")
+
+
+if __name__ == "__main__":
+    main()
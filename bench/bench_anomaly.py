@@ -0,0 +1,46 @@
+# Throughput of the heart rate anomaly detector
+#
+#   python bench/bench_anomaly.py [--throughput 10000]
+#
+# update() over --throughput workers in turn. tests/test_anomaly.py checks
+# its detection rate, delay and false alarms on synthetic traces.
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from anomaly import AnomalyDetector
+
+INTERVAL = 2.0              # Seconds between samples, as the sketches publish
+
+
+def throughput(workers, rounds=20):
+    detector = AnomalyDetector()
+    rng = random.Random(0)
+    keys = [("SITE_A", str(1 + i % 20), str(i)) for i in range(workers)]
+    values = [rng.randint(60, 100) for _ in range(1000)]
+    for key in keys:
+        detector.update(key, 75, 0.0)
+    began = time.perf_counter()
+    for round_ in range(rounds):
+        for index, key in enumerate(keys):
+            detector.update(key, values[(index + round_) % 1000], round_ * INTERVAL)
+    elapsed = time.perf_counter() - began
+    return rounds * workers / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--throughput", type=int, default=10000, help="workers for the throughput run")
+    args = parser.parse_args()
+
+    rate = throughput(args.throughput)
+    print(f"update(): {rate:,.0f} samples/s over {args.throughput} workers ({1e6 / rate:.2f} us each)")
+
+
+if __name__ == "__main__":
+    main()
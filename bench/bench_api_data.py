@@ -0,0 +1,68 @@
+# Requests/sec for /api/data with and without the snapshot cache
+#
+#   python bench/bench_api_data.py [--seconds 2]
+#
+# "uncached" is the old handler: walk the store and jsonify it on every
+# request. "cached" is the current /api/data, plain and with gzip.
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import centralApp
+from flask import jsonify
+
+WORKER_COUNTS = (100, 1000, 10000)
+
+
+@centralApp.app.route("/bench/uncached")
+def uncached():
+    return jsonify(centralApp.store.snapshot())
+
+
+def fill_store(workers):
+    store = centralApp.store
+    for i in range(workers):
+        floor, worker = str(i // 50), str(i % 50)
+        store.update("SITE_A", floor, worker, "heartrate", str(60 + i % 40))
+        store.update("SITE_A", floor, worker, "battery", str(i % 100))
+        store.update("SITE_A", floor, worker, "falldetect", "OK")
+
+
+def rate(client, url, seconds, headers=None):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        count += 1
+    return count / (time.perf_counter() - start), len(response.data)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    centralApp.app.config["LOGIN_DISABLED"] = True
+    client = centralApp.app.test_client()
+
+    print(f"{'workers':>8} {'variant':>10} {'req/s':>10} {'bytes':>10}")
+    for workers in WORKER_COUNTS:
+        centralApp.store.__init__()
+        centralApp.snapshot_cache.__init__(centralApp.store)
+        fill_store(workers)
+        for name, url, headers in (
+            ("uncached", "/bench/uncached", None),
+            ("cached", "/api/data", None),
+            ("gzip", "/api/data", {"Accept-Encoding": "gzip"}),
+        ):
+            per_sec, size = rate(client, url, args.seconds, headers)
+            print(f"{workers:>8} {name:>10} {per_sec:>10.1f} {size:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# SQLite archive throughput with synthetic MQTT traffic
+#
+#   python bench/bench_archive.py [--messages 100000] [--workers 500]
+#
+# "record" is the cost seen by the ingest thread, "stored" is rows/s until
+# everything is committed. "row-commit" is the naive one-transaction-per-row
+# baseline for comparison.
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archive import SCHEMA, Archive, connect
+
+
+def traffic(count, workers, fall_rate=0.001):
+    # Same mix the sketches publish: heartrate + battery + falldetect every 2 s
+    rng = random.Random(1)
+    now = time.time()
+    fallen = set()
+    for i in range(count):
+        worker = i % workers
+        floor, worker_id = str(worker // 50), str(worker % 50)
+        sensor = ("heartrate", "battery", "falldetect")[(i // workers) % 3]
+        if sensor == "heartrate":
+            value = str(rng.randint(55, 140))
+        elif sensor == "battery":
+            value = str(rng.randint(5, 100))
+        elif worker in fallen or rng.random() < fall_rate:
+            fallen.symmetric_difference_update({worker})
+            value = "Fallen" if worker in fallen else "OK"
+        else:
+            value = "OK"
+        yield "SITE_A", floor, worker_id, sensor, value, now + i * 0.001
+
+
+def run_archive(messages, batch_size, path):
+    archive = Archive(path, batch_size=batch_size, max_pending=len(messages) + 1)
+    archive.start()
+    start = time.perf_counter()
+    for message in messages:
+        archive.record(*message)
+    recorded = time.perf_counter() - start
+    archive.stop()
+    stored = time.perf_counter() - start
+    return len(messages) / recorded, len(messages) / stored
+
+
+def run_row_commit(messages, path):
+    db = connect(path)
+    db.executescript(SCHEMA)
+    start = time.perf_counter()
+    for site, floor, worker, sensor, value, ts in messages:
+        with db:
+            db.execute("INSERT INTO readings VALUES (?, ?, ?, ?, ?, ?)",
+                       (site, floor, worker, sensor, 1.0 if value == "Fallen" else 0.0
+                        if value == "OK" else float(value), ts))
+    db.close()
+    return len(messages) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--workers", type=int, default=500)
+    args = parser.parse_args()
+    messages = list(traffic(args.messages, args.workers))
+
+    print(f"{'variant':>16} {'record msg/s':>14} {'stored msg/s':>14}")
+    with tempfile.TemporaryDirectory() as directory:
+        rate = run_row_commit(messages[:10000], os.path.join(directory, "naive.db"))
+        print(f"{'row-commit':>16} {'-':>14} {rate:>14.0f}")
+        for batch_size in (100, 500, 2000):
+            recorded, stored = run_archive(messages, batch_size, os.path.join(directory, f"b{batch_size}.db"))
+            print(f"{'batch ' + str(batch_size):>16} {recorded:>14.0f} {stored:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# centralApp in thread mode against ASYNC_MODE, under the same load
+#
+#   python bench/bench_async.py [--workers 200] [--interval 0.5] [--seconds 10] [--pollers 4]
+#
+# Gateway output for --workers workers is written to a pty that the app
+# reads as its RX LoRa port, while --pollers clients fetch /api/data over
+# keep-alive HTTP as fast as they can and one client holds /api/stream
+# open. Reported per mode: readings stored per second, end-to-end latency
+# (written to the pty -> pushed to dashboards) and /api/data latency.
+# Each mode runs in its own process so they start from the same state.
+# POSIX only (pty). Site A is not included, it needs an MQTT broker; the
+# ingest path it shares with centralApp is the same engine.
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def poll(port, stop, latency, errors):
+    connection = http.client.HTTPConnection("localhost", port, timeout=10)
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            connection.request("GET", "/api/data")
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(str(e))
+            connection.close()
+            connection = http.client.HTTPConnection("localhost", port, timeout=10)
+            continue
+        latency.record(time.perf_counter() - started)
+
+
+def listen(port, stop, counts):
+    # One dashboard on the push stream, counting the updates it gets
+    connection = http.client.HTTPConnection("localhost", port, timeout=30)
+    connection.request("GET", "/api/stream")
+    response = connection.getresponse()
+    while not stop.is_set():
+        line = response.fp.readline()
+        if not line:
+            break
+        if line.startswith(b"event: update"):
+            counts[0] += 1
+    connection.close()
+
+
+def child(args):
+    import asyncio
+    import centralApp
+    from log_setup import setup_logging
+    from priority import LatencyTracker
+    from tools.loadgen.__main__ import Sites, serial_sender
+    from tools.loadgen.recorder import DashboardProbe, Recorder
+    from tools.loadgen.runner import run
+    from tools.loadgen.targets import PtyTarget
+    from werkzeug.serving import make_server
+
+    setup_logging("WARNING", stream=open(os.devnull, "w"))
+    centralApp.app.config["LOGIN_DISABLED"] = True
+    target = PtyTarget()
+    port = free_port()
+
+    if args.mode == "async":
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_until_complete, daemon=True,
+                         args=(centralApp.serve_async(port=port, urls=[target.name]),)).start()
+    else:
+        centralApp.start_serial_reader(target.name)
+        server = make_server("localhost", port, centralApp.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    deadline = time.time() + 10
+    while True:
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+            break
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+    stop = threading.Event()
+    api_latency = LatencyTracker(100000)
+    errors = []
+    stream_updates = [0]
+    threads = [threading.Thread(target=poll, args=(port, stop, api_latency, errors), daemon=True)
+               for _ in range(args.pollers)]
+    threads.append(threading.Thread(target=listen, args=(port, stop, stream_updates), daemon=True))
+    for thread in threads:
+        thread.start()
+
+    recorder = Recorder()
+    probe = DashboardProbe(centralApp.broker)
+    probe.start()
+    model = Sites(["SITE_A"], args.workers, 5, 0.001, 0)
+    run(model, serial_sender(target, recorder, probe, frames=False), recorder, args.interval, args.seconds)
+    time.sleep(1.0)     # Let the app finish what is queued
+    stop.set()
+
+    stored = sum(tracker.count for tracker in centralApp.store_latency.values())
+    print(json.dumps({
+        "readings_sent_per_s": recorder.readings / recorder.elapsed(),
+        "readings_stored_per_s": stored / recorder.elapsed(),
+        "end_to_end": probe.latency.stats(),
+        "api_data": api_latency.stats(),
+        "api_data_per_s": api_latency.count / recorder.elapsed(),
+        "api_errors": len(errors),
+        "stream_updates": stream_updates[0],
+    }))
+    sys.stdout.flush()
+    os._exit(0)     # Daemon threads are blocked in socket and pty reads
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.5, help="seconds between a worker's rounds")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--pollers", type=int, default=4, help="clients polling /api/data")
+    parser.add_argument("--mode", choices=("thread", "async"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        child(args)
+        return
+
+    print(f"{args.workers} workers every {args.interval} s "
+          f"({args.workers * 4 / args.interval:.0f} readings/s), {args.pollers} pollers, {args.seconds} s")
+    print(f"{'mode':>7} {'sent/s':>8} {'stored/s':>9} {'e2e p50':>8} {'e2e p99':>8} "
+          f"{'api/s':>7} {'api p50':>8} {'api p99':>8} {'errors':>7} {'pushed':>7}")
+    for mode in ("thread", "async"):
+        output = subprocess.run([sys.executable, __file__, "--mode", mode] + sys.argv[1:],
+                                capture_output=True, text=True, cwd=ROOT)
+        if output.returncode != 0:
+            print(f"{mode:>7} failed:\n{output.stderr}")
+            continue
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        e2e, api = result["end_to_end"], result["api_data"]
+        print(f"{mode:>7} {result['readings_sent_per_s']:>8.0f} {result['readings_stored_per_s']:>9.0f} "
+              f"{e2e.get('p50_ms', 0):>7.1f}ms {e2e.get('p99_ms', 0):>6.1f}ms "
+              f"{result['api_data_per_s']:>7.0f} {api.get('p50_ms', 0):>6.1f}ms {api.get('p99_ms', 0):>6.1f}ms "
+              f"{result['api_errors']:>7} {result['stream_updates']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# Readings delivered per LoRa packet and per second for frame_codec against
+# the one-ASCII-line-per-reading format
+#
+#   python bench/bench_frame_codec.py [--workers 20] [--rounds 50]
+#
+# Each round is one 2 s publish cycle of the worker sketches: heartrate,
+# battery, falldetect and status for every worker. Serial time is what the
+# payload lines take to cross a 9600-baud 8N1 link (10 bits a byte). Every
+# payload is one LoRa packet and one stop-and-wait round trip, so readings
+# per packet is the multiplier on what the radio link can carry.
+#
+# tests/test_frame_codec.py checks the wire format, round trips and
+# corrupted frames.
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from frame_codec import encode_frames
+
+BAUD = 9600
+BITS_PER_BYTE = 10          # 8N1
+
+
+def publish_round(workers, rng):
+    readings = []
+    for worker in range(1, workers + 1):
+        floor = str(1 + worker % 3)
+        worker = str(worker)
+        readings.append((floor, worker, "heartrate", str(rng.randint(60, 140))))
+        readings.append((floor, worker, "battery", str(rng.randint(0, 100))))
+        readings.append((floor, worker, "falldetect", "Fallen" if rng.random() < 0.01 else "OK"))
+        readings.append((floor, worker, "status", rng.choice(("online", "OK", "Responding"))))
+    return readings
+
+
+def measure(name, encode, rounds):
+    start = time.perf_counter()
+    payloads = [p for readings in rounds for p in encode(readings)]
+    elapsed = time.perf_counter() - start
+
+    readings = sum(len(r) for r in rounds)
+    serial_bytes = sum(len(p) + 1 for p in payloads)
+    serial_seconds = serial_bytes * BITS_PER_BYTE / BAUD
+    print(f"{name:>8} {len(payloads):>9} {readings / len(payloads):>13.2f} "
+          f"{serial_bytes / readings:>14.1f} {readings / serial_seconds:>15.0f} "
+          f"{readings / elapsed:>13.0f}")
+
+
+def ascii_lines(readings):
+    return [f"/{floor}/{worker}/{sensor}/{value}" for floor, worker, sensor, value in readings]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    rounds = [publish_round(args.workers, rng) for _ in range(args.rounds)]
+
+    print(f"{'format':>8} {'packets':>9} {'readings/pkt':>13} {'serial B/read':>14} "
+          f"{'readings/s@9600':>15} {'encode/s':>13}")
+    measure("ascii", ascii_lines, rounds)
+    measure("frames", encode_frames, rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# Several RX LoRa gateways at full line rate into one centralApp
+#
+#   python bench/bench_gateways.py [--gateways 4] [--seconds 10] [--baud 9600] [--async]
+#
+# Each gateway is a pty written by its own thread as fast as a serial
+# port at --baud (8N1, so baud/10 bytes per second) would deliver, with
+# the gateway output for a different site on each. centralApp reads them
+# all at once, in thread mode or with --async on one event loop. Checks
+# that every line written was read, none dropped, no serial errors, and
+# that every reading sent reached the store; exits with status 1 if not.
+# Also prints each gateway's line rate and line-to-store lag. POSIX only.
+
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import centralApp
+from log_setup import setup_logging
+from tools.loadgen.model import SiteModel, gateway_packet, readings
+from tools.loadgen.targets import PtyTarget
+
+SETTLE = 2.0        # Seconds allowed for the app to catch up after the last write
+
+
+def write_at_line_rate(target, site, seed, workers, seconds, bytes_per_s, sent):
+    # Readings in ASCII payloads, one LoRa packet each, paced like the UART
+    model = SiteModel(workers, seed=seed)
+    started = time.perf_counter()
+    due = started
+    while time.perf_counter() - started < seconds:
+        for reading in readings(model.round()):
+            packet = gateway_packet(site, "/%s/%s/%s/%s" % reading)
+            target.write(packet)
+            sent["lines"] += packet.count("\n")
+            sent["readings"] += 1
+            due += len(packet) / bytes_per_s
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if time.perf_counter() - started >= seconds:
+                return
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gateways", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=20, help="simulated workers per site")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--baud", type=int, default=9600)
+    parser.add_argument("--async", dest="use_async", action="store_true", help="read on one asyncio loop")
+    args = parser.parse_args()
+
+    setup_logging("WARNING", stream=open(os.devnull, "w"))
+    centralApp.app.config["LOGIN_DISABLED"] = True
+    targets = [PtyTarget() for _ in range(args.gateways)]
+    sites = ["SITE_" + chr(ord("A") + i) for i in range(args.gateways)]
+    if args.use_async:
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_until_complete, daemon=True,
+                         args=(centralApp.serve_async(port=0, urls=[t.name for t in targets]),)).start()
+    else:
+        for target in targets:
+            centralApp.start_serial_reader(target.name)
+    time.sleep(0.5)     # Let the readers open their ports
+
+    sent = {target.name: {"lines": 0, "readings": 0} for target in targets}
+    writers = [threading.Thread(target=write_at_line_rate,
+                                args=(target, site, seed, args.workers, args.seconds, args.baud / 10,
+                                      sent[target.name]))
+               for seed, (target, site) in enumerate(zip(targets, sites))]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    deadline = time.time() + SETTLE
+    while time.time() < deadline and (len(centralApp.ingest_queue) or
+                                      any(g.reader.lines_read < sent[url]["lines"]
+                                          for url, g in centralApp.gateways.items())):
+        time.sleep(0.05)
+
+    print(f"{args.gateways} gateways at {args.baud} baud for {args.seconds} s, "
+          f"{'async' if args.use_async else 'thread'} mode")
+    print(f"{'gateway':<14} {'written':>8} {'read':>8} {'dropped':>8} {'errors':>7} {'lines/s':>8} "
+          f"{'lag p50':>8} {'lag p99':>8}")
+    failures = []
+    for site, target in zip(sites, targets):
+        gateway = centralApp.gateways[target.name]
+        stats = gateway.stats()
+        lag = stats["lag"]
+        written = sent[target.name]["lines"]
+        print(f"{site:<14} {written:>8} {stats['lines_read']:>8} {stats['lines_dropped']:>8} "
+              f"{stats['errors']:>7} {written / args.seconds:>8.1f} "
+              f"{lag.get('p50_ms', 0):>6.1f}ms {lag.get('p99_ms', 0):>6.1f}ms")
+        if stats["lines_read"] != written or stats["lines_dropped"] or stats["errors"]:
+            failures.append(site)
+
+    readings_sent = sum(counts["readings"] for counts in sent.values())
+    readings_stored = sum(tracker.count for tracker in centralApp.store_latency.values())
+    print(f"readings sent {readings_sent}, stored {readings_stored}, "
+          f"ingest queue dropped {centralApp.ingest_queue.dropped}")
+    if readings_stored != readings_sent or centralApp.ingest_queue.dropped:
+        failures.append("store")
+    if failures:
+        print("FAILED: " + ", ".join(failures))
+        os._exit(1)
+    print("OK: no lines dropped")
+    os._exit(0)     # Reader threads are blocked in pty reads
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# Cost of LivenessTracker.tick() and seen() against a scan of every worker
+#
+#   python bench/bench_liveness.py [--workers 10000,100000] [--seconds 30] [--silent 0.01]
+#
+# Virtual time: every worker reports heartrate, battery and falldetect
+# every 2 s (spread over the interval, like the sketches), with the Site A
+# timeouts (stale after 10 s, offline after 60 s). After 5 s a --silent
+# fraction of the workers stops reporting. Each 0.5 s tick the tracker
+# advances its wheel; "scan" is the obvious alternative, comparing every
+# (worker, sensor) last-seen time against the timeouts. Per tick both are
+# timed, split into ticks where nothing expires and ticks where the silent
+# workers go stale.
+
+import argparse
+import gc
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from liveness import LivenessTracker, TICK
+
+SENSORS = ("heartrate", "battery", "falldetect")
+TIMEOUTS = {sensor: (10, 60) for sensor in SENSORS}
+INTERVAL = 2.0
+SILENCE_AT = 5.0
+
+
+def scan(last_seen, now, states):
+    # What a tracker without a wheel does each tick: look at everything
+    changed = 0
+    for entry, seen in last_seen.items():
+        silent = now - seen
+        state = 2 if silent >= 60 else 1 if silent >= 10 else 0
+        if states.get(entry, 0) != state:
+            states[entry] = state
+            changed += 1
+    return changed
+
+
+def run(workers, seconds, silent_fraction):
+    # Collector pauses would land in whichever timing they fall in, as in timeit
+    gc.collect()
+    gc.disable()
+    try:
+        return simulate(workers, seconds, silent_fraction)
+    finally:
+        gc.enable()
+
+
+def simulate(workers, seconds, silent_fraction):
+    changes = []
+    tracker = LivenessTracker(TIMEOUTS, lambda key, state, silent: changes.append(state))
+    start = time.time()
+    keys = [("SITE_A", str(1 + i % 5), str(i)) for i in range(workers)]
+    silent_from = int(workers * (1 - silent_fraction))
+    last_seen = {}
+    scan_states = {}
+    per_tick = int(workers * TICK / INTERVAL)
+
+    seen_time = 0.0
+    seen_calls = 0
+    quiet = {"wheel": [], "scan": []}
+    expiring = {"wheel": [], "scan": []}
+    ticks = int(seconds / TICK)
+    for step in range(1, ticks + 1):
+        now = start + step * TICK
+        # This tick's share of the workers report
+        first = (step * per_tick) % workers
+        batch = [keys[(first + i) % workers] for i in range(per_tick)]
+        if now - start >= SILENCE_AT:
+            batch = [key for key in batch if int(key[2]) < silent_from]
+        began = time.perf_counter()
+        for key in batch:
+            for sensor in SENSORS:
+                tracker.seen(key, sensor, now)
+        seen_time += time.perf_counter() - began
+        seen_calls += len(batch) * len(SENSORS)
+        for key in batch:
+            for sensor in SENSORS:
+                last_seen[(key, sensor)] = now
+
+        before = len(changes)
+        began = time.perf_counter()
+        tracker.tick(now)
+        wheel = time.perf_counter() - began
+        began = time.perf_counter()
+        scanned = scan(last_seen, now, scan_states)
+        scanning = time.perf_counter() - began
+        bucket = expiring if len(changes) > before or scanned else quiet
+        bucket["wheel"].append(wheel)
+        bucket["scan"].append(scanning)
+    return {
+        "seen_us": seen_time / seen_calls * 1e6,
+        "quiet": quiet,
+        "expiring": expiring,
+        "changes": len(changes),
+        "tracked": len(tracker),
+        "states": tracker.counts(),
+    }
+
+
+def mean_ms(samples):
+    return sum(samples) / len(samples) * 1000 if samples else float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default="10000,100000")
+    parser.add_argument("--seconds", type=float, default=30.0, help="virtual seconds to simulate")
+    parser.add_argument("--silent", type=float, default=0.01, help="fraction of workers that go quiet")
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'seen us':>8} {'quiet ticks':>12} {'wheel ms':>9} {'scan ms':>9} "
+          f"{'exp. ticks':>11} {'wheel ms':>9} {'scan ms':>9} {'changes':>8}")
+    for workers in (int(count) for count in args.workers.split(",")):
+        result = run(workers, args.seconds, args.silent)
+        quiet, expiring = result["quiet"], result["expiring"]
+        print(f"{workers:>8} {result['seen_us']:>8.2f} {len(quiet['wheel']):>12} "
+              f"{mean_ms(quiet['wheel']):>9.3f} {mean_ms(quiet['scan']):>9.3f} "
+              f"{len(expiring['wheel']):>11} {mean_ms(expiring['wheel']):>9.3f} "
+              f"{mean_ms(expiring['scan']):>9.3f} {result['changes']:>8}")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
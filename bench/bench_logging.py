@@ -0,0 +1,76 @@
+# Per-message cost of centralApp.handle_message with the old print()
+# output against the queued logging setup
+#
+#   python bench/bench_logging.py [--messages 2000]
+#
+# "print" is the old behaviour: each reading also printed the whole store
+# ("[INFO] Updated data_store: ..."). "logging INFO" is the current default,
+# "logging DEBUG" additionally logs one line per reading. Output goes to
+# os.devnull, so this is formatting cost only; a terminal is slower still.
+
+import argparse
+import contextlib
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import centralApp
+from log_setup import setup_logging
+
+SIZES = (1000, 10000)
+
+
+def fill(workers):
+    centralApp.store = store = centralApp.WorkerStateStore()
+    for i in range(workers):
+        floor, worker = str(1 + i % 10), str(i)
+        store.update("SITE_A", floor, worker, "heartrate", "80")
+        store.update("SITE_A", floor, worker, "battery", "90")
+
+
+def lines(workers, count):
+    return [f"Got valid message: From SITE_A: /{1 + i % 10}/{i % workers}/heartrate/{60 + i % 80}\r\n".encode()
+            for i in range(count)]
+
+
+def old_handle(raw, out):
+    line = centralApp.handle_message(raw)
+    print(f"[INFO] Updated data_store: {centralApp.store.snapshot()}", file=out)
+    return line
+
+
+def per_message_us(handle, messages):
+    start = time.perf_counter()
+    for raw in messages:
+        handle(raw)
+    return (time.perf_counter() - start) / len(messages) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2000)
+    args = parser.parse_args()
+
+    devnull = open(os.devnull, "w")
+    print(f"{'workers':>8} {'output':>14} {'us/message':>11}")
+    for workers in SIZES:
+        fill(workers)
+        messages = lines(workers, args.messages)
+
+        setup_logging("INFO", stream=devnull)
+        with contextlib.redirect_stdout(devnull):
+            old = per_message_us(lambda raw: old_handle(raw, devnull), messages)
+        info = per_message_us(centralApp.handle_message, messages)
+        logging.getLogger().setLevel("DEBUG")
+        debug = per_message_us(centralApp.handle_message, messages)
+
+        print(f"{workers:>8} {'print':>14} {old:>11.1f}")
+        print(f"{workers:>8} {'logging INFO':>14} {info:>11.1f}")
+        print(f"{workers:>8} {'logging DEBUG':>14} {debug:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# Lines/sec for lora_protocol.parse_line against the old str-based parsing
+#
+#   python bench/bench_lora_protocol.py [--lines 200000]
+#
+# "gateway" is the mix LORA_CENTRAL.INO prints for each packet (7 lines),
+# "corrupted" is the same mix with random byte flips, drops and inserts,
+# which parse_line must classify without raising.
+#
+# tests/test_lora_protocol.py checks what the lines parse to.
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lora_protocol import KIND_NAMES, parse_line
+
+PACKET = (
+    b"Received Checksum: 3265\r\n",
+    b"Calculated Checksum: 3265\r\n",
+    b"Got valid message: From SITE_A: /1/2/heartrate/75\r\n",
+    b"RSSI: -41\r\n",
+    b"Sending: From CENTRAL To SITE_A: ACK\r\n",
+    b"With checksum: 2011\r\n",
+    b"Sent a reply\r\n",
+)
+
+
+def old_parse(raw):
+    # What read_ser6 + handle_message did before lora_protocol
+    message = raw.decode("utf-8", errors="replace").strip()
+    if "Got valid message:" not in message:
+        return None
+    if "From " in message and ":" in message:
+        _, _, after_site = message.partition("From ")
+        site_info, _, topic_payload = after_site.partition(":")
+        site_info = site_info.strip()
+        topic_parts = topic_payload.strip().strip("/").split("/")
+        if len(topic_parts) == 4:
+            return site_info, topic_parts
+    return None
+
+
+def corrupt(lines, seed=0):
+    rng = random.Random(seed)
+    for raw in lines:
+        data = bytearray(raw)
+        for _ in range(rng.randint(1, 4)):
+            op = rng.randint(0, 2)
+            pos = rng.randrange(len(data)) if data else 0
+            if op == 0 and data:
+                data[pos] = rng.randrange(256)
+            elif op == 1 and data:
+                del data[pos]
+            else:
+                data.insert(pos, rng.randrange(256))
+        yield bytes(data)
+
+
+def rate(parse, lines):
+    start = time.perf_counter()
+    for raw in lines:
+        parse(raw)
+    return len(lines) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=200000)
+    args = parser.parse_args()
+
+    gateway = [PACKET[i % len(PACKET)] for i in range(args.lines)]
+    corrupted = list(corrupt(gateway))
+
+    print(f"{'input':>10} {'parser':>12} {'lines/s':>12}")
+    for name, lines in (("gateway", gateway), ("corrupted", corrupted)):
+        print(f"{name:>10} {'old':>12} {rate(old_parse, lines):>12.0f}")
+        print(f"{name:>10} {'parse_line':>12} {rate(parse_line, lines):>12.0f}")
+
+    counts = [0] * len(KIND_NAMES)
+    for raw in corrupted:
+        counts[parse_line(raw).kind] += 1
+    print("corrupted lines by kind:", dict(zip(KIND_NAMES, counts)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# Cost of recording one metric event, and of one /metrics scrape
+#
+#   python bench/bench_metrics.py [--events 1000000] [--threads 4]
+#
+# The loop overhead of an empty call is subtracted, so the numbers are what
+# instrumentation adds to the ingest path.
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import Registry
+
+
+def per_event_ns(fn, events):
+    start = time.perf_counter()
+    for _ in range(events):
+        fn()
+    return (time.perf_counter() - start) / events * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=1000000)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    registry = Registry()
+    counter = registry.counter("bench_total", "bench", ("sensor",))
+    histogram = registry.histogram("bench_seconds", "bench")
+    labels = ("heartrate",)
+
+    def empty():
+        pass
+
+    base = per_event_ns(empty, args.events)
+    cases = (
+        ("counter.inc", lambda: counter.inc(labels)),
+        ("histogram.observe", lambda: histogram.observe(0.00042)),
+    )
+    print(f"{'event':>18} {'ns/event':>9}")
+    for name, fn in cases:
+        print(f"{name:>18} {per_event_ns(fn, args.events) - base:>9.0f}")
+
+    # Several threads recording at once: each has its own shard, no lock
+    def record():
+        for _ in range(args.events // args.threads):
+            counter.inc(labels)
+            histogram.observe(0.00042)
+
+    threads = [threading.Thread(target=record) for _ in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    per_pair = elapsed / (args.events // args.threads * args.threads) * 1e9
+    print(f"{args.threads} threads: {per_pair:.0f} ns per inc+observe pair, wall clock")
+
+    start = time.perf_counter()
+    text = registry.render()
+    print(f"scrape: {(time.perf_counter() - start) * 1e3:.2f} ms, {len(text)} bytes")
+    expected = args.events + args.events // args.threads * args.threads
+    assert f'bench_total{{sensor="heartrate"}} {expected}' in text, "counts lost across threads"
+
+
+if __name__ == "__main__":
+    main()
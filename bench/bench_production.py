@@ -0,0 +1,152 @@
+# /api/data throughput: the Flask dev server against production.py workers
+#
+#   python bench/bench_production.py [--workers 200] [--http-workers 1,2,4] [--clients 8] [--seconds 5]
+#
+# centralApp is fed --workers simulated workers (4 readings each every
+# 0.5 s) over a pty, so snapshots keep changing while --clients client
+# processes fetch /api/data (gzip, keep-alive) as fast as they can.
+# "dev" is the threaded dev server that app.run() starts; "prod N" is
+# production.py with N HTTP worker processes serving from the shared
+# snapshot file. Each server runs in its own process tree. POSIX only.
+#
+# Extra HTTP workers only pay off with CPUs to run them on: on a single
+# CPU the client processes, the ingest process and the workers all share
+# it, so look at the numbers next to os.cpu_count() in the header.
+
+import argparse
+import http.client
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def serve(args):
+    # Runs as a child: the app, its feed, and the dev server or production.py
+    import centralApp
+    from log_setup import setup_logging
+    from tools.loadgen.model import SiteModel, gateway_packet, readings
+    from tools.loadgen.targets import PtyTarget
+
+    target = PtyTarget()
+    centralApp.PORTS = [target.name]
+    centralApp.LOG_LEVEL = "WARNING"
+    centralApp.LOG_LEVELS = {}
+    centralApp.app.config["LOGIN_DISABLED"] = True
+
+    def feed():
+        model = SiteModel(args.workers)
+        while True:
+            for reading in readings(model.round()):
+                target.write(gateway_packet("SITE_A", "/%s/%s/%s/%s" % reading))
+            time.sleep(0.5)
+    threading.Thread(target=feed, daemon=True).start()
+
+    if args.serve == "dev":
+        from werkzeug.serving import make_server
+        setup_logging("WARNING", stream=open(os.devnull, "w"))
+        centralApp.start_services()
+        centralApp.start_ingest()
+        make_server("localhost", args.port, centralApp.app, threaded=True).serve_forever()
+    else:
+        import production
+        from shared_snapshot import default_path
+        production.main(["central", "--workers", args.serve, "--port", str(args.port),
+                         "--snapshot", default_path("bench")])
+
+
+def client(port, seconds, results):
+    connection = http.client.HTTPConnection("localhost", port, timeout=10)
+    count = errors = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        try:
+            connection.request("GET", "/api/data", headers={"Accept-Encoding": "gzip"})
+            response = connection.getresponse()
+            response.read()
+            if response.status == 200:
+                count += 1
+            else:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+            connection = http.client.HTTPConnection("localhost", port, timeout=10)
+    results.put((count, errors))
+
+
+def wait_ready(port, timeout=15):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            connection = http.client.HTTPConnection("localhost", port, timeout=2)
+            connection.request("GET", "/api/data")
+            if connection.getresponse().status == 200:
+                return
+        except (OSError, http.client.HTTPException):
+            pass
+        if time.time() > deadline:
+            raise RuntimeError(f"server on port {port} did not come up")
+        time.sleep(0.1)
+
+
+def run(mode, args):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, __file__, "--serve", mode, "--port", str(port),
+                               "--workers", str(args.workers)],
+                              cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(port)
+        time.sleep(1.0)     # Let the feed fill the store
+        results = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=client, args=(port, args.seconds, results))
+                   for _ in range(args.clients)]
+        for process in clients:
+            process.start()
+        totals = [results.get() for _ in clients]
+        for process in clients:
+            process.join()
+    finally:
+        server.terminate()
+        server.wait()
+    return sum(count for count, _ in totals) / args.seconds, sum(errors for _, errors in totals)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=200, help="simulated workers feeding the app")
+    parser.add_argument("--http-workers", default="1,2,4", help="production.py worker counts to try")
+    parser.add_argument("--clients", type=int, default=8, help="client processes polling /api/data")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args)
+        return
+
+    print(f"{args.workers} simulated workers, {args.clients} clients, {args.seconds} s, "
+          f"{os.cpu_count()} CPUs")
+    print(f"{'server':>8} {'req/s':>8} {'errors':>7}")
+    modes = ["dev"] + [count for count in args.http_workers.split(",") if count]
+    for mode in modes:
+        rate, errors = run(mode, args)
+        label = mode if mode == "dev" else f"prod {mode}"
+        print(f"{label:>8} {rate:>8.0f} {errors:>7}")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
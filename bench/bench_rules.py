@@ -0,0 +1,159 @@
+# Cost of one RulesEngine.evaluate() pass against a loop over every worker
+#
+#   python bench/bench_rules.py [--workers 100,1000,10000,100000] [--passes 20]
+#
+# Every worker has a heart rate, a battery level and a fall status, with
+# the default rules of the apps (heart rate above 120 or below 50 for
+# 30 s, battery below 15 %, fall with no response for 60 s). Between
+# passes 1 % of the workers get a new reading, so a few alerts fire and
+# clear each pass as they would live. "loop" is the same rules written
+# the obvious way: per worker and rule, in Python, over dicts. Both are
+# checked to fire the same alerts.
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rules import FallUnanswered, RulesEngine, Threshold
+
+RULES = (
+    Threshold("heartrate_high", "heartrate", above=120, hold=30),
+    Threshold("heartrate_low", "heartrate", below=50, hold=30),
+    Threshold("battery_low", "battery", below=15),
+    FallUnanswered("fall_unanswered", within=60),
+)
+STEP = 1.0          # Virtual seconds between passes
+CHANGING = 0.01     # Fraction of workers with a new reading each pass
+
+
+class LoopRules:
+    """RULES evaluated one worker at a time."""
+
+    def __init__(self):
+        self.workers = {}       # key -> {"heartrate", "battery", "fallen_at"}
+        self.responding = {}    # (site, floor) -> last "Responding"
+        self.since = {}         # (rule name, key) -> condition met since
+        self.firing = set()
+
+    def update(self, key, sensor, value, timestamp):
+        worker = self.workers.setdefault(key, {"heartrate": None, "battery": None, "fallen_at": None})
+        if sensor == "falldetect":
+            if not value:
+                worker["fallen_at"] = None
+            elif worker["fallen_at"] is None:
+                worker["fallen_at"] = timestamp
+        elif sensor == "status":
+            if value == "Responding":
+                self.responding[key[:2]] = timestamp
+        else:
+            worker[sensor] = value
+
+    def evaluate(self, now):
+        changes = []
+        for key, worker in self.workers.items():
+            heartrate, battery, fallen_at = worker["heartrate"], worker["battery"], worker["fallen_at"]
+            responded = self.responding.get(key[:2])
+            for rule in RULES:
+                if rule.name == "heartrate_high":
+                    met = heartrate is not None and heartrate > 120
+                elif rule.name == "heartrate_low":
+                    met = heartrate is not None and heartrate < 50
+                elif rule.name == "battery_low":
+                    met = battery is not None and battery < 15
+                else:
+                    met = (fallen_at is not None and now - fallen_at >= 60 and
+                           (responded is None or responded < fallen_at))
+                entry = (rule.name, key)
+                if met:
+                    since = self.since.setdefault(entry, now)
+                    firing = now - since >= rule.hold
+                else:
+                    self.since.pop(entry, None)
+                    firing = False
+                if firing != (entry in self.firing):
+                    if firing:
+                        self.firing.add(entry)
+                    else:
+                        self.firing.discard(entry)
+                    changes.append((rule.name, key, firing))
+        return changes
+
+
+def reading(rng):
+    # Mostly normal values, now and then one that trips a rule
+    sensor = rng.choice(("heartrate", "battery", "falldetect", "status"))
+    if sensor == "heartrate":
+        return sensor, float(rng.choice((rng.randint(60, 110),) * 20 + (130, 45)))
+    if sensor == "battery":
+        return sensor, float(rng.choice((rng.randint(20, 100),) * 20 + (10,)))
+    if sensor == "falldetect":
+        return sensor, float(rng.random() < 0.05)
+    return sensor, "Responding" if rng.random() < 0.05 else "OK"
+
+
+def run(workers, passes):
+    rng = random.Random(workers)
+    engine = RulesEngine(RULES)
+    loop = LoopRules()
+    keys = [("SITE_A", str(1 + i % 20), str(i)) for i in range(workers)]
+    now = 1_000_000.0
+
+    def feed(key, sensor, value):
+        engine.update(key, sensor, value, now)
+        loop.update(key, sensor, value, now)
+
+    for key in keys:
+        feed(key, "heartrate", float(rng.randint(60, 110)))
+        feed(key, "battery", float(rng.randint(20, 100)))
+        feed(key, "falldetect", 0.0)
+
+    timings = {"vector": [], "loop": []}
+    events = 0
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(passes):
+            now += STEP
+            for key in rng.sample(keys, max(1, int(workers * CHANGING))):
+                feed(key, *reading(rng))
+            began = time.perf_counter()
+            fired = engine.evaluate(now)
+            timings["vector"].append(time.perf_counter() - began)
+            began = time.perf_counter()
+            expected = loop.evaluate(now)
+            timings["loop"].append(time.perf_counter() - began)
+            got = sorted((event["rule"], (event["site"], event["floor"], event["worker"]),
+                          event["state"] == "fired") for event in fired)
+            if got != sorted(expected):
+                raise SystemExit(f"{workers} workers: engine and loop disagree")
+            events += len(fired)
+    finally:
+        gc.enable()
+    return timings, events
+
+
+def median_ms(samples):
+    return sorted(samples)[len(samples) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default="100,1000,10000,100000")
+    parser.add_argument("--passes", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'vector ms':>10} {'loop ms':>9} {'speedup':>8} {'events':>7}")
+    for workers in (int(count) for count in args.workers.split(",")):
+        timings, events = run(workers, args.passes)
+        vector, loop = median_ms(timings["vector"]), median_ms(timings["loop"])
+        print(f"{workers:>8} {vector:>10.3f} {loop:>9.3f} {loop / vector:>7.1f}x {events:>7}")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# /api/summary: incrementally kept counts against adding up the store
+#
+#   python bench/bench_summary.py [--sites 50] [--floors 20] [--workers 50] [--updates 100000]
+#
+# Fills centralApp's store through store_reading with every worker's heart
+# rate, battery and fall status, then applies random readings, with now
+# and then a worker going stale, offline or coming back through
+# on_liveness_change (tests/test_summary.py checks the served summary
+# against a recount of the store the same way). Then times:
+#   observe    FloorSummary.observe() per reading
+#   summary    GET /api/summary after a change (a rebuild from the counters)
+#   recompute  the same numbers by walking the store
+#   api_data   GET /api/data, what the dashboard added up before
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import centralApp
+from liveness import LIVE, OFFLINE, STALE
+from log_setup import setup_logging
+
+REPEATS = 50        # Timed /api/summary requests
+OBSERVED = 10000    # Records timed through observe()
+
+
+def recompute(store, low_battery):
+    # Brute force: the counts of every floor, site and overall, from scratch
+    def empty():
+        return {"workers": 0, "fallen": 0, "low_battery": 0, "stale": 0, "offline": 0, "bpm": []}
+
+    total = empty()
+    sites = {}
+    for record in store.records():
+        site = sites.setdefault(record.site, dict(empty(), floors={}))
+        floor = site["floors"].setdefault(record.floor, empty())
+        for counts in (total, site, floor):
+            counts["workers"] += 1
+            counts["fallen"] += bool(record.fallen)
+            counts["low_battery"] += record.battery is not None and record.battery < low_battery
+            counts["stale"] += record.liveness == STALE
+            counts["offline"] += record.liveness == OFFLINE
+            if record.heartrate is not None and record.liveness != OFFLINE:
+                counts["bpm"].append(record.heartrate)
+
+    def finish(counts):
+        bpm = counts.pop("bpm")
+        counts["heartrate_avg"] = round(sum(bpm) / len(bpm), 1) if bpm else None
+        for floor in counts.get("floors", {}).values():
+            finish(floor)
+        return counts
+
+    return {"total": finish(total), "sites": {name: finish(site) for name, site in sites.items()}}
+
+
+def random_reading(rng):
+    sensor = rng.choice(("heartrate", "heartrate", "battery", "falldetect"))
+    if sensor == "heartrate":
+        return sensor, str(rng.randint(55, 130))
+    if sensor == "battery":
+        return sensor, str(rng.randint(0, 100))
+    return sensor, rng.choice(("OK", "OK", "OK", "Fallen"))
+
+
+def median_ms(samples):
+    return sorted(samples)[len(samples) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sites", type=int, default=50)
+    parser.add_argument("--floors", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=50, help="per floor")
+    parser.add_argument("--updates", type=int, default=100000)
+    args = parser.parse_args()
+
+    setup_logging("WARNING", stream=open(os.devnull, "w"))
+    centralApp.app.config["LOGIN_DISABLED"] = True
+    client = centralApp.app.test_client()
+    rng = random.Random(1)
+    keys = [("SITE_%02d" % site, str(floor), str(worker)) for site in range(args.sites)
+            for floor in range(1, args.floors + 1) for worker in range(1, args.workers + 1)]
+
+    began = time.perf_counter()
+    for key in keys:
+        centralApp.store_reading(*key, "heartrate", str(rng.randint(60, 100)))
+        centralApp.store_reading(*key, "battery", str(rng.randint(20, 100)))
+        centralApp.store_reading(*key, "falldetect", "OK")
+    print(f"{len(keys)} workers stored in {time.perf_counter() - began:.1f} s")
+
+    for done in range(1, args.updates + 1):
+        key = rng.choice(keys)
+        if done % 50 == 0:
+            centralApp.on_liveness_change(key, rng.choice((LIVE, STALE, OFFLINE)), ["heartrate"])
+        else:
+            centralApp.store_reading(*key, *random_reading(rng))
+    print(f"{args.updates} updates applied")
+
+    timings = {"summary": [], "recompute": [], "api_data": []}
+    records = [centralApp.store.get(*key) for key in rng.sample(keys, min(OBSERVED, len(keys)))]
+    for record in records:
+        record.heartrate += 1       # A change, so observe() has a delta to apply
+    began = time.perf_counter()
+    for record in records:
+        centralApp.floor_summary.observe(record)
+    observe_us = (time.perf_counter() - began) / len(records) * 1e6
+    for record in records[:REPEATS]:
+        record.heartrate += 1
+        centralApp.floor_summary.observe(record)
+        began = time.perf_counter()
+        client.get("/api/summary")
+        timings["summary"].append(time.perf_counter() - began)
+    for _ in range(5):
+        began = time.perf_counter()
+        recompute(centralApp.store, centralApp.LOW_BATTERY)
+        timings["recompute"].append(time.perf_counter() - began)
+        began = time.perf_counter()
+        response = client.get("/api/data")
+        timings["api_data"].append(time.perf_counter() - began)
+    summary_bytes = len(client.get("/api/summary").data)
+    print(f"observe    {observe_us:8.2f} us per reading")
+    print(f"summary    {median_ms(timings['summary']):8.2f} ms, {summary_bytes:,} bytes")
+    print(f"recompute  {median_ms(timings['recompute']):8.2f} ms")
+    print(f"api_data   {median_ms(timings['api_data']):8.2f} ms, {len(response.data):,} bytes")
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
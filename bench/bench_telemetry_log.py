@@ -0,0 +1,63 @@
+# handle_message ingest rate with the telemetry log disabled and enabled
+#
+#   python bench/bench_telemetry_log.py [--messages 20000] [--workers 200]
+#
+# stdout is discarded while measuring so the handler's prints do not
+# dominate. "enabled" includes waiting for the writer to fsync the backlog.
+
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import centralApp
+from telemetry_log import TelemetryLog
+
+
+def lines(count, workers):
+    sensors = ("heartrate", "battery", "falldetect")
+    values = {"heartrate": "75", "battery": "80", "falldetect": "OK"}
+    for i in range(count):
+        sensor = sensors[i % 3]
+        worker = i % workers
+        yield f"Got valid message: From SITE_A: /{worker // 50}/{worker % 50}/{sensor}/{values[sensor]}"
+
+
+def run(messages, workers, log):
+    centralApp.store.__init__()
+    centralApp.telemetry_log = log
+    batch = list(lines(messages, workers))
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        for line in batch:
+            centralApp.handle_message(line)
+        handled = time.perf_counter() - start
+        if log is not None:
+            log.stop()
+        durable = time.perf_counter() - start
+    return messages / handled, messages / durable
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'log':>10} {'handled msg/s':>15} {'durable msg/s':>15} {'fsyncs':>8}")
+    rate, _ = run(args.messages, args.workers, None)
+    print(f"{'disabled':>10} {rate:>15.0f} {'-':>15} {'-':>8}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        log = TelemetryLog(directory, checkpoint=centralApp.store.readings)
+        log.start()
+        rate, durable = run(args.messages, args.workers, log)
+        print(f"{'enabled':>10} {rate:>15.0f} {durable:>15.0f} {log.fsyncs:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+# Time and peak memory of the hot paths of both apps, against stored baselines
+#
+#   python bench/suite.py [--workers 10,1000,10000] [--only api_data]
+#   python bench/suite.py --save                 # Record bench/baseline.json
+#   python bench/suite.py --compare [--threshold 0.5] [--memory-threshold 0.10]
+#
+# Cases, each at every worker count (workers already in the store):
+#   site.on_message         app.on_message with fake paho messages, per message
+#   central.handle_message  centralApp.handle_message with recorded gateway
+#                           lines, ASCII and frame payloads, per line
+#   *.api_data, *.index     /api/data (plain and gzip) and / through the Flask
+#                           test client, per request
+#   *.login, *.load_user    POST /login and the flask_login user loader
+#
+# Time is the fastest of REPEATS runs, per unit of work. Peak memory is what
+# tracemalloc sees allocated during one run on top of what was there before,
+# measured separately so tracing does not slow the timings. --compare exits
+# with status 1 when any case is slower or bigger than its baseline by more
+# than the threshold; a case that looks slower is timed again first.
+#
+# bench/baseline.json is committed, recorded with --save on the machine
+# described by its "_recorded" entry. Baselines only mean something on the
+# machine that recorded them: on another one, save your own before a
+# change (git stash, --save, git stash pop) and --compare after it.
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app
+import centralApp
+from frame_codec import encode_frames
+from log_setup import setup_logging
+from serial_link import LoRaForwarder
+from tools.loadgen.model import SiteModel, gateway_packet, readings
+from tools.loadgen.targets import FakeMessage
+
+BASELINE = os.path.join(ROOT, "bench", "baseline.json")
+WORKER_COUNTS = (10, 1000, 10000)
+SAMPLE = 2000               # Messages or lines per run of the ingest cases
+REPEATS = 7
+RETRIES = 2                 # Extra timings of a case that looks regressed
+TIME_SLACK_US = 1.0         # Slowdowns smaller than this are timer noise, whatever the ratio
+MIN_RUN = 0.1               # Seconds, runs are made at least this long
+PASSWORD = "bench"
+
+
+def reset_site():
+    app.store.__init__()
+    app.snapshot_cache.__init__(app.store, app.SITE_ID, app.SNAPSHOT_INTERVAL)
+    app.history.__init__(app.HISTORY_SIZE)
+    if app.deadband is not None:
+        app.deadband.__init__(app.HEARTRATE_DEADBAND, app.HEARTRATE_RELATIVE,
+                              app.BATTERY_STEP, app.KEYFRAME_INTERVAL)
+    new_forwarder()
+
+
+def new_forwarder():
+    # Never started here, so its queue would only fill up
+    app.forwarder = LoRaForwarder(frames=app.FRAME_ENCODING, ack_timeout=app.ACK_TIMEOUT)
+
+
+def reset_central():
+    centralApp.store.__init__()
+    centralApp.snapshot_cache.__init__(centralApp.store, min_interval=centralApp.SNAPSHOT_INTERVAL)
+    centralApp.history.__init__(centralApp.HISTORY_SIZE)
+
+
+def fill(store, site, model):
+    for floor, worker, sensor, value in readings(model.round()):
+        store.update(site, floor, worker, sensor, value)
+
+
+def spread(items, count):
+    # Every n-th item, so a sample touches workers across the whole store
+    step = max(1, len(items) // count)
+    return items[::step][:count]
+
+
+# Each case setup(workers) prepares the app and returns (run, units):
+# run() does one run of work, `units` is how much work that is
+
+def site_on_message(workers):
+    reset_site()
+    model = SiteModel(workers)
+    fill(app.store, app.SITE_ID, model)
+    messages = [FakeMessage(topic, payload.encode()) for topic, payload in spread(model.round(), SAMPLE)]
+
+    def run():
+        for msg in messages:
+            app.on_message(None, None, msg)
+        new_forwarder()
+    return run, len(messages)
+
+
+def central_lines(workers, frames):
+    reset_central()
+    model = SiteModel(workers)
+    fill(centralApp.store, "SITE_A", model)
+    batch = readings(model.round())
+    if frames:
+        batch.sort(key=lambda r: (r[0], r[1]))
+        payloads = encode_frames(batch)
+    else:
+        payloads = ["/%s/%s/%s/%s" % reading for reading in batch]
+    lines = [line.encode() + b"\r\n" for payload in spread(payloads, SAMPLE // 7)
+             for line in gateway_packet("SITE_A", payload).split("\r\n") if line]
+
+    def run():
+        for line in lines:
+            centralApp.handle_message(line)
+    return run, len(lines)
+
+
+def central_handle_message(workers):
+    return central_lines(workers, frames=False)
+
+
+def central_handle_frames(workers):
+    return central_lines(workers, frames=True)
+
+
+def request(module, reset, site, method, url, headers=None, data=None):
+    def setup(workers):
+        reset()
+        fill(module.store, site, SiteModel(workers))
+        client = module.app.test_client()
+        call = getattr(client, method)
+
+        def run():
+            response = call(url, headers=headers, data=data)
+            assert response.status_code in (200, 302), (url, response.status_code)
+        return run, 1
+    return setup
+
+
+def load_user(module):
+    def setup(workers):
+        def run():
+            assert module.load_user("1") is not None
+        return run, 1
+    return setup
+
+
+LOGIN_FORM = {"username": "admin", "password": PASSWORD}
+GZIP = {"Accept-Encoding": "gzip"}
+
+# (name, setup, scales with workers)
+CASES = (
+    ("site.on_message", site_on_message, True),
+    ("central.handle_message", central_handle_message, True),
+    ("central.handle_message.frames", central_handle_frames, True),
+    ("site.api_data", request(app, reset_site, app.SITE_ID, "get", "/api/data"), True),
+    ("site.api_data.gzip", request(app, reset_site, app.SITE_ID, "get", "/api/data", GZIP), True),
+    ("site.index", request(app, reset_site, app.SITE_ID, "get", "/"), True),
+    ("central.api_data", request(centralApp, reset_central, "SITE_A", "get", "/api/data"), True),
+    ("central.api_data.gzip", request(centralApp, reset_central, "SITE_A", "get", "/api/data", GZIP), True),
+    ("central.index", request(centralApp, reset_central, "SITE_A", "get", "/"), True),
+    ("site.login", request(app, reset_site, app.SITE_ID, "post", "/login", data=LOGIN_FORM), False),
+    ("central.login", request(centralApp, reset_central, "SITE_A", "post", "/login", data=LOGIN_FORM), False),
+    ("site.load_user", load_user(app), False),
+    ("central.load_user", load_user(centralApp), False),
+)
+
+
+def time_per_unit(run, units):
+    run()       # Warm up caches (snapshot bodies, templates, lazy imports)
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            run()
+        if time.perf_counter() - start >= MIN_RUN:
+            break
+        calls *= 2
+    samples = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        for _ in range(calls):
+            run()
+        samples.append((time.perf_counter() - start) / calls / units)
+    return min(samples)     # The least disturbed run, as timeit does
+
+
+def peak_memory(run):
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        run()
+        return tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+
+def measure(names, worker_counts, slow=None):
+    """Yields (case, result). A case slow(case, result) says is too slow
+    is timed again up to RETRIES times, keeping the best time, so one noisy
+    moment on the machine does not fail a comparison."""
+    for name, setup, scales in CASES:
+        if names and not any(part in name for part in names):
+            continue
+        for workers in worker_counts if scales else (None,):
+            key = name if workers is None else f"{name}[{workers}]"
+            run, units = setup(workers or 10)
+            seconds = time_per_unit(run, units)
+            result = {"us": round(seconds * 1e6, 3), "peak_kib": round(peak_memory(run) / 1024, 1)}
+            for _ in range(RETRIES):
+                if slow is None or not slow(key, result):
+                    break
+                seconds = min(seconds, time_per_unit(run, units))
+                result["us"] = round(seconds * 1e6, 3)
+            yield key, result
+
+
+def compare(result, baseline, threshold, memory_threshold):
+    """(time change, memory change, regressed) against a baseline entry."""
+    if baseline is None:
+        return None, None, False
+    time_change = result["us"] / baseline["us"] - 1 if baseline["us"] else 0.0
+    # Small peaks are noise from allocator state, give them 64 KiB of slack
+    memory_change = ((result["peak_kib"] - baseline["peak_kib"]) / max(baseline["peak_kib"], 64.0))
+    slower = time_change > threshold and result["us"] - baseline["us"] > TIME_SLACK_US
+    return time_change, memory_change, slower or memory_change > memory_threshold
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default=",".join(map(str, WORKER_COUNTS)))
+    parser.add_argument("--only", action="append", help="run cases whose name contains this")
+    parser.add_argument("--save", action="store_true", help="write the results as the baseline")
+    parser.add_argument("--compare", action="store_true", help="fail on regressions against the baseline")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.5, help="allowed slowdown, 0.5 = 50%%")
+    parser.add_argument("--memory-threshold", type=float, default=0.10, help="allowed peak memory growth")
+    args = parser.parse_args()
+
+    worker_counts = [int(count) for count in args.workers.split(",")]
+    baseline = {}
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    # Warnings only, written nowhere: the log thread waking up for every
+    # INFO line makes timings jumpy. bench_logging.py measures logging.
+    setup_logging("WARNING", stream=open(os.devnull, "w"))
+    for module in (app, centralApp):
+        module.app.config["LOGIN_DISABLED"] = True
+        module.users["admin"].password = PASSWORD
+
+    if args.save:
+        # A baseline is the best of every retry, as a comparison can be
+        def slow(key, result):
+            return True
+    elif baseline:
+        def slow(key, result):
+            return compare(result, baseline.get(key), args.threshold, args.memory_threshold)[2]
+    else:
+        slow = None
+
+    results = {}
+    regressions = []
+    print(f"{'case':<40} {'us/unit':>10} {'peak KiB':>10} {'time':>8} {'memory':>8}")
+    for key, result in measure(args.only, worker_counts, slow):
+        results[key] = result
+        time_change, memory_change, regressed = compare(result, baseline.get(key), args.threshold,
+                                                        args.memory_threshold)
+        changes = "" if time_change is None else f" {time_change:>+8.0%} {memory_change:>+8.0%}"
+        print(f"{key:<40} {result['us']:>10.1f} {result['peak_kib']:>10.1f}{changes}"
+              + ("  REGRESSED" if regressed else ""))
+        if regressed:
+            regressions.append(key)
+
+    if args.save:
+        saved = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                saved = json.load(f)
+        saved.update(results)
+        saved["_recorded"] = {"date": time.strftime("%Y-%m-%d"), "platform": platform.platform(),
+                              "python": platform.python_version(), "cpus": os.cpu_count()}
+        with open(args.baseline, "w") as f:
+            json.dump(saved, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+    if regressions:
+        print(f"{len(regressions)} regressed past the threshold: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,54 @@
 # CENTRAL DASHBOARD SETUP
-# Change line 9 to COM port connected to RX LoRa
+# Set PORTS to the COM ports the RX LoRa gateways are connected to
 
-from flask import Flask, render_template, jsonify, request, redirect, url_for, flash, session, after_this_request
+from flask import Flask, Response, render_template, jsonify, request, redirect, url_for, flash, session, after_this_request
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
+import logging
 import os
+import asyncio
 import dotenv
 import threading
-import serial
+import time
+from anomaly import AnomalyDetector
+from archive import Archive
+from async_engine import AsyncSerialReader, WsgiServer, consume, run_async
+from events import EventBroker
+from floor_summary import FloorSummary
+from frame_codec import decode_frame
+from history import History
+from liveness import LIVE, LivenessTracker
+from log_setup import setup_logging
+from metrics import CONTENT_TYPE, Registry
+from lora_protocol import FRAME, KIND_NAMES, MALFORMED, RSSI, VALID, parse_line
+from priority import ALERT, TELEMETRY, AsyncLaneQueue, LaneQueue, LatencyTracker, is_alert, lane_stats, lane_trackers
+from rules import FallUnanswered, RulesEngine, Threshold
+from snapshot_cache import SnapshotCache, pick_encoding
+from serial_link import SerialLineReader
+from state_store import SENSOR_FIELDS, WorkerStateStore
+from telemetry_log import TelemetryLog
 
-PORT = 'COM3'
+PORTS = ['COM3']                    # RX LoRa gateways, one reader each, all into one store
+LOG_DIR = "telemetry_log"           # Write-ahead log for restart recovery, None to disable
+ARCHIVE_PATH = "archive_central.db" # SQLite archive of readings and incidents, None to disable
+HISTORY_SIZE = 3600                 # Readings kept per worker and sensor for /api/history
+SNAPSHOT_INTERVAL = 0.0             # Min seconds between /api/data re-serialisations, 0 = every change
+LOG_LEVEL = "INFO"                  # DEBUG logs every reading and gateway line
+LOG_LEVELS = {}                     # Per-subsystem levels, e.g. {"central.store": "DEBUG"}
+ASYNC_MODE = False                  # Serial and HTTP on one asyncio loop, see async_engine.py
+LIVENESS_TIMEOUTS = {               # Per sensor, seconds of silence before a worker is (stale, offline);
+    "heartrate": (90, 300),         # Site A sends unchanged readings only every 60 s. None to disable.
+    "battery": (90, 300),
+    "falldetect": (90, 300),
+}
+LOW_BATTERY = 15                    # Percent under which a battery is low, for /api/summary and the alert rule
+ALERT_RULES = (                     # Evaluated every second over all workers, see rules.py. None to disable.
+    Threshold("heartrate_high", "heartrate", above=120, hold=30),
+    Threshold("heartrate_low", "heartrate", below=50, hold=30),
+    Threshold("battery_low", "battery", below=LOW_BATTERY),
+    FallUnanswered("fall_unanswered", within=60),
+)
+HEARTRATE_ANOMALIES = True          # Score heart rates against each worker's own baseline, see anomaly.py.
+                                    # Site A's deadband thins what arrives here, Site A scores every sample.
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
 app.config.update(
@@ -17,7 +57,40 @@ app.config.update(
     SESSION_COOKIE_SAMESITE='Lax',  # Restrict cookie sharing
     PERMANENT_SESSION_LIFETIME=1800  # Session timeout in seconds (30 minutes)
 )
-ser6 = None
+gateways = {}                       # Gateway URL -> Gateway, see start_serial_reader and serve_async
+ingest_thread = None                # Runs process_lines in thread mode
+ingest_queue = LaneQueue()          # Readings waiting for store_line, alerts first
+line_counts = [0] * len(KIND_NAMES) # Gateway lines seen, by lora_protocol kind
+last_rssi = None                    # Signal strength of the last valid packet
+store_latency = lane_trackers()     # Per lane, serial line received to store update
+broker = EventBroker()              # Pushes updates to dashboards on /api/stream
+
+log = logging.getLogger("central")
+serial_log = logging.getLogger("central.serial")
+store_log = logging.getLogger("central.store")
+
+class Gateway:
+    """One RX LoRa gateway: its reader and what came in through it."""
+
+    def __init__(self, url):
+        self.url = url
+        self.reader = None              # SerialLineReader, or AsyncSerialReader in ASYNC_MODE
+        self.lag = LatencyTracker()     # Line received to its readings stored
+        self.line_counts = [0] * len(KIND_NAMES)
+        self.last_rssi = None
+
+    def on_line(self, raw):
+        on_serial_line(raw, self)
+
+    def stats(self):
+        stats = self.reader.stats() if self.reader is not None else {"url": self.url, "connected": False}
+        stats["line_types"] = dict(zip(KIND_NAMES, self.line_counts))
+        stats["last_rssi"] = self.last_rssi
+        stats["lag"] = self.lag.stats()
+        return stats
+
+def reader_totals(key):
+    return sum(gateway.reader.stats()[key] for gateway in gateways.values() if gateway.reader is not None)
 
 # Setup Flask-Login
 login_manager = LoginManager()
@@ -47,29 +120,66 @@ def load_user(user_id):
 @app.after_request
 def add_no_cache_headers(response):
     """Add headers to prevent browser caching."""
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate, max-age=0"
+    if response.get_etag()[0]:
+        # Versioned responses may be kept, but must be revalidated every time
+        response.headers["Cache-Control"] = "no-cache, must-revalidate, max-age=0"
+    else:
+        response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate, max-age=0"
     response.headers["Pragma"] = "no-cache"
     response.headers["Expires"] = "0"
     return response
 
-data_store = {
-    # Site ID → Floor ID → Worker ID → Sensor type → Value
-    # Example data
-    # "SITE_A": {
-    #     "floor1": {
-    #         "worker1": {
-    #             "falldetect": "0",
-    #             "heartrate": "75",
-    #             "battery": "90"
-    #         },
-    #         "worker2": {
-    #             "falldetect": "0",
-    #             "heartrate": "60",
-    #             "battery": "80"
-    #         }
-    #     }
-    # }
-}
+# Latest reading per worker: site -> floor -> worker, e.g.
+# store.get("SITE_A", "1", "2").heartrate
+store = WorkerStateStore()
+snapshot_cache = SnapshotCache(store, min_interval=SNAPSHOT_INTERVAL)
+history = History(HISTORY_SIZE)     # Recent readings per worker and sensor
+floor_summary = FloorSummary(LOW_BATTERY)   # Per floor and site counts for /api/summary
+archive = None                      # Archive once started, see start_archive
+telemetry_log = None                # TelemetryLog once started, see start_telemetry_log
+liveness = None                     # LivenessTracker once started, see start_liveness
+alerts = None                       # RulesEngine once started, see start_alerts
+anomalies = None                    # AnomalyDetector once started, see start_anomalies
+
+# Served on /metrics
+metrics = Registry()
+readings_stored = metrics.counter("central_readings_total", "Readings stored, by site and sensor", ("site", "sensor"))
+parse_errors = metrics.counter("central_parse_errors_total", "Lines or readings that could not be used, by stage",
+                               ("stage",))
+handle_message_seconds = metrics.histogram("central_handle_message_seconds",
+                                           "Time to store a gateway line or one queued reading")
+api_data_seconds = metrics.histogram("central_api_data_seconds", "Time to build an /api/data response", ("kind",))
+metrics.callback("central_serial_lines_total", "Lines printed by the RX LoRa, by type",
+                 lambda: {(name,): count for name, count in zip(KIND_NAMES, line_counts)}, ("type",), "counter")
+metrics.callback("central_serial_reconnects_total", "Times an RX LoRa serial port was reopened",
+                 lambda: reader_totals("reconnects") if gateways else None, type="counter")
+metrics.callback("central_gateway_lines_total", "Lines printed by each RX LoRa gateway, by type",
+                 lambda: {(url, name): count for url, gateway in gateways.items()
+                          for name, count in zip(KIND_NAMES, gateway.line_counts)},
+                 ("gateway", "type"), "counter")
+metrics.callback("central_gateway_errors_total", "Serial errors (failed opens, drops) per gateway",
+                 lambda: {(url,): gateway.reader.errors for url, gateway in gateways.items()
+                          if gateway.reader is not None}, ("gateway",), "counter")
+metrics.callback("central_gateway_lines_dropped_total", "Lines lost to errors or overlong, per gateway",
+                 lambda: {(url,): gateway.reader.lines_dropped for url, gateway in gateways.items()
+                          if gateway.reader is not None}, ("gateway",), "counter")
+metrics.callback("central_gateway_connected", "Whether each gateway's serial port is open",
+                 lambda: {(url,): int(gateway.reader is not None and gateway.reader.connected)
+                          for url, gateway in gateways.items()}, ("gateway",))
+metrics.callback("central_store_workers", "Workers in the state store", lambda: len(store))
+metrics.callback("central_workers_liveness", "Tracked workers by liveness state",
+                 lambda: None if liveness is None else {(state,): count for state, count in liveness.counts().items()},
+                 ("state",))
+metrics.callback("central_alerts_active", "Alerts firing now, by rule",
+                 lambda: None if alerts is None else {(rule,): count for rule, count in alerts.counts().items()},
+                 ("rule",))
+metrics.callback("central_heartrate_anomalies_active", "Workers whose heart rate is anomalous now",
+                 lambda: None if anomalies is None else len(anomalies.active()))
+metrics.callback("central_ingest_queue_depth", "Gateway readings waiting to be stored", lambda: len(ingest_queue))
+metrics.callback("central_ingest_dropped_total", "Telemetry readings dropped from a full ingest queue",
+                 lambda: ingest_queue.dropped, type="counter")
+metrics.callback("central_ingest_superseded_total", "Telemetry readings dropped for a newer alert from the same worker",
+                 lambda: ingest_queue.superseded, type="counter")
 
 @app.route('/api/check-session')
 def check_session():
@@ -88,12 +198,11 @@ def login():
                 login_user(users[username])
                 next_page = request.args.get('next')
                 
-                # Debug print
-                print(f"Login successful for {username}, redirecting to: {next_page or '/'}")
+                log.info("Login successful for %s, redirecting to: %s", username, next_page or '/')
                 
                 return redirect(next_page or url_for('main'))
             except Exception as e:
-                print(f"Error during login: {e}")
+                log.error("Error during login: %s", e)
                 flash(f"An error occurred during login: {e}")
         else:
             flash('Invalid username or password')
@@ -116,79 +225,407 @@ def logout():
 @app.route("/")
 @login_required
 def main():
-    print(data_store)
-    return render_template("centralDashboard.html", data=data_store)
+    data = snapshot_cache.snapshot()
+    return render_template("centralDashboard.html", data=data)
 
-# API endpoint to get lastest data
+# API endpoint to get lastest data. ?since=<version> returns only the workers
+# changed after that version, and If-None-Match gets a 304 when nothing did
 @app.route("/api/data")
 @login_required
 def get_data():
-    return jsonify(data_store)
+    started = time.perf_counter()
+    # The ETag is the snapshot version, so an unchanged store costs a 304
+    since = request.args.get("since", type=int)
+    if since is None:
+        # Full state comes pre-serialised from the cache
+        encoding = pick_encoding(request.accept_encodings)
+        version, body = snapshot_cache.get(encoding)
+    else:
+        version = snapshot_cache.version
+    etag = snapshot_cache.etag(version)
+
+    if request.if_none_match.contains(etag):
+        response, kind = Response(status=304), "not_modified"
+    elif since is None:
+        response, kind = Response(body, mimetype="application/json"), "full"
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+    elif since > version:
+        # Client's version is from before a restart, send everything
+        response = jsonify({"version": version, "full": True, "changed": snapshot_cache.snapshot()})
+        kind = "full"
+    else:
+        response = jsonify({"version": version, "changed": snapshot_cache.snapshot(since=since)})
+        kind = "delta"
+    response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+    response.headers["X-Data-Version"] = str(version)
+    response.headers["X-Data-Epoch"] = snapshot_cache.epoch
+    api_data_seconds.observe(time.perf_counter() - started, (kind,))
+    return response
+
+# Fallen workers, low batteries, stale/offline workers and average heart
+# rate per floor, per site and overall, ?site= for one site. Served from
+# counts kept up to date by ingest; the ETag changes when a count does.
+@app.route("/api/summary")
+@login_required
+def get_summary():
+    site = request.args.get("site")
+    if site is None:
+        version, body = floor_summary.body()
+    else:
+        version = floor_summary.version
+    etag = f"summary-{store.epoch}-{version}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif site is None:
+        response = Response(body, mimetype="application/json")
+    else:
+        data = floor_summary.summary(site)
+        if data is None:
+            return jsonify({"error": "unknown site"}), 404
+        response = jsonify(data)
+    response.set_etag(etag)
+    return response
+
+# Prometheus scrape endpoint. Not behind the login so a scraper can read
+# it; the app only listens on localhost.
+@app.route("/metrics")
+def get_metrics():
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+# Reading history for one worker: /api/history/<site>/<floor>/<worker>?sensor=heartrate
+# from/to are unix seconds, step buckets the points into min/max/avg
+@app.route("/api/history/<site>/<floor>/<worker>")
+@login_required
+def get_history(site, floor, worker):
+    sensor = request.args.get("sensor", "heartrate")
+    if sensor not in SENSOR_FIELDS:
+        return jsonify({"error": "unknown worker or sensor"}), 404
+    points = history.query(site, floor, worker, sensor,
+                           start=request.args.get("from", type=float),
+                           end=request.args.get("to", type=float),
+                           step=request.args.get("step", type=float))
+    if points is None:
+        return jsonify({"error": "unknown worker or sensor"}), 404
+    return jsonify({"site": site, "floor": floor, "worker": worker, "sensor": sensor, "points": points})
+
+# Alerts and heart rate anomalies firing now, and the fired/cleared events
+# after event id `since`
+@app.route("/api/alerts")
+@login_required
+def get_alerts():
+    sources = [source for source in (alerts, anomalies) if source is not None]
+    if not sources:
+        return jsonify({"error": "alert rules disabled"}), 503
+    since = request.args.get("since", 0, type=int)
+    return jsonify({"active": sorted((event for source in sources for event in source.active()),
+                                     key=lambda event: event["id"]),
+                    "events": sorted((event for source in sources for event in source.events(since)),
+                                     key=lambda event: event["id"]),
+                    "stats": {"rules": None if alerts is None else alerts.stats(),
+                              "anomalies": None if anomalies is None else anomalies.stats()}})
+
+# Fall incidents from the archive, newest first. Filters: site, floor, worker,
+# from/to (unix seconds)
+@app.route("/api/incidents")
+@login_required
+def get_incidents():
+    if archive is None:
+        return jsonify({"error": "archive disabled"}), 503
+    return jsonify(archive.incidents(site=request.args.get("site"),
+                                     floor=request.args.get("floor"),
+                                     worker=request.args.get("worker"),
+                                     start=request.args.get("from", type=float),
+                                     end=request.args.get("to", type=float)))
+
+# Archived reading statistics and incident count for one worker
+@app.route("/api/workers/<site>/<floor>/<worker>/summary")
+@login_required
+def get_worker_summary(site, floor, worker):
+    if archive is None:
+        return jsonify({"error": "archive disabled"}), 503
+    return jsonify(archive.summary(site, floor, worker,
+                                   start=request.args.get("from", type=float),
+                                   end=request.args.get("to", type=float)))
+
+# Push stream: one snapshot, then only the per-worker changes
+@app.route("/api/stream")
+@login_required
+def stream_data():
+    return Response(broker.stream(snapshot_cache.snapshot), mimetype="text/event-stream",
+                    headers={"X-Accel-Buffering": "no"})
+
+# Serial link health: totals over all gateways, then per gateway its
+# lines read and dropped, line rate, errors, reconnects and store lag
+@app.route("/api/serial-stats")
+@login_required
+def get_serial_stats():
+    if not gateways:
+        return jsonify({"status": "not started"}), 503
+    per_gateway = {url: gateway.stats() for url, gateway in gateways.items()}
+    stats = {key: sum(gateway.get(key, 0) for gateway in per_gateway.values())
+             for key in ("lines_read", "lines_dropped", "reconnects", "errors")}
+    stats["connected"] = all(gateway["connected"] for gateway in per_gateway.values())
+    stats["line_types"] = dict(zip(KIND_NAMES, line_counts))
+    stats["last_rssi"] = last_rssi
+    stats["gateways"] = per_gateway
+    return jsonify(stats)
 
-# Handle message from LoRa
+# Write-ahead log: readings written, fsync batches and readings recovered at startup
+@app.route("/api/log-stats")
+@login_required
+def get_log_stats():
+    if telemetry_log is None:
+        return jsonify({"status": "disabled"}), 503
+    return jsonify(telemetry_log.stats())
+
+# Central stage of the alert pipeline, per priority lane. The Site A app
+# reports the MQTT-to-serial stage of the same path.
+@app.route("/api/latency")
+@login_required
+def get_latency():
+    return jsonify({
+        "serial_to_store": lane_stats(store_latency),
+        "queued": len(ingest_queue),
+        "dropped": ingest_queue.dropped,
+    })
+
+# Store one reading that arrived over LoRa
+def store_reading(site_info, floor_id, worker_id, sensor_type, sensor_value):
+    record = store.update(site_info, floor_id, worker_id, sensor_type, sensor_value)
+    if record is None:
+        store_log.warning("Invalid reading from %s: %s", site_info, [floor_id, worker_id, sensor_type, sensor_value])
+        parse_errors.inc(("reading",))
+        return None
+    readings_stored.inc((site_info, sensor_type))
+    floor_summary.observe(record)
+    history.record(site_info, floor_id, worker_id, sensor_type,
+                   record.reading(sensor_type), record.updated)
+    if archive is not None:
+        archive.record(site_info, floor_id, worker_id, sensor_type,
+                       sensor_value, record.updated)
+    if telemetry_log is not None:
+        telemetry_log.append(site_info, floor_id, worker_id, sensor_type,
+                             sensor_value, record.updated)
+    if liveness is not None:
+        liveness.seen((site_info, floor_id, worker_id), sensor_type, record.updated)
+    if anomalies is not None and sensor_type == "heartrate":
+        score_heartrate(record)
+    if alerts is not None:
+        alerts.observe(record, sensor_type)
+    broker.publish("update", {"site": site_info, "floor": floor_id, "worker": worker_id,
+                              "data": record.as_dict()})
+    store_log.debug("Updated %s/%s/%s %s=%s", site_info, floor_id, worker_id, sensor_type, sensor_value)
+    return record
+
+# Fold a stored heart rate into the worker's baseline and keep its score
+# in the store
+def score_heartrate(record):
+    score = anomalies.update((record.site, record.floor, record.worker), record.heartrate, record.updated)
+    if score is not None:
+        store.set_anomaly(record.site, record.floor, record.worker, score)
+
+# Count one parsed gateway line, returns the (floor, worker, sensor, value)
+# readings it carries, or None
+def count_line(line, gateway=None):
+    global last_rssi
+    kind = line.kind
+    readings = None
+    if kind == VALID:
+        readings = [(line.floor, line.worker, line.sensor, line.value)]
+    elif kind == FRAME:
+        readings = decode_frame(line.payload)
+        if readings is None:
+            kind = MALFORMED    # Corrupt frame, none of it is applied
+    line_counts[kind] += 1
+    if gateway is not None:
+        gateway.line_counts[kind] += 1
+    if kind == RSSI:
+        last_rssi = line.number
+        if gateway is not None:
+            gateway.last_rssi = line.number
+    elif kind == MALFORMED:
+        serial_log.warning("Malformed message from %s: %s", gateway.url if gateway else "gateway", line)
+        parse_errors.inc(("line",))
+    return readings
+
+# Handle message from LoRa, one line as printed by LORA_CENTRAL.INO
 def handle_message(message):
+    started = time.perf_counter()
+    if isinstance(message, str):
+        message = message.encode()
+    line = parse_line(message)
     try:
-        if "From " in message and ":" in message:
-            before_site, _, after_site = message.partition("From ")
-            site_info, _, topic_payload = after_site.partition(":")
-            
-            site_info = site_info.strip()
-            topic_payload = topic_payload.strip()
-
-            topic_parts = topic_payload.strip("/").split("/")
-
-            if len(topic_parts) == 4:
-                floor_id = topic_parts[0]
-                worker_id = topic_parts[1]
-                sensor_type = topic_parts[2]
-                sensor_value = topic_parts[3]
-
-                # Initialize site
-                if site_info not in data_store:
-                    data_store[site_info] = {}
-                if floor_id not in data_store[site_info]:
-                    data_store[site_info][floor_id] = {}
-                if worker_id not in data_store[site_info][floor_id]:
-                    data_store[site_info][floor_id][worker_id] = {}
-
-                # Store value
-                data_store[site_info][floor_id][worker_id][sensor_type] = sensor_value
-                print(f"[INFO] Updated data_store: {data_store}")
-            else:
-                print(f"[ERROR] Invalid topic format: {topic_parts}")
-        else:
-            print("[ERROR] Message format doesn't match expected pattern")
+        for floor_id, worker_id, sensor_type, sensor_value in count_line(line) or ():
+            store_reading(line.sender, floor_id, worker_id, sensor_type, sensor_value)
     except Exception as e:
-        print(f"[EXCEPTION] in handle_message: {e}")
+        serial_log.exception("Failed to store %s from %s: %s", line.payload, line.sender, e)
+    handle_message_seconds.observe(time.perf_counter() - started)
+    return line
+
+# Last stored fall state of a worker, None if unknown
+def fall_state(site, floor_id, worker_id):
+    record = store.get(site, floor_id, worker_id)
+    return None if record is None else record.fallen
 
-def read_ser6():
-    global ser_com6
+# Called by a gateway's serial reader for every line its RX LoRa prints.
+# Only parses and queues, so fall alerts can jump ahead of telemetry. All
+# gateways share the queue, so they are merged into the store in order.
+# Each reading of a frame is queued on its own, keyed by worker and sensor,
+# so an alert drops the older telemetry it would otherwise be stored under.
+def on_serial_line(raw, gateway=None):
+    received_at = time.perf_counter()
+    line = parse_line(raw)
+    for reading in count_line(line, gateway) or ():
+        floor_id, worker_id, sensor_type, sensor_value = reading
+        fallen = fall_state(line.sender, floor_id, worker_id) if sensor_type == "falldetect" else None
+        lane = ALERT if is_alert(sensor_type, sensor_value, fallen) else TELEMETRY
+        ingest_queue.put((line, (reading,), received_at, gateway), lane,
+                         (line.sender, floor_id, worker_id, sensor_type))
+
+def process_lines():
     while True:
-        if ser_com6 is not None and ser_com6.in_waiting > 0:
-            try:
-                # Decode with error handling
-                message = ser_com6.readline().decode('utf-8', errors='replace').strip()
-                
-                # Filter to only print the specific message
-                if "Got valid message:" in message:
-                    print(f"Received from {PORT}: {message}")
-                    handle_message(message)
-            except Exception as e:
-                print(f"[EXCEPTION] in read_ser6: {e}")
-                
-def ser6_thread():
+        store_line(*ingest_queue.get())
+
+def store_line(lane, item):
+    line, readings, received_at, gateway = item
     try:
-        global ser_com6
-        ser_com6 = serial.Serial(PORT, 9600, timeout=1)
-        print(f"Serial port {PORT} opened successfully")
+        started = time.perf_counter()
+        serial_log.debug("Received from %s: %s: %s", gateway and gateway.url, line.sender, line.payload)
+        for floor_id, worker_id, sensor_type, sensor_value in readings:
+            store_reading(line.sender, floor_id, worker_id, sensor_type, sensor_value)
+        finished = time.perf_counter()
+        handle_message_seconds.observe(finished - started)
+        store_latency[lane].record(finished - received_at)
+        if gateway is not None:
+            gateway.lag.record(finished - received_at)
+    except Exception as e:
+        serial_log.exception("Failed to store %s from %s: %s", line.payload, line.sender, e)
 
-        serial_thread = threading.Thread(target=read_ser6, daemon=True)
-        serial_thread.start()
+# Put back one reading from the telemetry log after a restart
+def restore_reading(site, floor, worker, sensor, value, timestamp):
+    record = store.update(site, floor, worker, sensor, value, timestamp)
+    if record is not None:
+        history.record(site, floor, worker, sensor, record.reading(sensor), timestamp)
+        floor_summary.observe(record)
+        if liveness is not None:
+            liveness.seen((site, floor, worker), sensor, timestamp)
+        if anomalies is not None and sensor == "heartrate":
+            score_heartrate(record)
+        if alerts is not None:
+            alerts.observe(record, sensor)
 
-    except Exception as e:
-        print(f"Failed to open serial port COM6: {e}")
-        ser_com6 = None
+def start_telemetry_log(directory=LOG_DIR):
+    global telemetry_log
+    wal = TelemetryLog(directory, checkpoint=store.readings)
+    count = wal.recover(restore_reading)
+    log.info("Recovered %d readings from %s", count, directory)
+    wal.start()
+    telemetry_log = wal
+    return wal
+
+def start_archive(path=ARCHIVE_PATH):
+    global archive
+    archive = Archive(path)
+    archive.start()
+    return archive
+
+# A worker went stale or offline, or is back: mark it in the store, where
+# /api/data picks it up, and push it to the dashboards
+def on_liveness_change(key, state, silent):
+    site, floor_id, worker_id = key
+    record = store.set_liveness(site, floor_id, worker_id, None if state == LIVE else state, silent)
+    if record is None:
+        return
+    floor_summary.observe(record)
+    if state == LIVE:
+        store_log.info("Worker %s/%s/%s is reporting again", site, floor_id, worker_id)
+    else:
+        store_log.warning("Worker %s/%s/%s is %s, nothing from %s", site, floor_id, worker_id,
+                          state, ", ".join(silent))
+    broker.publish("liveness", {"site": site, "floor": floor_id, "worker": worker_id,
+                                "data": record.as_dict()})
+
+def start_liveness(timeouts=LIVENESS_TIMEOUTS):
+    global liveness
+    liveness = LivenessTracker(timeouts, on_liveness_change)
+    liveness.start()
+    return liveness
+
+# An alert rule or heart rate anomaly fired or cleared for a worker: log it
+# and push it to the dashboards
+def on_alert(event):
+    if event["state"] == "fired":
+        store_log.warning("ALERT %s: worker %s/%s/%s, %s", event["rule"], event["site"], event["floor"],
+                          event["worker"], event["message"])
+    else:
+        store_log.info("Cleared %s: worker %s/%s/%s", event["rule"], event["site"], event["floor"], event["worker"])
+    broker.publish("alert", event)
+
+def start_alerts(rules=ALERT_RULES):
+    global alerts
+    alerts = RulesEngine(rules, on_alert)
+    alerts.start()
+    return alerts
+
+def start_anomalies():
+    global anomalies
+    anomalies = AnomalyDetector(on_alert)
+    return anomalies
+
+# Start reading one more gateway. `port` may be an already open port,
+# e.g. a loop:// port of tools/loadgen. Returns its Gateway.
+def start_serial_reader(url, port=None):
+    global ingest_thread
+    if ingest_thread is None:
+        ingest_thread = threading.Thread(target=process_lines, daemon=True)
+        ingest_thread.start()
+    gateway = gateways[url] = Gateway(url)
+    gateway.reader = SerialLineReader(url, gateway.on_line, port=port)
+    gateway.reader.start()
+    return gateway
+
+# ASYNC_MODE: the RX LoRas and HTTP share one event loop. on_serial_line
+# queues on an AsyncLaneQueue instead, store_line drains it.
+# `serial_ports` maps URLs to already open ports.
+async def serve_async(host="localhost", port=5001, urls=None, serial_ports=None):
+    global ingest_queue
+    ingest_queue = AsyncLaneQueue()
+    readers = []
+    for url in urls or PORTS:
+        gateway = gateways[url] = Gateway(url)
+        gateway.reader = AsyncSerialReader(url, gateway.on_line, port=(serial_ports or {}).get(url))
+        readers.append(gateway.reader.run())
+    server = WsgiServer(app, {"/api/stream": (broker, snapshot_cache.snapshot)})
+    await asyncio.gather(consume(ingest_queue, store_line), *readers,
+                         (await server.serve(host, port)).serve_forever())
+
+# Liveness, alert rules, anomaly scores, telemetry log and archive: what
+# both run modes need. Everything that watches readings comes before the
+# log, so workers restored from it are checked too.
+def start_services():
+    if LIVENESS_TIMEOUTS:
+        start_liveness()
+    if ALERT_RULES:
+        start_alerts()
+    if HEARTRATE_ANOMALIES:
+        start_anomalies()
+    if LOG_DIR is not None:
+        start_telemetry_log()
+    if ARCHIVE_PATH is not None:
+        start_archive()
+
+# Thread mode ingest, a reader per gateway
+def start_ingest():
+    for url in PORTS:
+        start_serial_reader(url)
 
 if __name__ == "__main__":
-    ser6_thread()
-    app.run(host="localhost", port=5001, debug=False)
\ No newline at end of file
+    setup_logging(LOG_LEVEL, LOG_LEVELS)
+    start_services()
+    if ASYNC_MODE:
+        run_async(serve_async)
+    else:
+        start_ingest()
+        app.run(host="localhost", port=5001, debug=False)
\ No newline at end of file
@@ -0,0 +1,115 @@
+# Drops outbound readings that have not changed enough to be worth airtime
+
+import threading
+import time
+from array import array
+
+from frame_codec import STATUS_CODES
+from priority import ALERT
+from state_store import parse_fall
+
+HEARTRATE_DEADBAND = 2              # bpm
+HEARTRATE_RELATIVE = 0.03           # Fraction of the last heart rate sent, if larger than the above
+BATTERY_STEP = 5                    # percent
+KEYFRAME_INTERVAL = 60.0            # Seconds after which an unchanged reading is sent anyway
+
+HEARTRATE_SENSORS = ("heartrate", "hrmin", "hrmax")
+
+
+def reading_number(sensor, value):
+    """A reading as a float for comparison, or None if it cannot be filtered."""
+    try:
+        if sensor == "falldetect":
+            return float(parse_fall(value))
+        if sensor == "status":
+            code = STATUS_CODES.get(value)
+            return None if code is None else float(code)
+        return float(value)
+    except ValueError:
+        return None
+
+
+class DeadbandFilter:
+    """Decides per reading whether it is worth sending.
+
+    A heart rate (or hrmin/hrmax) is sent once it is at least
+    `heartrate_deadband` bpm, or `heartrate_relative` of the last value
+    sent, away from the last value sent. Battery needs a `battery_step`
+    change, falldetect and status any change. Whatever the value, a
+    reading is sent again after `keyframe_interval` seconds, so the
+    central side still sees the worker is alive. Alerts always go through,
+    except a repeated falldetect "OK".
+
+    The last value sent and when are kept in two flat arrays indexed by
+    (floor, worker, sensor), 16 bytes per slot.
+    """
+
+    def __init__(self, heartrate_deadband=HEARTRATE_DEADBAND, heartrate_relative=HEARTRATE_RELATIVE,
+                 battery_step=BATTERY_STEP, keyframe_interval=KEYFRAME_INTERVAL):
+        self.heartrate_deadband = heartrate_deadband
+        self.heartrate_relative = heartrate_relative
+        self.battery_step = battery_step
+        self.keyframe_interval = keyframe_interval
+
+        self.forwarded = {}         # sensor -> readings sent
+        self.suppressed = {}        # sensor -> readings dropped
+        self.keyframes = 0          # Unchanged readings sent because the interval ran out
+
+        self._slots = {}            # (floor, worker, sensor) -> index into the arrays
+        self._values = array("d")   # Last value sent
+        self._sent_at = array("d")  # time.monotonic() it was sent
+        self._lock = threading.Lock()
+
+    def stats(self):
+        forwarded = sum(self.forwarded.values())
+        suppressed = sum(self.suppressed.values())
+        return {
+            "forwarded": dict(self.forwarded),
+            "suppressed": dict(self.suppressed),
+            "keyframes": self.keyframes,
+            "suppressed_ratio": round(suppressed / (forwarded + suppressed), 3) if forwarded + suppressed else 0.0,
+        }
+
+    def _changed(self, sensor, number, last):
+        if sensor in HEARTRATE_SENSORS:
+            return abs(number - last) >= max(self.heartrate_deadband, self.heartrate_relative * abs(last))
+        if sensor == "battery":
+            return abs(number - last) >= self.battery_step
+        return number != last
+
+    def check(self, reading, lane=None, now=None):
+        """True if the reading should be sent, and then counts it as sent."""
+        floor, worker, sensor, value = reading
+        number = reading_number(sensor, value)
+        if number is None:
+            self.forwarded[sensor] = self.forwarded.get(sensor, 0) + 1
+            return True
+        if now is None:
+            now = time.monotonic()
+
+        key = (floor, worker, sensor)
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                self._slots[key] = len(self._values)
+                self._values.append(number)
+                self._sent_at.append(now)
+                send = True
+            else:
+                last = self._values[slot]
+                if lane == ALERT and not (sensor == "falldetect" and number == 0.0 and last == 0.0):
+                    send = True
+                elif self._changed(sensor, number, last):
+                    send = True
+                elif now - self._sent_at[slot] >= self.keyframe_interval:
+                    send = True
+                    self.keyframes += 1
+                else:
+                    send = False
+                if send:
+                    self._values[slot] = number
+                    self._sent_at[slot] = now
+
+            counts = self.forwarded if send else self.suppressed
+            counts[sensor] = counts.get(sensor, 0) + 1
+        return send
@@ -0,0 +1,139 @@
+# Server-Sent Events fan-out shared by the Site A and Central dashboards
+
+import asyncio
+import json
+import queue
+import threading
+
+# Marker put on a client's queue when it fell too far behind to catch up
+RESYNC = object()
+
+
+def format_sse(event, data):
+    """Encode one SSE message. Done once per update, not once per client."""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class AsyncClient(queue.Queue):
+    """A client queue read by an asyncio task. publish() may run on any
+    thread, each put wakes the task through its event loop."""
+
+    def __init__(self, loop, maxsize):
+        super().__init__(maxsize)
+        self._loop = loop
+        self._loop_thread = threading.get_ident()     # Made on the loop's thread
+        self._ready = asyncio.Event()
+
+    def _put(self, item):
+        super()._put(item)
+        if threading.get_ident() == self._loop_thread:
+            self._ready.set()
+        else:
+            self._loop.call_soon_threadsafe(self._ready.set)
+
+    async def get_async(self, timeout):
+        """Next message, or raises queue.Empty after `timeout` seconds."""
+        while True:
+            try:
+                return self.get_nowait()
+            except queue.Empty:
+                pass
+            self._ready.clear()
+            if not self.empty():
+                continue    # Put between get_nowait and clear
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                raise queue.Empty from None
+
+
+class EventBroker:
+    def __init__(self, max_queue=256, keepalive=15):
+        self.max_queue = max_queue      # Pending messages allowed per browser
+        self.keepalive = keepalive      # Seconds between keepalive comments
+        self.resyncs = 0                # Times a slow client was reset to a snapshot
+        self._clients = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, loop=None):
+        # With an event loop the client is read with AsyncClient.get_async
+        if loop is None:
+            client = queue.Queue(maxsize=self.max_queue)
+        else:
+            client = AsyncClient(loop, self.max_queue)
+        with self._lock:
+            self._clients.add(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def client_count(self):
+        return len(self._clients)
+
+    def publish(self, event, data):
+        # Called from the ingest threads, so this must never block
+        with self._lock:
+            if not self._clients:
+                return
+            clients = list(self._clients)
+
+        message = format_sse(event, data)
+        for client in clients:
+            try:
+                client.put_nowait(message)
+            except queue.Full:
+                # Slow browser: throw away its backlog and have it reload a snapshot
+                self._reset(client)
+
+    def _reset(self, client):
+        try:
+            while True:
+                client.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            client.put_nowait(RESYNC)
+            self.resyncs += 1
+        except queue.Full:
+            pass
+
+    def stream(self, snapshot):
+        # Subscribe before taking the snapshot so no update falls in between.
+        # A delta that is already in the snapshot is harmless to apply twice.
+        client = self.subscribe()
+        try:
+            yield format_sse("snapshot", snapshot())
+            while True:
+                try:
+                    message = client.get(timeout=self.keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+
+                if message is RESYNC:
+                    yield format_sse("snapshot", snapshot())
+                else:
+                    yield message
+        finally:
+            self.unsubscribe(client)
+
+    async def astream(self, snapshot):
+        """stream() for an asyncio server, yields the same SSE text."""
+        client = self.subscribe(asyncio.get_running_loop())
+        try:
+            yield format_sse("snapshot", snapshot())
+            while True:
+                try:
+                    message = await client.get_async(self.keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+
+                if message is RESYNC:
+                    yield format_sse("snapshot", snapshot())
+                else:
+                    yield message
+        finally:
+            self.unsubscribe(client)
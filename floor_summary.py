@@ -0,0 +1,118 @@
+# Per floor and per site counts for the HQ dashboard, kept up to date as readings arrive
+#
+# Each worker's contribution to its floor (fallen or not, battery low or
+# not, liveness, heart rate) is remembered. When their record changes the
+# new contribution is worked out and the difference from the old one is
+# added to the floor's, the site's and the overall counters: a few
+# integer additions per reading, so /api/summary never walks the store.
+
+import json
+import operator
+import threading
+
+from liveness import OFFLINE, STALE
+
+LOW_BATTERY = 15        # Percent under which a battery counts as low
+FIELDS = ("workers", "fallen", "low_battery", "stale", "offline", "heartrate_sum", "heartrate_count")
+NOBODY = (0,) * len(FIELDS)
+
+
+class FloorSummary:
+    """Materialised per floor, per site and overall counts of workers,
+    fallen workers, low batteries and stale/offline workers, and the
+    average heart rate of workers not offline.
+
+    observe(record) after every change to a state_store WorkerRecord,
+    reading or liveness. `version` goes up whenever a count changes.
+    """
+
+    def __init__(self, low_battery=LOW_BATTERY):
+        self.low_battery = low_battery
+        self.version = 0
+        self._contributions = {}        # (site, floor, worker) -> tuple of FIELDS
+        self._floors = {}               # (site, floor) -> list of FIELDS
+        self._sites = {}                # site -> list of FIELDS
+        self._total = [0] * len(FIELDS)
+        self._built = (-1, None, None)  # (version, summary(), its JSON) last built
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._contributions)
+
+    def contribution(self, record):
+        """What one worker adds to each of FIELDS."""
+        counted = record.heartrate is not None and record.liveness != OFFLINE
+        return (1,
+                1 if record.fallen else 0,
+                1 if record.battery is not None and record.battery < self.low_battery else 0,
+                1 if record.liveness == STALE else 0,
+                1 if record.liveness == OFFLINE else 0,
+                record.heartrate if counted else 0,
+                1 if counted else 0)
+
+    def observe(self, record):
+        """Fold the current state of a worker's record into the counts."""
+        key = (record.site, record.floor, record.worker)
+        with self._lock:
+            # Read the record under the lock, so that when the ingest and
+            # liveness threads observe the same worker, the last one wins
+            new = self.contribution(record)
+            old = self._contributions.get(key, NOBODY)
+            if new == old:
+                return
+            self._contributions[key] = new
+            floor = self._floors.get(key[:2])
+            if floor is None:
+                floor = self._floors[key[:2]] = [0] * len(FIELDS)
+            site = self._sites.get(record.site)
+            if site is None:
+                site = self._sites[record.site] = [0] * len(FIELDS)
+            total = self._total
+            for index, change in enumerate(map(operator.sub, new, old)):
+                if change:
+                    floor[index] += change
+                    site[index] += change
+                    total[index] += change
+            self.version += 1
+
+    def _build(self):
+        with self._lock:
+            if self._built[0] != self.version:
+                built = {"version": self.version, "total": counts(self._total), "sites": {}}
+                for name, counters in self._sites.items():
+                    built["sites"][name] = dict(counts(counters), floors={})
+                for (name, floor), counters in self._floors.items():
+                    built["sites"][name]["floors"][floor] = counts(counters)
+                self._built = (self.version, built, None)
+            return self._built
+
+    def summary(self, site=None):
+        """{"version", "total", "sites": {site: {counts, "floors": {floor:
+        counts}}}}, or with `site` given that site's counts and floors only
+        (None if unknown). Built once per version."""
+        built = self._build()[1]
+        if site is None:
+            return built
+        return built["sites"].get(site)
+
+    def body(self):
+        """(version, summary() as JSON bytes), serialised once per version."""
+        version, built, body = self._build()
+        if body is None:
+            body = json.dumps(built, separators=(",", ":")).encode()
+            with self._lock:
+                if self._built[0] == version:
+                    self._built = (version, built, body)
+        return version, body
+
+    def stats(self):
+        return {"workers": len(self), "floors": len(self._floors), "sites": len(self._sites),
+                "version": self.version}
+
+
+def counts(counters):
+    """The summary entry for one list of FIELDS."""
+    workers, fallen, low_battery, stale, offline, heartrate_sum, heartrate_count = counters
+    return {"workers": workers, "fallen": fallen, "low_battery": low_battery, "stale": stale,
+            "offline": offline,
+            "heartrate_avg": round(heartrate_sum / heartrate_count, 1) if heartrate_count else None}
@@ -0,0 +1,199 @@
+# Packs several worker readings into one LoRa payload
+#
+# The Packet struct in the LoRa sketches has a 32-byte payload that is copied
+# with strncpy and printed with Serial.println, so a frame has to be at most
+# 31 bytes of text with no NUL or newline. Frames are therefore
+#
+#   "#" + base64url(binary frame), no padding
+#
+# and the binary frame is
+#
+#   version byte (FRAME_VERSION), then one record per reading:
+#     header byte:  bits 0-2  sensor code (SENSOR_CODES)
+#                   bit 3     same floor/worker as the previous record
+#                   bit 4     fall flag (falldetect only)
+#     floor varint, worker varint    unless bit 3 is set
+#     value varint                   except falldetect, whose value is bit 4
+#
+# Varints are unsigned LEB128. Values go as whole numbers, the precision
+# WorkerStateStore keeps (the sketches print heart rate as a float, e.g.
+# "75.00", which arrives as "75"). Readings that do not fit this form (IDs
+# that are not small non-negative integers, non-numeric values, unknown
+# sensors) are sent as the existing ASCII "/floor/worker/sensor/value".
+
+import base64
+import binascii
+
+from state_store import parse_fall
+
+FRAME_MARKER = "#"
+FRAME_VERSION = 1
+MAX_PAYLOAD = 31                                # Packet.payload minus the NUL
+MAX_FRAME_BYTES = (MAX_PAYLOAD - 1) * 6 // 8    # Binary bytes that fit after base64
+
+SENSOR_CODES = {"heartrate": 0, "battery": 1, "falldetect": 2, "status": 3, "hrmin": 4, "hrmax": 5}
+SENSOR_NAMES = {code: name for name, code in SENSOR_CODES.items()}
+STATUS_CODES = {"OK": 0, "Responding": 1, "online": 2}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+SAME_WORKER = 0x08
+FALL_FLAG = 0x10
+MAX_ID = 1 << 14                # Two varint bytes
+
+
+def write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]        # IndexError on a truncated frame
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+        if shift > 28:
+            raise ValueError("varint too long")
+
+
+def _small_int(text, limit):
+    # Only plain decimal, so an ID decodes back to exactly the same string
+    if not text.isdigit() or (len(text) > 1 and text[0] == "0"):
+        return None
+    value = int(text)
+    return value if value < limit else None
+
+
+def _whole_number(text, limit):
+    # Truncated like WorkerStateStore.update does
+    try:
+        value = float(text)
+        number = int(value)
+    except (ValueError, OverflowError):
+        return None
+    return number if 0 <= value and number < limit else None
+
+
+def encode_reading(floor, worker, sensor, value, previous=None):
+    """Binary record for one reading, or None if it has no compact form."""
+    code = SENSOR_CODES.get(sensor)
+    floor_id = _small_int(floor, MAX_ID)
+    worker_id = _small_int(worker, MAX_ID)
+    if code is None or floor_id is None or worker_id is None:
+        return None
+
+    out = bytearray(1)
+    header = code
+    if previous == (floor, worker):
+        header |= SAME_WORKER
+    else:
+        write_varint(out, floor_id)
+        write_varint(out, worker_id)
+
+    if sensor == "falldetect":
+        try:
+            if parse_fall(value):
+                header |= FALL_FLAG
+        except ValueError:
+            return None
+    elif sensor == "status":
+        if value not in STATUS_CODES:
+            return None
+        write_varint(out, STATUS_CODES[value])
+    else:
+        number = _whole_number(value, 1 << 21)
+        if number is None:
+            return None
+        write_varint(out, number)
+
+    out[0] = header
+    return bytes(out)
+
+
+def _finish(frame):
+    return FRAME_MARKER + base64.urlsafe_b64encode(bytes(frame)).decode().rstrip("=")
+
+
+def encode_frames(readings):
+    """Pack (floor, worker, sensor, value) readings into as few payloads as possible.
+
+    Returns payload strings in input order, ASCII fallbacks after the frames.
+    """
+    payloads, fallback = [], []
+    frame = bytearray((FRAME_VERSION,))
+    previous = None
+    for floor, worker, sensor, value in readings:
+        record = encode_reading(floor, worker, sensor, value, previous)
+        if record is None:
+            fallback.append(f"/{floor}/{worker}/{sensor}/{value}")
+            continue
+        if len(frame) + len(record) > MAX_FRAME_BYTES:
+            payloads.append(_finish(frame))
+            frame = bytearray((FRAME_VERSION,))
+            record = encode_reading(floor, worker, sensor, value)
+        frame += record
+        previous = (floor, worker)
+    if len(frame) > 1:
+        payloads.append(_finish(frame))
+    return payloads + fallback
+
+
+def is_frame(payload):
+    return payload.startswith(FRAME_MARKER)
+
+
+def decode_frame(payload):
+    """Readings in a "#..." payload as (floor, worker, sensor, value) strings.
+
+    Returns None for anything that is not a complete, well-formed frame;
+    a frame is never half applied.
+    """
+    if not payload.startswith(FRAME_MARKER):
+        return None
+    text = payload[1:]
+    try:
+        data = base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+    except (binascii.Error, ValueError):
+        return None
+    if len(data) < 2 or data[0] != FRAME_VERSION:
+        return None
+
+    readings = []
+    floor = worker = None
+    pos = 1
+    try:
+        while pos < len(data):
+            header = data[pos]
+            pos += 1
+            sensor = SENSOR_NAMES.get(header & 0x07)
+            if sensor is None or header & 0xE0:
+                return None
+            if header & SAME_WORKER:
+                if floor is None:
+                    return None
+            else:
+                floor_id, pos = read_varint(data, pos)
+                worker_id, pos = read_varint(data, pos)
+                floor, worker = str(floor_id), str(worker_id)
+
+            if sensor == "falldetect":
+                value = "Fallen" if header & FALL_FLAG else "OK"
+            else:
+                if header & FALL_FLAG:
+                    return None
+                number, pos = read_varint(data, pos)
+                if sensor == "status":
+                    value = STATUS_NAMES.get(number)
+                    if value is None:
+                        return None
+                else:
+                    value = str(number)
+            readings.append((floor, worker, sensor, value))
+    except (IndexError, ValueError):
+        return None
+    return readings
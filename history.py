@@ -0,0 +1,101 @@
+# Fixed-size reading history per worker and sensor
+
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+HISTORY_SIZE = 3600         # Samples kept per worker and sensor (2 h at the sketches' 2 s rate)
+
+
+class RingBuffer:
+    """(timestamp, value) samples in two flat arrays, oldest overwritten first.
+
+    The arrays grow on demand up to `size` and are then reused in place,
+    so memory never exceeds 12 bytes per sample slot.
+    """
+
+    __slots__ = ("size", "times", "values", "head")
+
+    def __init__(self, size):
+        self.size = size
+        self.times = array("d")     # Unix seconds
+        self.values = array("f")
+        self.head = 0               # Next slot to overwrite once full
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self, timestamp, value):
+        if len(self.times) < self.size:
+            self.times.append(timestamp)
+            self.values.append(value)
+        else:
+            self.times[self.head] = timestamp
+            self.values[self.head] = value
+            self.head = (self.head + 1) % self.size
+
+    def _ordered(self, data):
+        # Oldest first. A no-op until the buffer has wrapped.
+        if self.head == 0:
+            return data
+        return data[self.head:] + data[:self.head]
+
+    def window(self, start=None, end=None):
+        """Return (times, values) arrays for start <= t <= end, oldest first."""
+        times = self._ordered(self.times)
+        values = self._ordered(self.values)
+        lo = 0 if start is None else bisect_left(times, start)
+        hi = len(times) if end is None else bisect_right(times, end)
+        return times[lo:hi], values[lo:hi]
+
+
+def downsample(times, values, step):
+    """min/max/avg per `step`-second bucket, aligned to multiples of step."""
+    buckets = []
+    lo = 0
+    while lo < len(times):
+        bucket = times[lo] - times[lo] % step
+        hi = bisect_left(times, bucket + step, lo)
+        chunk = values[lo:hi]
+        buckets.append({
+            "t": bucket,
+            "min": min(chunk),
+            "max": max(chunk),
+            "avg": sum(chunk) / len(chunk),
+            "count": len(chunk),
+        })
+        lo = hi
+    return buckets
+
+
+class History:
+    def __init__(self, size=HISTORY_SIZE):
+        self.size = size
+        self._buffers = {}          # (site, floor, worker, sensor) -> RingBuffer
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buffers)
+
+    def record(self, site, floor, worker, sensor, value, timestamp):
+        if value is None:
+            return      # Not a numeric sensor, e.g. status
+        key = (site, floor, worker, sensor)
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            with self._lock:
+                buffer = self._buffers.setdefault(key, RingBuffer(self.size))
+        buffer.append(timestamp, value)
+
+    def query(self, site, floor, worker, sensor, start=None, end=None, step=None):
+        """Raw [t, value] points, or downsampled buckets when step is given.
+
+        Returns None if nothing was ever recorded for that worker and sensor.
+        """
+        buffer = self._buffers.get((site, floor, worker, sensor))
+        if buffer is None:
+            return None
+        times, values = buffer.window(start, end)
+        if step:
+            return downsample(times, values, step)
+        return [[t, v] for t, v in zip(times, values)]
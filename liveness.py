@@ -0,0 +1,185 @@
+# Flags workers whose sensors have gone quiet, shared by both apps
+#
+# Every reading calls seen(). Each (worker, sensor) sits in one slot of a
+# hashed timer wheel, the slot of the tick at which it would go stale (or
+# offline, once stale). A reading moves the entry to its new slot, two set
+# operations, so tick() only ever looks at the one slot that is due: the
+# entries that actually expire. Workers that keep reporting never come up,
+# and a tick costs the same with a hundred workers as with a hundred
+# thousand. Deadlines further out than the wheel's span wait in the last
+# slot and are placed again when it comes round.
+
+import logging
+import math
+import threading
+import time
+
+LIVE, STALE, OFFLINE = "live", "stale", "offline"
+TICK = 0.5              # Seconds per wheel slot, how late a state change may be noticed
+SLOTS = 4096            # Wheel span is SLOTS * TICK seconds
+
+log = logging.getLogger(__name__)
+
+
+class LivenessTracker(threading.Thread):
+    """Tracks when each worker's sensors were last heard from.
+
+    `timeouts` maps sensor -> (stale after, offline after) in seconds;
+    sensors not in it are not tracked. A worker is offline when every
+    tracked sensor it has reported is offline, stale when any is stale
+    or offline, and live otherwise. on_change(key, state, silent) is
+    called whenever a worker's state or its set of silent sensors
+    changes, from the thread that noticed: tick()'s own, or the ingest
+    thread whose reading brought a worker back.
+    """
+
+    def __init__(self, timeouts, on_change, tick=TICK, slots=SLOTS):
+        super().__init__(daemon=True, name="liveness")
+        self.timeouts = timeouts
+        self.on_change = on_change
+        self.tick_seconds = tick
+        self.changes = 0
+        self.ticks = 0
+        self.expired = 0                # Entries looked at by tick(), stale or not
+        self._wheel = [set() for _ in range(slots)]
+        self._slot_of = {}              # (key, sensor) -> index of its wheel slot
+        self._seen = {}                 # (key, sensor) -> time.time() of the last reading
+        self._sensors = {}              # key -> {sensor: state}
+        self._time = time.time()        # Wheel time: the tick the cursor is on
+        self._cursor = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def __len__(self):
+        return len(self._sensors)
+
+    def _place(self, entry, deadline):
+        ticks = math.ceil((deadline - self._time) / self.tick_seconds)
+        slot = (self._cursor + min(max(ticks, 1), len(self._wheel) - 1)) % len(self._wheel)
+        old = self._slot_of.get(entry)
+        if old != slot:
+            if old is not None:
+                self._wheel[old].discard(entry)
+            self._wheel[slot].add(entry)
+            self._slot_of[entry] = slot
+
+    def seen(self, key, sensor, timestamp=None):
+        """Record a reading from `sensor` of the worker `key`."""
+        timeouts = self.timeouts.get(sensor)
+        if timeouts is None:
+            return
+        entry = (key, sensor)
+        now = time.time()
+        if timestamp is None:
+            timestamp = now
+        now = max(now, timestamp)
+        with self._lock:
+            if timestamp < self._seen.get(entry, 0.0):
+                return      # Older than what we have, e.g. replayed from a log
+            self._seen[entry] = timestamp
+            sensors = self._sensors.get(key)
+            if sensors is None:
+                sensors = self._sensors[key] = {}
+            if sensors.get(sensor) == LIVE:
+                self._place(entry, timestamp + timeouts[0])
+                return
+            before = worker_state(sensors)
+            sensors[sensor] = LIVE
+            self._settle(entry, sensors, sensor, now)
+            after = worker_state(sensors)
+        if after != before:
+            self._changed(key)
+
+    def _settle(self, entry, sensors, sensor, now):
+        # Puts an entry in the state its silence calls for and files it
+        # under its next deadline; offline entries leave the wheel
+        stale_after, offline_after = self.timeouts[sensor]
+        last = self._seen[entry]
+        silent = now - last
+        if silent >= offline_after:
+            sensors[sensor] = OFFLINE
+            slot = self._slot_of.pop(entry, None)
+            if slot is not None:
+                self._wheel[slot].discard(entry)
+            return
+        if silent >= stale_after:
+            sensors[sensor] = STALE
+            self._place(entry, last + offline_after)
+        else:
+            sensors[sensor] = LIVE
+            self._place(entry, last + stale_after)
+
+    def _changed(self, key):
+        # Passes the state as it is now, not as it was when the change was
+        # seen: a tick and a reading may report the same worker at once,
+        # and whichever handler runs last must leave the latest state
+        self.changes += 1
+        try:
+            self.on_change(key, *self.state(key))
+        except Exception:
+            log.exception("Liveness change handler failed for %s", key)
+
+    def tick(self, now=None):
+        """Advance the wheel to `now`, settling every entry that came due."""
+        now = time.time() if now is None else now
+        changed = {}
+        with self._lock:
+            steps = int((now - self._time) / self.tick_seconds)
+            if steps > len(self._wheel):
+                # Far behind (suspended machine?): one lap settles everything
+                self._time += (steps - len(self._wheel)) * self.tick_seconds
+                steps = len(self._wheel)
+            for _ in range(steps):
+                self._cursor = (self._cursor + 1) % len(self._wheel)
+                self._time += self.tick_seconds
+                # A fresh set: one that held many entries and had them moved
+                # out keeps its size, and looping over it would cost as much
+                due, self._wheel[self._cursor] = self._wheel[self._cursor], set()
+                if not due:
+                    continue
+                for entry in due:
+                    del self._slot_of[entry]
+                    key, sensor = entry
+                    sensors = self._sensors[key]
+                    if key not in changed:
+                        changed[key] = worker_state(sensors)
+                    self._settle(entry, sensors, sensor, now)
+                self.expired += len(due)
+            self.ticks += 1
+            changed = [key for key, before in changed.items() if worker_state(self._sensors[key]) != before]
+        for key in changed:
+            self._changed(key)
+        return len(changed)
+
+    def state(self, key):
+        """(state, silent sensors) of a worker, or None if it is not tracked."""
+        with self._lock:
+            sensors = self._sensors.get(key)
+            return None if sensors is None else worker_state(sensors)
+
+    def counts(self):
+        """Tracked workers by state."""
+        with self._lock:
+            states = [worker_state(sensors)[0] for sensors in self._sensors.values()]
+        return {state: states.count(state) for state in (LIVE, STALE, OFFLINE)}
+
+    def stats(self):
+        return {"workers": len(self), "by_state": self.counts(), "changes": self.changes,
+                "ticks": self.ticks, "expired": self.expired}
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.wait(self.tick_seconds):
+            self.tick()
+
+
+def worker_state(sensors):
+    """(state, sorted silent sensors) for a worker's {sensor: state}."""
+    silent = sorted(sensor for sensor, state in sensors.items() if state != LIVE)
+    if not silent:
+        return LIVE, silent
+    if len(silent) == len(sensors) and all(sensors[sensor] == OFFLINE for sensor in silent):
+        return OFFLINE, silent
+    return STALE, silent
@@ -0,0 +1,99 @@
+# Logging setup shared by the Site A and Central apps
+#
+# Loggers put records on a queue and a listener thread formats and writes
+# them, so the MQTT and serial threads never wait on stdout. Each part of
+# the system logs under its own name ("site.mqtt", "central.serial",
+# "serial_link", "archive", ...) so levels can be set per subsystem.
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+RATE_LIMIT_INTERVAL = 10.0      # Seconds an identical warning or error is held back
+
+_listener = None                # QueueListener of the current setup
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through one of each repeated WARNING-or-worse message per interval.
+
+    Messages count as repeats when they come from the same logger with
+    the same format string, whatever the arguments. The next one let
+    through says how many were held back in between.
+    """
+
+    def __init__(self, interval=RATE_LIMIT_INTERVAL):
+        super().__init__()
+        self.interval = interval
+        self.suppressed = 0
+        self._seen = {}             # (logger, format string) -> [time let through, held back since]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            return True
+        key = (record.name, record.msg)
+        with self._lock:
+            seen = self._seen.get(key)
+            if seen is not None and record.created - seen[0] < self.interval:
+                seen[1] += 1
+                self.suppressed += 1
+                return False
+            held_back = seen[1] if seen is not None else 0
+            self._seen[key] = [record.created, 0]
+        if held_back:
+            record.msg = f"{record.msg} [{held_back} more like this held back]"
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # The stock prepare() formats the message on the calling thread. The
+    # queue never leaves this process, so pass the record through untouched
+    # and let the listener thread do the formatting.
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level="INFO", levels=None, stream=None, rate_limit=RATE_LIMIT_INTERVAL):
+    """Route all logging through a queue to one stream handler.
+
+    `levels` maps logger names to levels, e.g. {"central.store": "DEBUG"}.
+    Calling it again replaces the previous setup. Returns the running
+    QueueListener; stop_logging() (run at exit) flushes and stops it.
+    """
+    global _listener
+    stop_logging()
+    handler = logging.StreamHandler(sys.stdout if stream is None else stream)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    if rate_limit:
+        queue_handler.addFilter(RateLimitFilter(rate_limit))
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    for name, name_level in (levels or {}).items():
+        logging.getLogger(name).setLevel(name_level)
+
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    _listener = listener
+    return listener
+
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
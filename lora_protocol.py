@@ -0,0 +1,139 @@
+# Parser for the lines LORA_CENTRAL.INO prints on its serial port
+
+from operator import itemgetter
+
+from state_store import FALLEN_VALUES, NOT_FALLEN_VALUES
+
+# Line kinds, in the order the gateway prints them for one packet
+VALID = 0               # Got valid message: From SITE_A: /1/2/heartrate/75
+RSSI = 1                # RSSI: -41
+CHECKSUM_RECEIVED = 2   # Received Checksum: 3265
+CHECKSUM_CALCULATED = 3 # Calculated Checksum: 3265
+SENDING = 4             # Sending: From CENTRAL To SITE_A: ACK
+SENT_CHECKSUM = 5       # With checksum: 2011
+SENT_REPLY = 6          # Sent a reply
+IGNORED = 7             # Ignored message: From SITE_B To OTHER: ...
+RECEIVE_FAILED = 8      # Receive failed
+STATUS = 9              # Startup and radio setup messages
+MALFORMED = 10          # Looked like one of the above but did not parse
+UNKNOWN = 11            # Anything else, e.g. line noise
+FRAME = 12              # Got valid message: From SITE_A: #AQABAksJZA (frame_codec)
+
+KIND_NAMES = ("valid", "rssi", "checksum_received", "checksum_calculated", "sending",
+              "sent_checksum", "sent_reply", "ignored", "receive_failed", "status",
+              "malformed", "unknown", "frame")
+
+SENSORS = frozenset(("heartrate", "battery", "falldetect", "status", "hrmin", "hrmax"))
+FALL_VALUES = frozenset(FALLEN_VALUES + NOT_FALLEN_VALUES)
+
+VALID_PREFIX = b"Got valid message: From "
+VALID_PREFIX_LEN = len(VALID_PREFIX)
+NUMBER_PREFIXES = tuple((prefix, kind, len(prefix)) for prefix, kind in (
+    (b"RSSI: ", RSSI),
+    (b"Received Checksum: ", CHECKSUM_RECEIVED),
+    (b"Calculated Checksum: ", CHECKSUM_CALCULATED),
+    (b"With checksum: ", SENT_CHECKSUM),
+))
+STATUS_PREFIXES = (b"LoRa radio init", b"Set Freq to", b"setFrequency failed", b"SSD1306")
+
+
+class Line(tuple):
+    """One parsed gateway line. Fields a kind does not use are None.
+
+    A tuple subclass built with tuple.__new__, which is cheaper than a
+    regular class on this path.
+    """
+
+    __slots__ = ()
+    FIELDS = ("kind", "sender", "floor", "worker", "sensor", "value", "number", "payload")
+
+    kind = property(itemgetter(0))
+    sender = property(itemgetter(1))        # Site ID the packet came from
+    floor = property(itemgetter(2))
+    worker = property(itemgetter(3))
+    sensor = property(itemgetter(4))
+    value = property(itemgetter(5))         # Raw reading, still a string
+    number = property(itemgetter(6))        # RSSI or checksum
+    payload = property(itemgetter(7))       # Payload text of a VALID/FRAME/MALFORMED line
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={value!r}" for name, value in zip(self.FIELDS[1:], self[1:])
+                           if value is not None)
+        return f"Line({KIND_NAMES[self.kind]}, {fields})"
+
+
+_new = tuple.__new__
+
+
+def _line(kind):
+    return _new(Line, (kind, None, None, None, None, None, None, None))
+
+
+# Lines without a reading share these, so they allocate nothing
+_MALFORMED = _line(MALFORMED)
+_UNKNOWN = _line(UNKNOWN)
+_SENT_REPLY = _line(SENT_REPLY)
+_RECEIVE_FAILED = _line(RECEIVE_FAILED)
+_STATUS = _line(STATUS)
+_SENDING = _line(SENDING)
+_IGNORED = _line(IGNORED)
+
+
+def _plausible(sensor, value):
+    # A value a flipped or dropped byte has not obviously mangled: a fall
+    # status, a status word, or a number as the sketches print them ("75.00")
+    if sensor == "falldetect":
+        return value in FALL_VALUES
+    if sensor == "status":
+        return value.isalpha()
+    return value.replace(".", "", 1).isdigit()
+
+
+def parse_line(raw):
+    """Classify one raw serial line (bytes, with or without line ending).
+
+    Never raises: corrupted input comes back as MALFORMED or UNKNOWN.
+    """
+    raw = raw.strip()
+
+    if raw.startswith(VALID_PREFIX):
+        try:
+            text = raw.decode("ascii")
+        except UnicodeDecodeError:
+            return _MALFORMED
+        sender, sep, payload = text[VALID_PREFIX_LEN:].partition(": ")
+        if not sep or not sender:
+            return _MALFORMED
+
+        if payload[:1] == "#":
+            # Several readings packed by frame_codec, decoded by the caller
+            return _new(Line, (FRAME, sender, None, None, None, None, None, payload))
+
+        # "/floor/worker/sensor/value"
+        parts = payload.split("/")
+        if (len(parts) != 5 or parts[0] or not parts[1] or not parts[2]
+                or parts[3] not in SENSORS or not _plausible(parts[3], parts[4])):
+            return _new(Line, (MALFORMED, sender, None, None, None, None, None, payload))
+        return _new(Line, (VALID, sender, parts[1], parts[2], parts[3], parts[4], None, payload))
+
+    first = raw[:1]
+    if first == b"S":
+        if raw == b"Sent a reply":
+            return _SENT_REPLY
+        if raw.startswith(b"Sending: "):
+            return _SENDING
+    elif first == b"R" and raw == b"Receive failed":
+        return _RECEIVE_FAILED
+    elif first == b"I" and raw.startswith(b"Ignored message: "):
+        return _IGNORED
+
+    for prefix, kind, length in NUMBER_PREFIXES:
+        if raw.startswith(prefix):
+            try:
+                return _new(Line, (kind, None, None, None, None, None, int(raw[length:]), None))
+            except ValueError:
+                return _MALFORMED
+
+    if raw.startswith(STATUS_PREFIXES):
+        return _STATUS
+    return _UNKNOWN
@@ -0,0 +1,169 @@
+# Counters and histograms for /metrics, in the Prometheus text format
+#
+# Recording never takes a lock: each thread updates its own shard (a
+# plain dict found through threading.local) and a scrape adds the shards
+# up. Shards of threads that have exited are folded into one, so the
+# per-request threads of the Flask dev server do not pile up.
+
+import threading
+from bisect import bisect_left
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                   0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)   # Seconds
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                     for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Sharded:
+    """Per-thread shards of {label values: state}, merged on scrape."""
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []           # (thread, shard) for threads that have recorded
+        self._retired = {}          # Merged shards of exited threads
+        self._lock = threading.Lock()
+
+    def _new_shard(self):
+        shard = {}
+        with self._lock:
+            self._shards.append((threading.current_thread(), shard))
+        self._local.shard = shard
+        return shard
+
+    def _merged(self):
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    self._merge(self._retired, shard)
+            self._shards = live
+            total = {}
+            self._merge(total, self._retired)
+            for _, shard in live:
+                self._merge(total, shard)
+        return total
+
+
+class Counter(_Sharded):
+    TYPE = "counter"
+
+    def inc(self, labels=(), amount=1):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge(self, total, shard):
+        for labels, value in list(shard.items()):
+            total[labels] = total.get(labels, 0) + value
+
+    def samples(self):
+        for labels, value in sorted(self._merged().items()):
+            yield self.name, _labels(self.labelnames, labels), value
+
+
+class Histogram(_Sharded):
+    TYPE = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        state = shard.get(labels)
+        if state is None:
+            # Per-bucket counts, then +Inf, then the sum
+            state = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def _merge(self, total, shard):
+        for labels, state in list(shard.items()):
+            merged = total.get(labels)
+            if merged is None:
+                total[labels] = list(state)
+            else:
+                for i, value in enumerate(state):
+                    merged[i] += value
+
+    def samples(self):
+        for labels, state in sorted(self._merged().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                yield (self.name + "_bucket", _labels(self.labelnames + ("le",), labels + (_number(bound),)),
+                       cumulative)
+            yield self.name + "_sum", _labels(self.labelnames, labels), state[-1]
+            yield self.name + "_count", _labels(self.labelnames, labels), cumulative
+
+
+class Callback:
+    """Read at scrape time from existing state: fn() returns a number or {label values: number}."""
+
+    def __init__(self, name, help, fn, labelnames=(), type="gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+        self.TYPE = type
+
+    def samples(self):
+        value = self.fn()
+        if not isinstance(value, dict):
+            value = {(): value}
+        for labels, number in value.items():
+            if number is not None:
+                yield self.name, _labels(self.labelnames, labels), number
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, fn, labelnames=(), type="gauge"):
+        return self._add(Callback(name, help, fn, labelnames, type))
+
+    def render(self):
+        """The Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.TYPE}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_number(value)}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,176 @@
+# Priority lanes so fall alerts are never stuck behind routine telemetry
+
+import asyncio
+import json
+import threading
+import time
+from collections import Counter, deque
+
+from state_store import FALLEN_VALUES, NOT_FALLEN_VALUES
+
+ALERT = 0
+TELEMETRY = 1
+LANE_NAMES = {ALERT: "alert", TELEMETRY: "telemetry"}
+
+
+def parse_actl(payload):
+    """Return (floor, worker, status) from the worker sketches' actl JSON, or None."""
+    try:
+        data = json.loads(payload)
+        return str(data["floor"]), str(data["worker"]), str(data["status"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def is_alert(sensor, value, fallen=None):
+    """Whether one reading goes in the alert lane.
+
+    A fall, the all-clear of a worker known to have fallen (`fallen` is
+    their last stored fall state, None if unknown) and a "Responding"
+    status (someone is on the way to a fall) do. The "OK" every worker
+    sketch repeats while nothing happens is routine telemetry.
+    """
+    if sensor == "falldetect":
+        return value in FALLEN_VALUES or (fallen is True and value in NOT_FALLEN_VALUES)
+    return sensor == "status" and value == "Responding"
+
+
+def classify_topic(topic, payload, fallen=None):
+    """Lane for an MQTT message, see is_alert(). `fallen` is the last
+    stored fall state of the worker it is about."""
+    if topic == "actl":
+        status = parse_actl(payload)
+        return ALERT if status is not None and is_alert("falldetect", status[2], fallen) else TELEMETRY
+    return ALERT if is_alert(topic.rpartition("/")[2], payload, fallen) else TELEMETRY
+
+
+class LatencyTracker:
+    """Keeps the last `size` latency samples (seconds) for percentile reporting."""
+
+    def __init__(self, size=1000):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def stats(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {"count": 0}
+
+        def pct(p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 3)
+
+        return {
+            "count": self.count,
+            "p50_ms": pct(0.50),
+            "p99_ms": pct(0.99),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+def lane_trackers():
+    return {lane: LatencyTracker() for lane in LANE_NAMES}
+
+
+def lane_stats(trackers):
+    return {LANE_NAMES[lane]: tracker.stats() for lane, tracker in trackers.items()}
+
+
+class Lanes:
+    """The two lanes LaneQueue and AsyncLaneQueue share.
+
+    The telemetry lane is bounded and drops its oldest entry when full.
+    The alert lane is never dropped from. An alert put with a `key` (the
+    worker and sensor a reading is for) drops any telemetry still queued
+    under the same key: the alert is newer, and jumping ahead of it the
+    older reading would be stored over it.
+    """
+
+    def __init__(self, max_telemetry=10000):
+        self.max_telemetry = max_telemetry
+        self.dropped = 0
+        self.superseded = 0
+        self._alerts = deque()
+        self._telemetry = deque()       # (key, item)
+        self._keys = Counter()          # key -> its entries in _telemetry
+
+    def __len__(self):
+        return len(self._alerts) + len(self._telemetry)
+
+    def _put(self, item, lane, key):
+        if lane == ALERT:
+            if key is not None and key in self._keys:
+                kept = deque(entry for entry in self._telemetry if entry[0] != key)
+                self.superseded += len(self._telemetry) - len(kept)
+                self._telemetry = kept
+                del self._keys[key]
+            self._alerts.append(item)
+            return
+        if len(self._telemetry) >= self.max_telemetry:
+            self._forget(self._telemetry.popleft()[0])
+            self.dropped += 1
+        self._telemetry.append((key, item))
+        if key is not None:
+            self._keys[key] += 1
+
+    def _take(self):
+        if self._alerts:
+            return ALERT, self._alerts.popleft()
+        key, item = self._telemetry.popleft()
+        self._forget(key)
+        return TELEMETRY, item
+
+    def _forget(self, key):
+        if key is not None:
+            self._keys[key] -= 1
+            if not self._keys[key]:
+                del self._keys[key]
+
+
+class LaneQueue(Lanes):
+    """Two-lane queue: get() always drains the alert lane first."""
+
+    def __init__(self, max_telemetry=10000):
+        super().__init__(max_telemetry)
+        self._cond = threading.Condition()
+
+    def put(self, item, lane=TELEMETRY, key=None):
+        with self._cond:
+            self._put(item, lane, key)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Return (lane, item), or None if nothing arrived within timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._alerts and not self._telemetry:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            return self._take()
+
+
+class AsyncLaneQueue(Lanes):
+    """LaneQueue for the asyncio run mode, used from one event loop only."""
+
+    def __init__(self, max_telemetry=10000):
+        super().__init__(max_telemetry)
+        self._ready = asyncio.Event()
+
+    def put(self, item, lane=TELEMETRY, key=None):
+        self._put(item, lane, key)
+        self._ready.set()
+
+    async def get(self):
+        """Return (lane, item), waiting for one if both lanes are empty."""
+        while not self._alerts and not self._telemetry:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._take()
@@ -0,0 +1,189 @@
+# Production launch: one ingest process and N HTTP worker processes
+#
+#   python production.py site [--workers 4] [--host localhost] [--port 5000]
+#   python production.py central [--workers 4] [--port 5001]
+#
+# The ingest process imports the app as usual: it owns the MQTT client,
+# the serial ports, the store and everything that writes. A
+# shared_snapshot.SnapshotPublisher copies each new /api/data body, and
+# every event the app's broker publishes, into a memory-mapped file. The
+# workers are forked from it and serve /, /api/data and /api/stream from
+# that file with a SnapshotReader standing in for snapshot_cache and
+# broker, so dashboard polling and streams scale with the workers and
+# never touch the ingest process. Everything else (history,
+# incidents, metrics, link stats, ...) is rarely asked for and needs the
+# live store, so a worker proxies it to the ingest process's own HTTP
+# server on localhost.
+#
+# With gunicorn instead of the built-in prefork, run the ingest side alone
+# and point gunicorn at worker_app():
+#
+#   python production.py site --workers 0 --ingest-port 6000
+#   gunicorn -w 4 -b localhost:5000 "production:worker_app('site', 'localhost:6000')"
+#
+# POSIX only (fork, and gunicorn is POSIX only too). All processes share
+# the secret key because it is made at import, before the fork; with
+# gunicorn set SECRET_KEY in the environment of both sides.
+
+import argparse
+import http.client
+import importlib
+import logging
+import os
+import signal
+import socket
+import sys
+from log_setup import setup_logging, stop_logging
+from shared_snapshot import SnapshotPublisher, SnapshotReader, default_path
+
+MODULES = {"site": "app", "central": "centralApp"}
+DEFAULT_PORTS = {"site": 5000, "central": 5001}
+LOCAL_PATHS = ("/", "/api/data", "/api/stream", "/login", "/logout", "/api/check-session")
+PROXY_TIMEOUT = 30          # Seconds a proxied request may take in the ingest process
+HOP_BY_HOP = {"connection", "keep-alive", "transfer-encoding", "te", "trailer", "upgrade",
+              "proxy-authorization", "proxy-authenticate"}
+
+log = logging.getLogger("production")
+
+
+def load(name):
+    module = importlib.import_module(MODULES[name])
+    secret = os.environ.get("SECRET_KEY")
+    if secret:
+        module.app.secret_key = secret
+    return module
+
+
+class Router:
+    """WSGI app of a worker: dashboard paths to the Flask app, the rest
+    proxied to the ingest process at `upstream` (host:port)."""
+
+    def __init__(self, app, upstream):
+        self.app = app
+        self.upstream = upstream
+        self.proxied = 0
+        self.proxy_errors = 0
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if path in LOCAL_PATHS or path.startswith("/static/"):
+            return self.app(environ, start_response)
+        return self.proxy(environ, start_response)
+
+    def proxy(self, environ, start_response):
+        self.proxied += 1
+        target = environ.get("SCRIPT_NAME", "") + environ.get("PATH_INFO", "")
+        if environ.get("QUERY_STRING"):
+            target += "?" + environ["QUERY_STRING"]
+        headers = {key[5:].replace("_", "-").title(): value for key, value in environ.items()
+                   if key.startswith("HTTP_") and key[5:].replace("_", "-").lower() not in HOP_BY_HOP}
+        if environ.get("CONTENT_TYPE"):
+            headers["Content-Type"] = environ["CONTENT_TYPE"]
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        body = environ["wsgi.input"].read(length) if length else None
+
+        connection = http.client.HTTPConnection(self.upstream, timeout=PROXY_TIMEOUT)
+        try:
+            connection.request(environ["REQUEST_METHOD"], target, body, headers)
+            response = connection.getresponse()
+            content = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self.proxy_errors += 1
+            log.error("Proxy to ingest process at %s failed: %s", self.upstream, e)
+            start_response("502 Bad Gateway", [("Content-Type", "text/plain")])
+            return [b"Ingest process unavailable"]
+        finally:
+            connection.close()
+        start_response(f"{response.status} {response.reason}",
+                       [(name, value) for name, value in response.getheaders()
+                        if name.lower() not in HOP_BY_HOP and name.lower() != "content-length"])
+        return [content]
+
+
+def worker_app(name, upstream, path=None):
+    """The WSGI app of one HTTP worker: the app module with its snapshot
+    cache and push broker swapped for a SnapshotReader of `path`."""
+    module = load(name)
+    reader = SnapshotReader(path or default_path(name))
+    module.snapshot_cache = reader
+    module.broker = reader
+    return Router(module.app, upstream)
+
+
+def serve_worker(name, upstream, path, sock, host, port):
+    from werkzeug.serving import make_server
+    # The parent's log listener thread did not survive the fork
+    module = sys.modules[MODULES[name]]
+    setup_logging(module.LOG_LEVEL, module.LOG_LEVELS)
+    signal.signal(signal.SIGTERM, lambda *args: os._exit(0))
+    server = make_server(host, port, worker_app(name, upstream, path), threaded=True, fd=sock.fileno())
+    log.info("Worker %d serving on %s:%d", os.getpid(), host, port)
+    server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python production.py")
+    parser.add_argument("name", choices=sorted(MODULES))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="HTTP worker processes, 0 to run only the ingest side")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, help="dashboard port, 5000 for site and 5001 for central")
+    parser.add_argument("--ingest-port", type=int, default=0, help="port of the ingest process on localhost")
+    parser.add_argument("--snapshot", help="shared snapshot file (default in /dev/shm)")
+    args = parser.parse_args(argv)
+    if not hasattr(os, "fork"):
+        parser.error("needs fork(), run the app directly on this platform")
+    port = args.port or DEFAULT_PORTS[args.name]
+    path = args.snapshot or default_path(args.name)
+
+    module = load(args.name)
+    publisher = SnapshotPublisher(module.snapshot_cache, path, module.broker)
+    # Both sockets exist before the fork, so workers know where to proxy
+    # and share one accept queue
+    internal = socket.create_server(("localhost", args.ingest_port))
+    upstream = "localhost:%d" % internal.getsockname()[1]
+    children = []
+    if args.workers:
+        sock = socket.create_server((args.host, port))
+        for _ in range(args.workers):
+            pid = os.fork()
+            if pid == 0:
+                internal.close()
+                try:
+                    serve_worker(args.name, upstream, path, sock, args.host, port)
+                except BaseException:
+                    log.exception("Worker %d failed", os.getpid())
+                    stop_logging()      # os._exit() skips the atexit flush
+                    os._exit(1)
+                os._exit(0)
+            children.append(pid)
+        sock.close()
+
+    from werkzeug.serving import make_server
+    setup_logging(module.LOG_LEVEL, module.LOG_LEVELS)
+    module.start_services()
+    module.start_ingest()
+    publisher.start()
+    log.info("Ingest process %d, %d HTTP workers on %s:%d, snapshots in %s",
+             os.getpid(), len(children), args.host, port, path)
+
+    def shutdown(*_):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, shutdown)
+    server = make_server("localhost", internal.getsockname()[1], module.app, threaded=True,
+                         fd=internal.fileno())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        shutdown()
+    finally:
+        publisher.stop()
+
+
+if __name__ == "__main__":
+    main()
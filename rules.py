@@ -0,0 +1,258 @@
+# Alert rules evaluated over every worker at once, shared by both apps
+#
+# Readings are written into NumPy columns, one slot per worker, as they
+# arrive (an index lookup and an array store). Every EVALUATE_INTERVAL
+# the engine evaluates each rule over whole columns: a few vectorised
+# comparisons however many workers there are, and Python only runs for
+# the alerts that fired or cleared since the last pass.
+#
+# Rules are declared in the apps' ALERT_RULES, e.g.
+#
+#   Threshold("heartrate_high", "heartrate", above=120, hold=30)
+#   Threshold("battery_low", "battery", below=15)
+#   FallUnanswered("fall_unanswered", within=60)
+
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+import numpy as np
+
+EVALUATE_INTERVAL = 1.0     # Seconds between evaluation passes
+INITIAL_SLOTS = 1024        # Worker slots allocated up front, doubled as needed
+RECENT_EVENTS = 1000        # Fired/cleared events kept for /api/alerts
+RESPONDING = "Responding"   # Status a helper's sketch sends after a fall
+
+# Alert event ids, shared with anomaly.py so /api/alerts can merge both
+# sources into one sequence
+event_ids = itertools.count(1)
+
+log = logging.getLogger(__name__)
+
+
+class Threshold:
+    """Fires while `sensor` is above `above` or below `below` (strictly),
+    once that has held for `hold` seconds."""
+
+    def __init__(self, name, sensor, above=None, below=None, hold=0.0):
+        if above is None and below is None:
+            raise ValueError(f"rule {name}: needs above or below")
+        self.name = name
+        self.sensor = sensor
+        self.above = above
+        self.below = below
+        self.hold = hold
+        self.sensors = (sensor,)
+
+    def condition(self, columns, now):
+        values = columns[self.sensor]
+        met = np.zeros(len(values), dtype=bool)
+        if self.above is not None:
+            met |= values > self.above      # NaN (no reading yet) compares False
+        if self.below is not None:
+            met |= values < self.below
+        return met
+
+    def value(self, columns, slot):
+        return float(columns[self.sensor][slot])
+
+    def describe(self):
+        limits = []
+        if self.above is not None:
+            limits.append(f"above {self.above:g}")
+        if self.below is not None:
+            limits.append(f"below {self.below:g}")
+        held = f" for {self.hold:g} s" if self.hold else ""
+        return f"{self.sensor} {' or '.join(limits)}{held}"
+
+
+class FallUnanswered:
+    """Fires when a worker has been down for `within` seconds and nobody
+    has responded since they fell. The helper's sketch sends "Responding"
+    on its own status topic, so as in archive.py a "Responding" from
+    anyone on the same site and floor counts."""
+
+    hold = 0.0
+    sensors = ("falldetect", "status")
+
+    def __init__(self, name, within=60.0):
+        self.name = name
+        self.within = within
+
+    def condition(self, columns, now):
+        fallen_at = columns["fallen_at"]
+        responded = columns["responding_at"] >= fallen_at
+        return (now - fallen_at >= self.within) & ~responded
+
+    def value(self, columns, slot):
+        return float(columns["fallen_at"][slot])
+
+    def describe(self):
+        return f"fallen with no response for {self.within:g} s"
+
+
+class RulesEngine(threading.Thread):
+    """Keeps the latest readings the rules need in columns and evaluates
+    the rules every `interval` seconds.
+
+    on_event(event) is called from the engine's thread for each alert
+    that fires or clears. Events are dicts: id, rule, state ("fired" or
+    "cleared"), site, floor, worker, at, value and message.
+    """
+
+    def __init__(self, rules, on_event=None, interval=EVALUATE_INTERVAL, slots=INITIAL_SLOTS):
+        super().__init__(daemon=True, name="rules")
+        names = [rule.name for rule in rules]
+        if len(set(names)) != len(names):
+            raise ValueError(f"rule names must be unique: {names}")
+        self.rules = list(rules)
+        self.on_event = on_event
+        self.interval = interval
+        self.evaluations = 0
+        self.keys = []                  # Slot -> (site, floor, worker)
+        self._slots = {}                # (site, floor, worker) -> slot
+        self._events = deque(maxlen=RECENT_EVENTS)
+        self._active = {}               # (rule name, key) -> fired event
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+        self._capacity = slots
+        sensors = {sensor for rule in self.rules for sensor in rule.sensors}
+        self._numeric = sorted(sensors - {"falldetect", "status"})
+        self._falls = "falldetect" in sensors
+        columns = self._numeric + (["fallen_at"] if self._falls else [])
+        self.columns = {name: np.full(slots, np.nan) for name in columns}
+        self._floors = {}               # (site, floor) -> floor index
+        self._floor_of = np.zeros(slots, dtype=np.intp)
+        self._floor_responding = np.full(16, np.nan)    # Floor index -> last "Responding" there
+        self._since = [np.full(slots, np.nan) for _ in self.rules]     # Condition met since
+        self._firing = [np.zeros(slots, dtype=bool) for _ in self.rules]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _slot(self, key):
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = len(self.keys)
+            if slot == self._capacity:
+                self._grow()
+            self.keys.append(key)
+            self._slots[key] = slot
+            self._floor_of[slot] = self._floor(key[0], key[1])
+        return slot
+
+    def _floor(self, site, floor):
+        index = self._floors.get((site, floor))
+        if index is None:
+            index = self._floors[(site, floor)] = len(self._floors)
+            if index == len(self._floor_responding):
+                grown = np.full(2 * index, np.nan)
+                grown[:index] = self._floor_responding
+                self._floor_responding = grown
+        return index
+
+    def _grow(self):
+        self._capacity *= 2
+
+        def doubled(array, fill):
+            grown = np.full(2 * len(array), fill, dtype=array.dtype)
+            grown[:len(array)] = array
+            return grown
+        self.columns = {name: doubled(column, np.nan) for name, column in self.columns.items()}
+        self._since = [doubled(since, np.nan) for since in self._since]
+        self._firing = [doubled(firing, False) for firing in self._firing]
+        self._floor_of = doubled(self._floor_of, 0)
+
+    def update(self, key, sensor, value, timestamp):
+        """Feed one stored reading: `value` is the number for numeric
+        sensors (fall as 1/0) and the string for status."""
+        falls = self._falls and (sensor == "falldetect" or sensor == "status")
+        if not falls and sensor not in self.columns:
+            return
+        with self._lock:
+            slot = self._slot(key)
+            if sensor == "falldetect":
+                fallen_at = self.columns["fallen_at"]
+                if not value:
+                    fallen_at[slot] = np.nan
+                elif np.isnan(fallen_at[slot]):
+                    fallen_at[slot] = timestamp     # Repeats of "Fallen" keep the first time
+            elif sensor == "status":
+                if value == RESPONDING:
+                    self._floor_responding[self._floor_of[slot]] = timestamp
+            else:
+                self.columns[sensor][slot] = value
+
+    def observe(self, record, sensor):
+        """Feed the reading just stored in a state_store WorkerRecord."""
+        value = record.status if sensor == "status" else record.reading(sensor)
+        self.update((record.site, record.floor, record.worker), sensor, value, record.updated)
+
+    def evaluate(self, now=None):
+        """One pass of every rule over every worker. Returns the events."""
+        now = time.time() if now is None else now
+        changes = []
+        with self._lock:
+            count = len(self.keys)
+            columns = {name: column[:count] for name, column in self.columns.items()}
+            if self._falls:
+                columns["responding_at"] = self._floor_responding[self._floor_of[:count]]
+            for index, rule in enumerate(self.rules):
+                met = rule.condition(columns, now)
+                since = self._since[index][:count]
+                since[met & np.isnan(since)] = now
+                since[~met] = np.nan
+                firing = met & (now - since >= rule.hold) if rule.hold else met
+                previous = self._firing[index][:count]
+                for slot in np.flatnonzero(firing != previous):
+                    changes.append((rule, int(slot), bool(firing[slot]), rule.value(columns, slot)))
+                previous[:] = firing
+            self.evaluations += 1
+        return [self._record(rule, self.keys[slot], fired, value, now) for rule, slot, fired, value in changes]
+
+    def _record(self, rule, key, fired, value, now):
+        site, floor, worker = key
+        event = {"id": next(event_ids), "rule": rule.name, "state": "fired" if fired else "cleared",
+                 "site": site, "floor": floor, "worker": worker, "at": now, "value": value,
+                 "message": rule.describe()}
+        if fired:
+            self._active[(rule.name, key)] = event
+        else:
+            self._active.pop((rule.name, key), None)
+        self._events.append(event)
+        return event
+
+    def active(self):
+        """Alerts firing now, oldest first."""
+        return sorted(list(self._active.values()), key=lambda event: event["id"])
+
+    def counts(self):
+        """Alerts firing now, by rule."""
+        active = [rule for rule, key in list(self._active)]
+        return {rule.name: active.count(rule.name) for rule in self.rules}
+
+    def events(self, since=0):
+        """Fired and cleared events after event id `since`, oldest first."""
+        return [event for event in list(self._events) if event["id"] > since]
+
+    def stats(self):
+        return {"workers": len(self), "active": self.counts(), "evaluations": self.evaluations}
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                events = self.evaluate()
+            except Exception:
+                log.exception("Alert rule evaluation failed")
+                continue
+            if self.on_event is not None:
+                for event in events:
+                    try:
+                        self.on_event(event)
+                    except Exception:
+                        log.exception("Alert handler failed for %s", event["rule"])
@@ -0,0 +1,343 @@
+# Line reader for the LoRa gateways' USB serial ports
+
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+import serial
+from frame_codec import encode_frames
+from priority import ALERT, TELEMETRY, lane_stats, lane_trackers
+
+MAX_LINE = 512      # Longest line the gateway can emit, anything longer is noise
+FRAME_BATCH = 16    # Queued readings packed into frames per round
+RATE_WINDOW = 10.0  # Seconds over which a reader's line rate is counted
+
+log = logging.getLogger(__name__)
+
+
+class RateMeter:
+    """Events per second over the last complete `window` seconds."""
+
+    def __init__(self, window=RATE_WINDOW):
+        self.window = window
+        self.rate = None            # Rate over the last complete window
+        self._start = time.monotonic()
+        self._count = 0
+
+    def add(self, count=1):
+        now = time.monotonic()
+        if now - self._start >= self.window:
+            self.rate = self._count / (now - self._start)
+            self._start, self._count = now, 0
+        self._count += count
+
+    def value(self):
+        elapsed = time.monotonic() - self._start
+        if elapsed >= 2 * self.window:
+            return 0.0      # Nothing counted for a whole window: the link went quiet
+        if elapsed >= self.window or self.rate is None:
+            return self._count / elapsed if elapsed > 0 else 0.0
+        return self.rate
+
+
+def reader_stats(reader):
+    """stats() of a SerialLineReader or async_engine.AsyncSerialReader."""
+    last = reader.last_line_at
+    return {
+        "url": reader.url,
+        "connected": reader.connected,
+        "lines_read": reader.lines_read,
+        "lines_dropped": reader.lines_dropped,
+        "bytes_read": reader.bytes_read,
+        "lines_per_s": round(reader.line_rate.value(), 2),
+        "idle_s": None if last is None else round(time.monotonic() - last, 3),
+        "reconnects": reader.reconnects,
+        "errors": reader.errors,
+        "last_error": reader.last_error,
+    }
+
+
+class SerialLineReader(threading.Thread):
+    """Reads lines from a serial port and hands each one to on_line.
+
+    Each read takes whatever the port has buffered, or blocks for one byte
+    (with a timeout so stop() is noticed), so a quiet link costs no CPU and
+    a busy one is not read a byte per call as readline() would. If the
+    port cannot be opened or drops out, the reader retries with
+    exponential backoff instead of giving up.
+    `url` is anything serial.serial_for_url accepts, e.g. 'COM3',
+    '/dev/ttyUSB0' or 'loop://'.
+    """
+
+    def __init__(self, url, on_line, baudrate=9600, timeout=1,
+                 min_backoff=0.5, max_backoff=30, port=None):
+        super().__init__(daemon=True, name=f"serial-{url}")
+        self.url = url
+        self.on_line = on_line
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.port = port                # An already open port may be passed in
+
+        self.lines_read = 0
+        self.lines_dropped = 0
+        self.bytes_read = 0
+        self.reconnects = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_line_at = None        # time.monotonic() of the last line handed on
+        self.line_rate = RateMeter()
+        self._opened_before = port is not None
+        self._stop_event = threading.Event()
+
+    @property
+    def connected(self):
+        return self.port is not None
+
+    def stats(self):
+        return reader_stats(self)
+
+    def stop(self):
+        self._stop_event.set()
+        self._close()
+
+    def _open(self):
+        backoff = self.min_backoff
+        while not self._stop_event.is_set():
+            try:
+                self.port = serial.serial_for_url(self.url, self.baudrate, timeout=self.timeout)
+                if self._opened_before:
+                    self.reconnects += 1
+                self._opened_before = True
+                log.info("Serial port %s opened", self.url)
+                return True
+            except (serial.SerialException, OSError, ValueError) as e:
+                self._error(f"Failed to open serial port {self.url}: {e}")
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        return False
+
+    def _close(self):
+        port, self.port = self.port, None
+        if port is not None:
+            try:
+                port.close()
+            except Exception:
+                pass
+
+    def _error(self, message):
+        self.errors += 1
+        self.last_error = message
+        log.error(message)
+
+    def _handle(self, line):
+        self.lines_read += 1
+        self.last_line_at = time.monotonic()
+        self.line_rate.add()
+        try:
+            self.on_line(line)
+        except Exception as e:
+            self.lines_dropped += 1
+            self._error(f"Failed to handle line from {self.url}: {e}")
+
+    def run(self):
+        pending = b""
+        discarding = False      # Skipping the rest of an oversized line
+        while not self._stop_event.is_set():
+            if self.port is None and not self._open():
+                break
+
+            try:
+                data = self.port.read(self.port.in_waiting or 1)
+            except (serial.SerialException, OSError, TypeError, AttributeError) as e:
+                # TypeError/AttributeError: pyserial's way of saying the port was closed under us
+                if self._stop_event.is_set():
+                    break
+                self._error(f"Serial port {self.url} dropped: {e}")
+                if pending:
+                    self.lines_dropped += 1
+                    pending = b""
+                self._close()
+                continue
+
+            if not data:
+                continue    # Read timed out, link is quiet
+            self.bytes_read += len(data)
+
+            lines = (pending + data).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                if discarding:
+                    discarding = False      # Tail of an oversized line
+                    continue
+                self._handle(line + b"\n")
+            if len(pending) >= MAX_LINE:
+                # No newline in sight, discard rather than grow forever
+                self.lines_dropped += 1
+                pending = b""
+                discarding = True
+        self._close()
+
+
+class LoRaForwarder(threading.Thread):
+    """Writes MQTT readings to the TX LoRa from its own thread.
+
+    on_message only queues, so a slow serial write (9600 baud, and the
+    gateway doing stop-and-wait with retries) never stalls the MQTT loop.
+    While the link is behind, only the newest heartrate/battery per worker
+    is kept. Fall alerts always go out first and keep their order; only
+    an alert that repeats the worker's last one still waiting to go is
+    dropped. Each lane holds at most max_pending.
+
+    With frames=True, readings queued together are packed several to a
+    LoRa payload by frame_codec; anything submitted without a reading, or
+    that has no compact form, is sent as its ASCII line. With ack_timeout
+    set, each payload waits for ack() (the TX sketch printing "ACK
+    received" or "Failed") before the next is written, so lines never pile
+    up in the sketch's 64-byte serial buffer while it is busy retrying.
+    """
+
+    def __init__(self, port=None, max_pending=1000, frames=False, batch_size=FRAME_BATCH,
+                 ack_timeout=None):
+        super().__init__(daemon=True, name="lora-forwarder")
+        self.port = port                # Set once the serial port is open
+        self.max_pending = max_pending
+        self.frames = frames
+        self.batch_size = batch_size
+        self.ack_timeout = ack_timeout
+
+        self.sent = 0                   # Readings (or lines) written
+        self.frames_sent = 0            # Payloads written, one LoRa packet each
+        self.coalesced = 0              # Readings replaced by a newer one before sending
+        self.superseded = 0             # Readings dropped for a newer alert from the same topic
+        self.dropped = 0                # Readings lost to a full queue or missing port
+        self.errors = 0
+        self.link_failures = 0          # Payloads the TX sketch gave up on
+        self.ack_timeouts = 0           # Payloads with no answer from the TX sketch
+        self.latency = lane_trackers()  # Per lane, MQTT receipt to write finished
+
+        self._alerts = deque()              # (topic, item)
+        self._last_alert = {}               # topic -> its newest item in _alerts
+        self._telemetry = OrderedDict()     # topic -> (line, lane, queued at, reading)
+        self._cond = threading.Condition()
+        self._stop_event = threading.Event()
+        self._acked = threading.Event()
+
+    def depth(self):
+        return len(self._alerts) + len(self._telemetry)
+
+    def submit(self, key, line, lane=TELEMETRY, received_at=None, reading=None):
+        # received_at is a time.perf_counter() value taken when the message arrived,
+        # reading the (floor, worker, sensor, value) strings for frame encoding
+        if received_at is None:
+            received_at = time.perf_counter()
+        item = (line, lane, received_at, reading)
+        with self._cond:
+            if lane == ALERT:
+                last = self._last_alert.get(key)
+                if last is not None and last[0] == line:
+                    self.coalesced += 1     # The same alert is already waiting to go
+                    return
+                if len(self._alerts) >= self.max_pending:
+                    self._pop_alert()
+                    self.dropped += 1
+                    log.error("Alert queue full, dropped the oldest alert")
+                if self._telemetry.pop(key, None) is not None:
+                    self.superseded += 1    # Sent ahead of it, the older value would win
+                self._alerts.append((key, item))
+                self._last_alert[key] = item
+            elif key in self._telemetry:
+                # Keep the worker's place in line, just send the newer value
+                self._telemetry[key] = item
+                self.coalesced += 1
+            else:
+                if len(self._telemetry) >= self.max_pending:
+                    self._telemetry.popitem(last=False)
+                    self.dropped += 1
+                self._telemetry[key] = item
+            self._cond.notify()
+
+    def ack(self, ok=True):
+        """The TX sketch finished with the last payload, delivered or not."""
+        if not ok:
+            self.link_failures += 1
+        self._acked.set()
+
+    def stats(self):
+        return {
+            "queue_depth": self.depth(),
+            "sent": self.sent,
+            "frames_sent": self.frames_sent,
+            "coalesced": self.coalesced,
+            "superseded": self.superseded,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "link_failures": self.link_failures,
+            "ack_timeouts": self.ack_timeouts,
+            "send_latency": lane_stats(self.latency),
+        }
+
+    def stop(self):
+        self._stop_event.set()
+        self._acked.set()
+        with self._cond:
+            self._cond.notify()
+
+    def _next_batch(self):
+        # Alerts go out in a batch of their own, never behind telemetry
+        size = self.batch_size if self.frames else 1
+        with self._cond:
+            while not self._alerts and not self._telemetry:
+                if self._stop_event.is_set():
+                    return None
+                self._cond.wait()
+            if self._alerts:
+                return [self._pop_alert() for _ in range(min(size, len(self._alerts)))]
+            return [self._telemetry.popitem(last=False)[1]
+                    for _ in range(min(size, len(self._telemetry)))]
+
+    def _pop_alert(self):
+        key, item = self._alerts.popleft()
+        if self._last_alert.get(key) is item:
+            del self._last_alert[key]
+        return item
+
+    def _payloads(self, batch):
+        if not self.frames:
+            return [item[0] for item in batch]
+        readings = [item[3] for item in batch if item[3] is not None]
+        # Same-worker readings next to each other share their IDs in a frame
+        readings.sort(key=lambda reading: reading[:2])
+        return encode_frames(readings) + [item[0] for item in batch if item[3] is None]
+
+    def _write(self, port, payload):
+        self._acked.clear()
+        port.write((payload + "\n").encode())
+        if self.ack_timeout and not self._acked.wait(self.ack_timeout):
+            self.ack_timeouts += 1
+
+    def run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+
+            port = self.port
+            if port is None:
+                self.dropped += len(batch)
+                continue
+            try:
+                for payload in self._payloads(batch):
+                    self._write(port, payload)
+                    self.frames_sent += 1
+                    log.debug("Sent to serial: %s", payload)
+            except Exception as e:
+                self.errors += 1
+                log.error("Failed to write to serial: %s", e)
+                continue
+
+            self.sent += len(batch)
+            now = time.perf_counter()
+            for _, lane, received_at, _ in batch:
+                self.latency[lane].record(now - received_at)
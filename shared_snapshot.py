@@ -0,0 +1,301 @@
+# /api/data snapshots shared between processes through a memory-mapped file
+#
+# The ingest process owns the store. A SnapshotPublisher copies each new
+# serialised snapshot (plain and every cached encoding) into a mapped
+# file; HTTP worker processes map the same file and serve from it with a
+# SnapshotReader, which has the read side of SnapshotCache's interface.
+# A request costs a header read and one copy of the body out of the
+# mapping, no IPC round trip.
+#
+# Layout: a header, then two slots. The publisher fills the slot readers
+# are not using and then flips the header over to it. The header is
+# guarded by a sequence number (a seqlock): odd while it is being
+# written, and bumped again when done, so a reader retries if the number
+# was odd or moved while it was reading.
+#
+# After the slots comes a ring of the last EVENT_SLOTS server-sent events
+# the app's broker published (updates, liveness, alerts), so a worker's
+# /api/stream sends the same deltas as the app's own. Each ring slot
+# starts with the number of the event in it, zeroed while it is being
+# rewritten; a reader that finds the number changed under it, or has
+# fallen a whole ring behind, starts over from a snapshot. The header
+# records how many events were in the ring when its snapshot was taken.
+
+import json
+import logging
+import mmap
+import os
+import queue
+import struct
+import tempfile
+import threading
+import time
+from events import RESYNC
+from snapshot_cache import ENCODINGS
+
+SLOT_SIZE = 32 << 20        # Bytes per slot: all encodings of one snapshot
+EVENT_SLOTS = 4096          # Server-sent events kept for the workers' /api/stream
+EVENT_SIZE = 512            # Bytes per event slot, larger events make readers reload a snapshot
+PUBLISH_INTERVAL = 0.1      # Seconds between checks of the store version
+STREAM_INTERVAL = 0.2       # Seconds between checks for new events of a worker's /api/stream
+KEEPALIVE = 15              # Seconds between keepalive comments on a quiet stream
+
+# seq, slot, version, epoch, events in the ring at the snapshot, then
+# offset and length of each body in the slot
+_BODIES = (None,) + ENCODINGS
+HEADER = struct.Struct("<QQQ8sQ" + "QQ" * len(_BODIES))
+HEADER_SIZE = 128
+EVENTS_WRITTEN = HEADER_SIZE - 8        # Offset of the count of events ever written
+EVENT_HEAD = struct.Struct("<QI")       # Event number, length of the SSE text
+RESYNC_LENGTH = 0xFFFFFFFF              # Event that did not fit, or was lost: reload a snapshot
+
+
+def file_size(slot_size):
+    return HEADER_SIZE + 2 * slot_size + EVENT_SLOTS * EVENT_SIZE
+
+log = logging.getLogger(__name__)
+
+
+def default_path(name):
+    # /dev/shm keeps the file in memory on Linux; elsewhere the page cache does
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, f"workersafety-{name}.snapshot")
+
+
+class SnapshotPublisher(threading.Thread):
+    """Copies snapshot_cache's bodies into the shared file whenever the
+    store version moves on, at most once every `interval` seconds, and
+    every event `broker` publishes as it comes."""
+
+    def __init__(self, cache, path, broker=None, slot_size=SLOT_SIZE, interval=PUBLISH_INTERVAL):
+        super().__init__(daemon=True, name="snapshot-publisher")
+        self.cache = cache
+        self.path = path
+        self.broker = broker
+        self.slot_size = slot_size
+        self.interval = interval
+        self.published = 0
+        self.too_large = 0
+        self.events = 0             # Events written to the ring
+        self._marked = False        # A reload marker went in since the last snapshot
+        self._snapshot_events = 0   # Events in the ring at the last snapshot
+        self._seq = 0
+        self._slot = 1
+        self._events_base = HEADER_SIZE + 2 * slot_size
+        self._stop_event = threading.Event()
+        # Subscribed before the first snapshot, so no event falls in between
+        self._client = None if broker is None else broker.subscribe()
+
+        with open(path, "wb") as f:
+            f.truncate(file_size(slot_size))
+        self._file = open(path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), file_size(slot_size))
+        self.publish()      # Readers never see an empty file
+
+    def write_event(self, message):
+        """Append one SSE message (str) to the ring. None, or a message
+        too large for a slot, tells readers to reload a snapshot instead."""
+        body = b"" if message is None else message.encode()
+        too_large = message is None or EVENT_HEAD.size + len(body) > EVENT_SIZE
+        number = self.events + 1
+        offset = self._events_base + (number % EVENT_SLOTS) * EVENT_SIZE
+        struct.pack_into("<Q", self._map, offset, 0)        # Readers copying this slot will notice
+        if not too_large:
+            self._map[offset + EVENT_HEAD.size:offset + EVENT_HEAD.size + len(body)] = body
+        EVENT_HEAD.pack_into(self._map, offset, number, RESYNC_LENGTH if too_large else len(body))
+        struct.pack_into("<Q", self._map, EVENTS_WRITTEN, number)
+        self.events = number
+        self._marked = self._marked or too_large
+
+    def publish(self):
+        """Publish the current snapshot, returns its version."""
+        events = self.events        # Their store changes are all in the snapshot taken next
+        version, plain = self.cache.get()
+        bodies = [plain] + [self.cache.get(encoding)[1] for encoding in ENCODINGS]
+        if sum(len(body) for body in bodies) > self.slot_size:
+            self.too_large += 1
+            log.error("Snapshot of %d bytes does not fit the %d byte slot, not published",
+                      sum(len(body) for body in bodies), self.slot_size)
+            return None
+
+        slot = 1 - self._slot
+        base = HEADER_SIZE + slot * self.slot_size
+        places = []
+        offset = base
+        for body in bodies:
+            self._map[offset:offset + len(body)] = body
+            places += [offset, len(body)]
+            offset += len(body)
+
+        epoch = self.cache.epoch.encode()
+        self._seq += 1      # Odd: header being rewritten
+        struct.pack_into("<Q", self._map, 0, self._seq)
+        HEADER.pack_into(self._map, 0, self._seq, slot, version, epoch, events, *places)
+        self._seq += 1
+        struct.pack_into("<Q", self._map, 0, self._seq)
+        self._slot = slot
+        self._snapshot_events = events
+        self.published += 1
+        return version
+
+    def stats(self):
+        return {"path": self.path, "published": self.published, "too_large": self.too_large,
+                "events": self.events}
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _copy_events(self):
+        # Wait up to one interval for events, then take whatever else is queued
+        try:
+            message = self._client.get(timeout=self.interval)
+            for _ in range(EVENT_SLOTS):
+                # RESYNC: the broker dropped events for this queue
+                self.write_event(None if message is RESYNC else message)
+                message = self._client.get_nowait()
+        except queue.Empty:
+            pass
+
+    def run(self):
+        version = None
+        while not self._stop_event.is_set():
+            if self._client is None:
+                self._stop_event.wait(self.interval)
+            else:
+                self._copy_events()
+            # Readers that met a reload marker or fell a ring behind need
+            # a snapshot from past it, even if the store has not changed
+            if (self.cache.version != version or self._marked
+                    or self.events - self._snapshot_events >= EVENT_SLOTS // 2):
+                self._marked = False
+                try:
+                    version = self.publish()
+                except Exception as e:
+                    log.error("Failed to publish snapshot: %s", e)
+        if self._client is not None:
+            self.broker.unsubscribe(self._client)
+        self._map.close()
+        self._file.close()
+
+
+class SnapshotReader:
+    """Serves what a SnapshotPublisher in another process published.
+
+    Has the parts of SnapshotCache and EventBroker the dashboard endpoints
+    use. Deltas for /api/data?since= are not kept in the file:
+    snapshot(since) returns every worker once anything changed, which
+    clients merge like any delta. /api/stream sends the events in the ring.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.retries = 0
+        self.resyncs = 0            # Streams that fell behind the ring and reloaded a snapshot
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._events_base = len(self._map) - EVENT_SLOTS * EVENT_SIZE
+        self._cached = {}           # encoding -> (seq, version, body, events), last copies made
+        self._parsed = (None, None)     # (version, dict) for snapshot()
+
+    def _header(self):
+        while True:
+            fields = HEADER.unpack_from(self._map, 0)
+            if not fields[0] & 1:
+                return fields
+            self.retries += 1
+            time.sleep(0)
+
+    def _read(self, encoding=None):
+        # (version, body, events in the ring at the snapshot)
+        index = _BODIES.index(encoding)
+        while True:
+            fields = self._header()
+            seq = fields[0]
+            cached = self._cached.get(encoding)
+            if cached is not None and cached[0] == seq:
+                return cached[1:]
+            offset, length = fields[5 + 2 * index], fields[6 + 2 * index]
+            body = self._map[offset:offset + length]
+            # The publisher may have reused this slot while we copied
+            if struct.unpack_from("<Q", self._map, 0)[0] == seq:
+                self._cached[encoding] = (seq, fields[2], body, fields[4])
+                return fields[2], body, fields[4]
+            self.retries += 1
+
+    def get(self, encoding=None):
+        """Return (version, body) for the given content encoding."""
+        return self._read(encoding)[:2]
+
+    @property
+    def version(self):
+        return self._header()[2]
+
+    @property
+    def epoch(self):
+        return self._header()[3].rstrip(b"\0").decode()
+
+    def etag(self, version=None):
+        return f"{self.epoch}-{self.version if version is None else version}"
+
+    def snapshot(self, since=0):
+        version, body = self.get()
+        if since >= version:
+            return {}
+        if self._parsed[0] != version:
+            self._parsed = (version, json.loads(body) if body else {})
+        return self._parsed[1]
+
+    def events(self, after):
+        """New events after event number `after`: (SSE messages, number of
+        the last one taken, None). In place of None, the number of an event
+        that a snapshot must cover before the stream goes on past it: one
+        too large for the ring, or the oldest left when it fell behind."""
+        written = struct.unpack_from("<Q", self._map, EVENTS_WRITTEN)[0]
+        oldest = written - EVENT_SLOTS      # The ring holds the events after this one
+        if after < oldest:
+            return [], oldest, oldest
+        messages = []
+        for number in range(after + 1, written + 1):
+            offset = self._events_base + (number % EVENT_SLOTS) * EVENT_SIZE
+            found, length = EVENT_HEAD.unpack_from(self._map, offset)
+            if found != number:
+                return messages, number - 1, None   # Overwritten, caught up with next time
+            if length == RESYNC_LENGTH:
+                return messages, number, number
+            start = offset + EVENT_HEAD.size
+            message = self._map[start:start + length]
+            if struct.unpack_from("<Q", self._map, offset)[0] != number:
+                return messages, number - 1, None   # Rewritten while we copied
+            messages.append(message.decode())
+        return messages, written, None
+
+    def stream(self, snapshot=None):
+        """EventBroker.stream() for a worker process: a snapshot, then the
+        events the app published, from the ring. A client that falls a
+        ring behind, or meets an event too large for it, gets a fresh
+        snapshot once there is one that covers what it missed."""
+        version, body, last = self._read()
+        yield "event: snapshot\ndata: " + body.decode() + "\n\n"
+        quiet = 0.0
+        while True:
+            time.sleep(STREAM_INTERVAL)
+            quiet += STREAM_INTERVAL
+            messages, upto, need = self.events(last)
+            if messages:
+                quiet = 0.0
+                yield "".join(messages)
+            if need is None:
+                last = upto
+            else:
+                version, body, covered = self._read()
+                if covered < need:
+                    last = need - 1         # Not published yet, look again next time
+                else:
+                    self.resyncs += 1
+                    quiet = 0.0
+                    last = upto
+                    # Events after it may be in the snapshot too, applying them again is harmless
+                    yield "event: snapshot\ndata: " + body.decode() + "\n\n"
+            if quiet >= KEEPALIVE:
+                quiet = 0.0
+                yield ": keepalive\n\n"
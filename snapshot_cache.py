@@ -0,0 +1,87 @@
+# Serialised /api/data body, built once per store change instead of per request
+
+import gzip
+import json
+import threading
+import time
+import zlib
+
+ENCODINGS = ("gzip", "deflate")
+
+
+class SnapshotCache:
+    """Caches the JSON encoding of store.snapshot(site) and its compressed forms.
+
+    The body is rebuilt only when the store version has moved on, and at most
+    once every `min_interval` seconds, so a burst of readings costs one
+    serialisation however many dashboards are polling. Compressed variants
+    are made the first time a client asks for them and kept until the next
+    rebuild.
+    """
+
+    def __init__(self, store, site=None, min_interval=0.0):
+        self.store = store
+        self.site = site
+        self.min_interval = min_interval
+        self.builds = 0
+        self._built_at = 0.0
+        # (store version, {encoding (None for plain): bytes}), replaced as a
+        # whole so a reader never pairs one build's body with another's version
+        self._state = (-1, {})
+        self._lock = threading.Lock()
+
+    def _rebuild(self):
+        version = self.store.version
+        built, bodies = self._state
+        if version == built:
+            return
+        now = time.monotonic()
+        if bodies and now - self._built_at < self.min_interval:
+            return
+        data = self.store.snapshot(self.site)
+        self._state = (version, {None: json.dumps(data, separators=(",", ":")).encode()})
+        self._built_at = now
+        self.builds += 1
+
+    def get(self, encoding=None):
+        """Return (version, body) for the given content encoding."""
+        # Unlocked fast path: the common case is an unchanged store
+        version, bodies = self._state
+        if version != self.store.version or encoding not in bodies:
+            with self._lock:
+                self._rebuild()
+                version, bodies = self._state
+                if encoding not in bodies:
+                    plain = bodies[None]
+                    if encoding == "gzip":
+                        bodies[encoding] = gzip.compress(plain, compresslevel=6, mtime=0)
+                    else:
+                        bodies[encoding] = zlib.compress(plain, 6)
+        return version, bodies[encoding]
+
+    # The rest of what the dashboard endpoints read, so that a
+    # shared_snapshot.SnapshotReader can stand in for this cache
+
+    @property
+    def version(self):
+        return self.store.version
+
+    @property
+    def epoch(self):
+        return self.store.epoch
+
+    def etag(self, version=None):
+        return self.store.etag(version)
+
+    def snapshot(self, since=0):
+        return self.store.snapshot(self.site, since=since)
+
+
+def pick_encoding(accept_encodings):
+    """Best encoding we cache from a werkzeug Accept-Encoding header, or None."""
+    best, best_quality = None, 0
+    for encoding in ENCODINGS:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
@@ -0,0 +1,204 @@
+# Latest reading per worker, shared by the Site A and Central apps
+
+import math
+import os
+import sys
+import threading
+import time
+
+FALLEN_VALUES = ("Fallen", "1", "true")
+NOT_FALLEN_VALUES = ("OK", "0", "false")
+
+# Sensor name in MQTT topics / LoRa payloads -> WorkerRecord field
+# hrmin/hrmax are the heart rate range over a Site A aggregation window
+SENSOR_FIELDS = {"heartrate": "heartrate", "battery": "battery", "falldetect": "fallen", "status": "status",
+                 "hrmin": "heartrate_min", "hrmax": "heartrate_max"}
+NUMERIC_SENSORS = ("heartrate", "battery", "falldetect", "hrmin", "hrmax")
+
+
+def parse_count(value):
+    """A heart rate, battery level or bpm bound as a whole number. Sketches
+    send heart rate as a float ("75.00"), so the fraction is dropped."""
+    number = float(value)
+    if not math.isfinite(number) or number < 0:
+        raise ValueError(f"not a reading {value!r}")
+    return int(number)
+
+
+def parse_fall(value):
+    if value in FALLEN_VALUES:
+        return True
+    if value in NOT_FALLEN_VALUES:
+        return False
+    raise ValueError(f"unknown fall status {value!r}")
+
+
+class WorkerRecord:
+    __slots__ = ("site", "floor", "worker", "heartrate", "battery", "fallen", "status",
+                 "heartrate_min", "heartrate_max", "liveness", "silent", "anomaly", "updated", "version")
+
+    def __init__(self, site, floor, worker):
+        self.site = site
+        self.floor = floor
+        self.worker = worker
+        self.heartrate = None       # bpm
+        self.battery = None         # percent
+        self.fallen = None          # None until the first falldetect
+        self.status = None          # Sketch status topic: "online", "OK", "Responding"
+        self.heartrate_min = None   # bpm, only sent with aggregated telemetry
+        self.heartrate_max = None
+        self.liveness = None        # "stale" or "offline" while sensors are silent, see liveness.py
+        self.silent = ()            # Those sensors
+        self.anomaly = None         # Heart rate anomaly score, 1 or more is anomalous, see anomaly.py
+        self.updated = 0.0          # time.time() of the last reading
+        self.version = 0            # Store version of the last change
+
+    def reading(self, sensor):
+        """Latest value of a sensor as a number (fall is 1/0), or None."""
+        if sensor not in NUMERIC_SENSORS:
+            return None
+        value = getattr(self, SENSOR_FIELDS[sensor])
+        return None if value is None else float(value)
+
+    def as_dict(self):
+        # Same keys the dashboards have always read, only sensors seen so far
+        data = {}
+        if self.heartrate is not None:
+            data["heartrate"] = self.heartrate
+        if self.battery is not None:
+            data["battery"] = self.battery
+        if self.fallen is not None:
+            data["falldetect"] = "Fallen" if self.fallen else "OK"
+        if self.status is not None:
+            data["status"] = self.status
+        if self.heartrate_min is not None:
+            data["hrmin"] = self.heartrate_min
+            data["hrmax"] = self.heartrate_max
+        if self.liveness is not None:
+            data["liveness"] = self.liveness
+            data["silent"] = list(self.silent)
+        if self.anomaly is not None:
+            data["anomaly"] = round(self.anomaly, 2)
+        data["updated"] = self.updated
+        return data
+
+
+class WorkerStateStore:
+    """Typed latest-value store keyed by (site, floor, worker).
+
+    Writers (the MQTT/serial threads) serialise on one lock. Readers never
+    take it: records() copies the index in a single C-level call, so Flask
+    threads can serialise while ingest carries on. `version` goes up on
+    every accepted update, so a reader can tell cheaply if anything changed.
+    """
+
+    def __init__(self):
+        self.epoch = os.urandom(4).hex()    # Tells this run's versions from a previous run's
+        self.version = 0
+        self._records = {}          # (site, floor, worker) -> WorkerRecord
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._records)
+
+    def get(self, site, floor, worker):
+        return self._records.get((site, floor, worker))
+
+    def records(self):
+        return list(self._records.values())
+
+    def etag(self, version=None):
+        return f"{self.epoch}-{self.version if version is None else version}"
+
+    def update(self, site, floor, worker, sensor, value, timestamp=None):
+        """Store one raw reading. Returns the record, or None if it was rejected."""
+        try:
+            if sensor == "heartrate":
+                field, parsed = "heartrate", parse_count(value)
+            elif sensor == "battery":
+                field, parsed = "battery", parse_count(value)
+            elif sensor == "hrmin" or sensor == "hrmax":
+                field, parsed = SENSOR_FIELDS[sensor], parse_count(value)
+            elif sensor == "falldetect":
+                field, parsed = "fallen", parse_fall(value)
+            elif sensor == "status":
+                field, parsed = "status", sys.intern(value)
+            else:
+                return None
+        except (ValueError, OverflowError):
+            return None
+
+        key = (site, floor, worker)
+        with self._lock:
+            record = self._records.get(key)
+            if record is None:
+                # Intern the IDs so every record and key shares one copy
+                site, floor, worker = sys.intern(site), sys.intern(floor), sys.intern(worker)
+                record = WorkerRecord(site, floor, worker)
+                self._records[(site, floor, worker)] = record
+            setattr(record, field, parsed)
+            record.updated = time.time() if timestamp is None else timestamp
+            self.version += 1
+            record.version = self.version
+        return record
+
+    def set_liveness(self, site, floor, worker, state, silent=()):
+        """Mark a known worker stale or offline, or live again (state None).
+        Returns the record, or None if there is no such worker."""
+        with self._lock:
+            record = self._records.get((site, floor, worker))
+            if record is None:
+                return None
+            record.liveness = state
+            record.silent = tuple(silent)
+            self.version += 1
+            record.version = self.version
+        return record
+
+    def set_anomaly(self, site, floor, worker, score):
+        """Set a known worker's heart rate anomaly score. Returns the
+        record, or None if there is no such worker."""
+        with self._lock:
+            record = self._records.get((site, floor, worker))
+            if record is None:
+                return None
+            record.anomaly = score
+            self.version += 1
+            record.version = self.version
+        return record
+
+    def readings(self):
+        """Raw (site, floor, worker, sensor, value, timestamp) tuples that rebuild this store."""
+        for record in self.records():
+            if record.heartrate is not None:
+                yield record.site, record.floor, record.worker, "heartrate", str(record.heartrate), record.updated
+            if record.battery is not None:
+                yield record.site, record.floor, record.worker, "battery", str(record.battery), record.updated
+            if record.fallen is not None:
+                yield (record.site, record.floor, record.worker, "falldetect",
+                       "Fallen" if record.fallen else "OK", record.updated)
+            if record.status is not None:
+                yield record.site, record.floor, record.worker, "status", record.status, record.updated
+            if record.heartrate_min is not None:
+                yield record.site, record.floor, record.worker, "hrmin", str(record.heartrate_min), record.updated
+            if record.heartrate_max is not None:
+                yield record.site, record.floor, record.worker, "hrmax", str(record.heartrate_max), record.updated
+
+    def snapshot(self, site=None, since=0):
+        """Nested dict for the dashboards: site -> floor -> worker -> readings.
+
+        With `site` given, that site's floor -> worker -> readings only.
+        With `since`, only workers changed after that store version.
+        """
+        data = {}
+        for record in self.records():
+            if record.version <= since:
+                continue
+            if site is None:
+                floors = data.setdefault(record.site, {})
+            elif record.site == site:
+                floors = data
+            else:
+                continue
+            floors.setdefault(record.floor, {})[record.worker] = record.as_dict()
+        return data
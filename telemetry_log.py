@@ -0,0 +1,221 @@
+# Append-only log of accepted readings so the Central app can rebuild its
+# state after a restart
+
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+SEGMENT_BYTES = 16 * 1024 * 1024        # Start a new segment after this size
+CHECKPOINT_INTERVAL = 300               # Seconds between checkpoints
+RETENTION_BYTES = 256 * 1024 * 1024     # Old segments are deleted past this total...
+RETENTION_AGE = 7 * 24 * 3600           # ...or once older than this
+FLUSH_INTERVAL = 0.2                    # Max seconds a reading waits for fsync
+
+# Each record: payload length, crc32 of payload, then the payload
+#   payload = timestamp (float64) + "site\0floor\0worker\0sensor\0value" in UTF-8
+RECORD_HEADER = struct.Struct("<II")
+TIMESTAMP = struct.Struct("<d")
+
+
+def encode_record(site, floor, worker, sensor, value, timestamp):
+    payload = TIMESTAMP.pack(timestamp) + "\0".join((site, floor, worker, sensor, value)).encode()
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_segment(path):
+    """Yield (site, floor, worker, sensor, value, timestamp) from one segment.
+
+    Stops quietly at a torn or corrupt record, which is what a crash mid-write
+    leaves at the end of the last segment.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        length, crc = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        payload = data[start:start + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            return
+        fields = payload[TIMESTAMP.size:].decode().split("\0")
+        if len(fields) != 5:
+            return
+        yield (*fields, TIMESTAMP.unpack_from(payload)[0])
+        offset = start + length
+
+
+class TelemetryLog(threading.Thread):
+    """Segmented write-ahead log with a batching writer thread.
+
+    append() only queues, so the serial path never waits on the disk. The
+    writer drains everything queued, writes it in one go and fsyncs once per
+    batch (group commit). Every CHECKPOINT_INTERVAL it rotates to a new
+    segment and saves a checkpoint of the whole store, so recovery is the
+    latest checkpoint plus the segments written after it.
+    """
+
+    def __init__(self, directory, checkpoint=None, segment_bytes=SEGMENT_BYTES,
+                 checkpoint_interval=CHECKPOINT_INTERVAL, retention_bytes=RETENTION_BYTES,
+                 retention_age=RETENTION_AGE, flush_interval=FLUSH_INTERVAL, max_pending=100000):
+        super().__init__(daemon=True, name="telemetry-log")
+        self.directory = directory
+        self.checkpoint = checkpoint    # Callable returning the readings that rebuild the store
+        self.segment_bytes = segment_bytes
+        self.checkpoint_interval = checkpoint_interval
+        self.retention_bytes = retention_bytes
+        self.retention_age = retention_age
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self.written = 0
+        self.dropped = 0                # Readings lost to a full queue
+        self.fsyncs = 0
+        self.recovered = 0
+
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._stop_event = threading.Event()
+        self._file = None
+        self._segment = 0
+        self._last_checkpoint = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+    def stats(self):
+        return {
+            "segment": self._segment,
+            "pending": len(self._pending),
+            "written": self.written,
+            "dropped": self.dropped,
+            "fsyncs": self.fsyncs,
+            "recovered": self.recovered,
+        }
+
+    def _segments(self):
+        names = [n for n in os.listdir(self.directory) if n.startswith("seg-") and n.endswith(".log")]
+        return sorted(int(n[4:-4]) for n in names)
+
+    def _checkpoints(self):
+        names = [n for n in os.listdir(self.directory) if n.startswith("checkpoint-") and n.endswith(".json")]
+        return sorted(int(n[11:-5]) for n in names)
+
+    def _path(self, kind, number):
+        if kind == "seg":
+            return os.path.join(self.directory, f"seg-{number:08d}.log")
+        return os.path.join(self.directory, f"checkpoint-{number:08d}.json")
+
+    def recover(self, apply):
+        """Replay the latest checkpoint and the log after it through apply(...).
+
+        apply takes (site, floor, worker, sensor, value, timestamp). Call this
+        before start().
+        """
+        checkpoints = self._checkpoints()
+        first_segment = 0
+        if checkpoints:
+            first_segment = checkpoints[-1]
+            with open(self._path("checkpoint", first_segment)) as f:
+                for reading in json.load(f):
+                    apply(*reading)
+                    self.recovered += 1
+
+        segments = self._segments()
+        for number in segments:
+            if number < first_segment:
+                continue
+            for reading in read_segment(self._path("seg", number)):
+                apply(*reading)
+                self.recovered += 1
+
+        # Never append after a possibly torn tail, start a fresh segment
+        self._segment = (segments[-1] + 1) if segments else first_segment
+        return self.recovered
+
+    def append(self, site, floor, worker, sensor, value, timestamp):
+        with self._cond:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append((site, floor, worker, sensor, value, timestamp))
+            if len(self._pending) == 1:
+                self._cond.notify()
+
+    def stop(self):
+        self._stop_event.set()
+        with self._cond:
+            self._cond.notify()
+        self.join()
+
+    def _open_segment(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self._path("seg", self._segment), "ab")
+
+    def _rotate(self):
+        self._segment += 1
+        self._open_segment()
+
+    def _write_checkpoint(self):
+        # Rotate first: every reading not in this checkpoint lands in the new
+        # segment or later, since the store is updated before append()
+        self._rotate()
+        readings = list(self.checkpoint())
+        path = self._path("checkpoint", self._segment)
+        with open(path + ".tmp", "w") as f:
+            json.dump(readings, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self._last_checkpoint = time.monotonic()
+        self._apply_retention()
+
+    def _apply_retention(self):
+        checkpoints = self._checkpoints()
+        if not checkpoints:
+            return
+        latest = checkpoints[-1]
+        for number in checkpoints[:-1]:
+            os.remove(self._path("checkpoint", number))
+
+        # Segments from the latest checkpoint on are needed for recovery
+        old = [n for n in self._segments() if n < latest]
+        total = sum(os.path.getsize(self._path("seg", n)) for n in self._segments())
+        cutoff = time.time() - self.retention_age
+        for number in old:
+            path = self._path("seg", number)
+            size = os.path.getsize(path)
+            if total > self.retention_bytes or os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                total -= size
+
+    def _write_batch(self, batch):
+        self._file.write(b"".join(encode_record(*reading) for reading in batch))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.fsyncs += 1
+        self.written += len(batch)
+        if self._file.tell() >= self.segment_bytes:
+            self._rotate()
+
+    def run(self):
+        self._open_segment()
+        while True:
+            with self._cond:
+                if not self._pending and not self._stop_event.is_set():
+                    self._cond.wait(self.flush_interval)
+                batch = list(self._pending)
+                self._pending.clear()
+            if batch:
+                self._write_batch(batch)
+                # Let more readings pile up so the next fsync covers them too
+                if not self._stop_event.is_set():
+                    self._stop_event.wait(self.flush_interval / 10)
+            if self.checkpoint is not None and \
+                    time.monotonic() - self._last_checkpoint >= self.checkpoint_interval:
+                self._write_checkpoint()
+            if self._stop_event.is_set() and not self._pending:
+                break
+        self._file.close()
@@ -0,0 +1,6 @@
+# The app modules live at the repo root, import them from there like bench/ does
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,86 @@
+# Accuracy of the heart rate anomaly detector on synthetic traces
+#
+# Each worker has their own resting heart rate (60-85 bpm) and noise
+# (2-6 bpm), sampled every 2 s and rounded to whole bpm as the sketches
+# send it. After 10 minutes of normal readings:
+#   steady  nothing happens for an hour: every alarm is a false one
+#   climb   +0.5 bpm a sample for 2 minutes, to 30 bpm over their usual,
+#           still under the fixed 120 bpm rule
+#   step    a sudden 25 bpm rise that lasts
+# and then, for climb and step, back to normal for 10 minutes, which must
+# not raise a second alarm. bench/bench_anomaly.py times update().
+
+import functools
+import random
+
+import pytest
+
+from anomaly import AnomalyDetector
+
+WORKERS = 200               # Traces of each kind
+INTERVAL = 2.0              # Seconds between samples, as the sketches publish
+SETTLE = 300                # Normal samples before anything happens (10 min)
+STEADY = 1800               # Samples of the steady trace after that (1 h)
+CLIMB = 60                  # Samples of the climb, 0.5 bpm each
+STEP = 25                   # bpm
+AFTER = 300                 # Normal samples after a climb or step
+
+MIN_DETECTED = 0.95         # Fraction of climbs and steps that must raise an alarm
+MAX_DELAY = {"climb": 40,   # Samples into the climb by which the median alarm must come (20 bpm)
+             "step": 3}     # Samples after the step
+MAX_FALSE_PER_HOUR = 0.05   # False alarms per worker-hour of normal readings
+
+
+def trace(rng, kind):
+    # (samples, index of the first abnormal sample or None)
+    usual = rng.uniform(60, 85)
+    noise = rng.uniform(2, 6)
+    normal = lambda: round(rng.gauss(usual, noise))
+    samples = [normal() for _ in range(SETTLE)]
+    if kind == "steady":
+        return samples + [normal() for _ in range(STEADY)], None
+    if kind == "climb":
+        samples += [round(rng.gauss(usual + 0.5 * (i + 1), noise)) for i in range(CLIMB)]
+        samples += [round(rng.gauss(usual + 0.5 * CLIMB, noise)) for _ in range(CLIMB)]
+    else:
+        samples += [round(rng.gauss(usual + STEP, noise)) for _ in range(2 * CLIMB)]
+    return samples + [normal() for _ in range(AFTER)], SETTLE
+
+
+@functools.lru_cache(maxsize=None)
+def accuracy(kind, workers=WORKERS, seed=1):
+    """(alarm delays in samples, false alarms, worker-hours of normal readings)"""
+    rng = random.Random(seed)
+    events = []
+    detector = AnomalyDetector(events.append)
+    delays = []
+    false_alarms = 0
+    for worker in range(workers):
+        samples, start = trace(rng, kind)
+        before = len(events)
+        for index, value in enumerate(samples):
+            detector.update(("SITE_A", "1", str(worker)), value, index * INTERVAL)
+        fired = [int(event["at"] / INTERVAL) for event in events[before:] if event["state"] == "fired"]
+        if start is None:
+            false_alarms += len(fired)
+            continue
+        false_alarms += sum(1 for index in fired if index < start)
+        late = [index for index in fired if index >= start]
+        if late:
+            delays.append(late[0] - start)
+            false_alarms += len(late) - 1     # A second alarm for the same episode
+    normal = SETTLE + (STEADY if kind == "steady" else AFTER)
+    return delays, false_alarms, workers * normal * INTERVAL / 3600
+
+
+@pytest.mark.parametrize("kind", ["steady", "climb", "step"])
+def test_false_alarms(kind):
+    _, false_alarms, hours = accuracy(kind)
+    assert false_alarms / hours <= MAX_FALSE_PER_HOUR
+
+
+@pytest.mark.parametrize("kind", ["climb", "step"])
+def test_detection(kind):
+    delays, _, _ = accuracy(kind)
+    assert len(delays) / WORKERS >= MIN_DETECTED
+    assert sorted(delays)[len(delays) // 2] <= MAX_DELAY[kind]
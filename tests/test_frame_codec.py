@@ -0,0 +1,77 @@
+# frame_codec: the wire format, round trips and corrupted frames
+
+import random
+
+import pytest
+
+from frame_codec import MAX_PAYLOAD, decode_frame, encode_frames
+
+# Frames are a wire format shared with deployed gateways, these must not change
+GOLDEN = (
+    ([("1", "2", "heartrate", "75")], ["#AQABAks"]),
+    ([("1", "2", "heartrate", "75"), ("1", "2", "battery", "100")], ["#AQABAksJZA"]),
+    ([("1", "2", "falldetect", "Fallen")], ["#ARIBAg"]),
+    ([("1", "2", "falldetect", "OK"), ("1", "2", "status", "Responding")], ["#AQIBAgsB"]),
+    ([("3", "200", "heartrate", "130")], ["#AQADyAGCAQ"]),
+    ([("1", "2", "heartrate", "75.00"), ("1", "2", "battery", "100")], ["#AQABAksJZA"]),
+    ([("1", "2", "heartrate", "-3")], ["/1/2/heartrate/-3"]),
+    ([("A", "2", "status", "online")], ["/A/2/status/online"]),
+)
+
+ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_#!"
+
+
+def publish_round(workers, rng):
+    # One 2 s publish cycle of the worker sketches
+    readings = []
+    for worker in range(1, workers + 1):
+        floor = str(1 + worker % 3)
+        worker = str(worker)
+        readings.append((floor, worker, "heartrate", str(rng.randint(60, 140))))
+        readings.append((floor, worker, "battery", str(rng.randint(0, 100))))
+        readings.append((floor, worker, "falldetect", "Fallen" if rng.random() < 0.01 else "OK"))
+        readings.append((floor, worker, "status", rng.choice(("online", "OK", "Responding"))))
+    return readings
+
+
+def rounds(count=50, workers=20):
+    rng = random.Random(0)
+    return [publish_round(workers, rng) for _ in range(count)]
+
+
+@pytest.mark.parametrize("readings, payloads", GOLDEN)
+def test_golden_vectors(readings, payloads):
+    assert encode_frames(readings) == payloads
+
+
+def test_round_trip():
+    for readings in rounds():
+        payloads = encode_frames(readings)
+        assert all(len(payload) <= MAX_PAYLOAD and payload.isprintable() for payload in payloads)
+        assert [reading for payload in payloads for reading in decode_frame(payload)] == readings
+
+
+def test_corrupted_frames_decode_whole_or_not_at_all():
+    rng = random.Random(1)
+    frames = [payload for readings in rounds() for payload in encode_frames(readings)]
+    rejected = 0
+    for payload in frames:
+        data = list(payload)
+        for _ in range(rng.randint(1, 3)):
+            pos = rng.randrange(1, len(data) + 1)
+            if rng.random() < 0.5 and pos < len(data):
+                data[pos] = rng.choice(ALPHABET)
+            else:
+                data.insert(pos, rng.choice(ALPHABET))
+        readings = decode_frame("".join(data))
+        if readings is None:
+            rejected += 1
+        else:
+            assert all(len(reading) == 4 and all(isinstance(part, str) for part in reading)
+                       for reading in readings)
+    assert rejected > len(frames) // 2
+
+
+@pytest.mark.parametrize("payload", ["", "#", "#AQ", "#AA", "#AQABA", "/1/2/heartrate/75", "#!!!!"])
+def test_incomplete_frames_are_rejected(payload):
+    assert decode_frame(payload) is None
@@ -0,0 +1,69 @@
+# Four RX LoRa gateways into one centralApp: every line written is read,
+# none dropped, and every reading sent is stored (bench/bench_gateways.py
+# does the same at full line rate and reports lag)
+
+import os
+import threading
+import time
+
+import pytest
+
+import centralApp
+from priority import LaneQueue, lane_trackers
+from tools.loadgen.model import SiteModel, gateway_packet, readings
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="needs ptys")
+
+GATEWAYS = 4
+ROUNDS = 3
+SETTLE = 5.0        # Seconds allowed for the app to catch up after the last write
+
+
+def write_rounds(target, site, seed, sent):
+    model = SiteModel(5, seed=seed)
+    for _ in range(ROUNDS):
+        for reading in readings(model.round()):
+            packet = gateway_packet(site, "/%s/%s/%s/%s" % reading)
+            target.write(packet)
+            sent["lines"] += packet.count("\n")
+            sent["readings"] += 1
+
+
+def test_four_gateways_drop_nothing(monkeypatch):
+    from tools.loadgen.targets import PtyTarget
+
+    monkeypatch.setattr(centralApp, "gateways", {})
+    monkeypatch.setattr(centralApp, "ingest_queue", LaneQueue())
+    monkeypatch.setattr(centralApp, "store_latency", lane_trackers())
+    targets = [PtyTarget() for _ in range(GATEWAYS)]
+    sites = ["SITE_" + chr(ord("A") + i) for i in range(GATEWAYS)]
+    sent = {target.name: {"lines": 0, "readings": 0} for target in targets}
+    try:
+        for target in targets:
+            centralApp.start_serial_reader(target.name)
+        writers = [threading.Thread(target=write_rounds, args=(target, site, seed, sent[target.name]))
+                   for seed, (target, site) in enumerate(zip(targets, sites))]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+
+        stored = centralApp.store_latency.values()
+        readings_sent = sum(counts["readings"] for counts in sent.values())
+        deadline = time.monotonic() + SETTLE
+        while time.monotonic() < deadline and (
+                sum(tracker.count for tracker in stored) < readings_sent or
+                any(gateway.reader.lines_read < sent[url]["lines"] for url, gateway in centralApp.gateways.items())):
+            time.sleep(0.05)
+
+        for target in targets:
+            stats = centralApp.gateways[target.name].stats()
+            assert (stats["lines_read"], stats["lines_dropped"], stats["errors"]) == \
+                (sent[target.name]["lines"], 0, 0)
+        assert sum(tracker.count for tracker in stored) == readings_sent
+        assert centralApp.ingest_queue.dropped == 0
+    finally:
+        for gateway in centralApp.gateways.values():
+            gateway.reader.stop()
+        for target in targets:
+            target.close()
@@ -0,0 +1,88 @@
+# A fall jumps ahead of telemetry, but never ahead of the same worker's
+# newer state: queue "OK" then "Fallen", the worker must end up fallen.
+
+import asyncio
+import threading
+import time
+
+import centralApp
+from priority import ALERT, TELEMETRY, AsyncLaneQueue, LaneQueue
+from serial_link import LoRaForwarder
+
+OK = b"Got valid message: From SITE_B: /1/2/falldetect/OK"
+FALLEN = b"Got valid message: From SITE_B: /1/2/falldetect/Fallen"
+
+
+class FakePort:
+    def __init__(self):
+        self.written = []
+        self.lock = threading.Lock()
+
+    def write(self, data):
+        with self.lock:
+            self.written.append(data.decode().rstrip("\n"))
+
+
+def test_lane_queue_alert_supersedes_older_telemetry():
+    queue = LaneQueue()
+    queue.put("heartrate 70", TELEMETRY, "/1/9/heartrate")
+    queue.put("OK", TELEMETRY, "/1/2/falldetect")
+    queue.put("Fallen", ALERT, "/1/2/falldetect")
+    assert queue.get(timeout=0) == (ALERT, "Fallen")
+    assert queue.get(timeout=0) == (TELEMETRY, "heartrate 70")
+    assert queue.get(timeout=0) is None
+    assert queue.superseded == 1
+
+
+def test_lane_queue_keeps_telemetry_newer_than_the_alert():
+    queue = LaneQueue()
+    queue.put("Fallen", ALERT, "/1/2/falldetect")
+    queue.put("OK", TELEMETRY, "/1/2/falldetect")
+    assert [queue.get(timeout=0), queue.get(timeout=0)] == [(ALERT, "Fallen"), (TELEMETRY, "OK")]
+    assert queue.superseded == 0
+
+
+def test_lane_queue_bounded_drop_forgets_keys():
+    queue = LaneQueue(max_telemetry=1)
+    queue.put("OK", TELEMETRY, "/1/2/falldetect")
+    queue.put("heartrate 70", TELEMETRY, "/1/9/heartrate")
+    queue.put("Fallen", ALERT, "/1/2/falldetect")
+    assert (queue.dropped, queue.superseded, len(queue)) == (1, 0, 2)
+
+
+def test_async_lane_queue_alert_supersedes_older_telemetry():
+    async def drain():
+        queue = AsyncLaneQueue()
+        queue.put("OK", TELEMETRY, "/1/2/falldetect")
+        queue.put("Fallen", ALERT, "/1/2/falldetect")
+        taken = [await queue.get()]
+        assert len(queue) == 0
+        return taken
+
+    assert asyncio.run(drain()) == [(ALERT, "Fallen")]
+
+
+def test_forwarder_sends_no_stale_ok_after_a_fall():
+    port = FakePort()
+    forwarder = LoRaForwarder(port)
+    forwarder.submit("/1/9/heartrate", "/1/9/heartrate/70")
+    forwarder.submit("/1/2/falldetect", "/1/2/falldetect/OK")
+    forwarder.submit("/1/2/falldetect", "/1/2/falldetect/Fallen", ALERT)
+    forwarder.start()
+    deadline = time.monotonic() + 5
+    while forwarder.depth() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    forwarder.stop()
+    forwarder.join(5)
+    assert port.written == ["/1/2/falldetect/Fallen", "/1/9/heartrate/70"]
+    assert forwarder.superseded == 1
+
+
+def test_central_stores_fallen_after_ok(monkeypatch):
+    # A queue of our own, which a started ingest thread is not waiting on
+    monkeypatch.setattr(centralApp, "ingest_queue", LaneQueue())
+    centralApp.on_serial_line(OK)
+    centralApp.on_serial_line(FALLEN)
+    while len(centralApp.ingest_queue):
+        centralApp.store_line(*centralApp.ingest_queue.get(timeout=0))
+    assert centralApp.fall_state("SITE_B", "1", "2") is True
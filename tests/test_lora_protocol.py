@@ -0,0 +1,111 @@
+# lora_protocol.parse_line on every line the gateway sketches print, and
+# on corrupted and truncated ones, which must never come back as readings
+# the sketches would not send
+
+import random
+
+import pytest
+
+from lora_protocol import (CHECKSUM_CALCULATED, CHECKSUM_RECEIVED, FALL_VALUES, FRAME, IGNORED,
+                           RECEIVE_FAILED, RSSI, SENDING, SENSORS, SENT_CHECKSUM, SENT_REPLY,
+                           STATUS, UNKNOWN, VALID, parse_line)
+
+# What LORA_CENTRAL.INO prints for each packet
+PACKET = (
+    b"Received Checksum: 3265\r\n",
+    b"Calculated Checksum: 3265\r\n",
+    b"Got valid message: From SITE_A: /1/2/heartrate/75\r\n",
+    b"RSSI: -41\r\n",
+    b"Sending: From CENTRAL To SITE_A: ACK\r\n",
+    b"With checksum: 2011\r\n",
+    b"Sent a reply\r\n",
+)
+
+# Clean lines -> (kind, {field: value}) they must parse to. The last
+# few are the TX LoRa's (LORA_SITEA.ino): never a reading at Central.
+EXPECTED = {
+    PACKET[0]: (CHECKSUM_RECEIVED, {"number": 3265}),
+    PACKET[1]: (CHECKSUM_CALCULATED, {"number": 3265}),
+    PACKET[2]: (VALID, {"sender": "SITE_A", "floor": "1", "worker": "2", "sensor": "heartrate",
+                        "value": "75", "payload": "/1/2/heartrate/75"}),
+    PACKET[3]: (RSSI, {"number": -41}),
+    PACKET[4]: (SENDING, {}),
+    PACKET[5]: (SENT_CHECKSUM, {"number": 2011}),
+    PACKET[6]: (SENT_REPLY, {}),
+    b"Got valid message: From SITE_B: /3/14/heartrate/75.00\r\n":
+        (VALID, {"sender": "SITE_B", "floor": "3", "worker": "14", "sensor": "heartrate", "value": "75.00"}),
+    b"Got valid message: From SITE_A: /1/2/falldetect/Fallen\r\n":
+        (VALID, {"sensor": "falldetect", "value": "Fallen"}),
+    b"Got valid message: From SITE_A: /1/2/status/Responding\r\n":
+        (VALID, {"sensor": "status", "value": "Responding"}),
+    b"Got valid message: From SITE_A: #AQABAksJZA\r\n": (FRAME, {"sender": "SITE_A", "payload": "#AQABAksJZA"}),
+    b"Ignored message: From SITE_B To OTHER: /1/2/battery/80\r\n": (IGNORED, {}),
+    b"Receive failed\r\n": (RECEIVE_FAILED, {}),
+    b"Set Freq to: 915.00\r\n": (STATUS, {}),
+    b"Sent raw: /1/2/heartrate/75\r\n": (UNKNOWN, {}),
+    b"ACK received\r\n": (UNKNOWN, {}),
+    b"Retrying...\r\n": (UNKNOWN, {}),
+    b"Failed\r\n": (UNKNOWN, {}),
+}
+
+
+def implausible(line):
+    # A VALID reading that a corrupted line should never have produced
+    if line.kind != VALID or line.sensor not in SENSORS:
+        return line.kind == VALID
+    if line.sensor == "falldetect":
+        return line.value not in FALL_VALUES
+    if line.sensor == "status":
+        return not line.value.isalpha()
+    try:
+        float(line.value)
+    except ValueError:
+        return True
+    return False
+
+
+def corrupt(lines, seed=0):
+    # Random byte flips, drops and inserts
+    rng = random.Random(seed)
+    for raw in lines:
+        data = bytearray(raw)
+        for _ in range(rng.randint(1, 4)):
+            op = rng.randint(0, 2)
+            pos = rng.randrange(len(data)) if data else 0
+            if op == 0 and data:
+                data[pos] = rng.randrange(256)
+            elif op == 1 and data:
+                del data[pos]
+            else:
+                data.insert(pos, rng.randrange(256))
+        yield bytes(data)
+
+
+@pytest.mark.parametrize("raw", EXPECTED)
+def test_clean_line(raw):
+    kind, fields = EXPECTED[raw]
+    line = parse_line(raw)
+    assert line.kind == kind
+    assert {name: getattr(line, name) for name in fields} == fields
+
+
+def test_truncated_lines_are_not_implausible_readings():
+    for raw in EXPECTED:
+        for end in range(len(raw)):
+            line = parse_line(raw[:end])
+            assert not implausible(line), (raw[:end], line)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_corrupted_lines_are_not_implausible_readings(seed):
+    gateway = [PACKET[i % len(PACKET)] for i in range(20000)]
+    for raw in corrupt(gateway, seed):
+        line = parse_line(raw)
+        assert not implausible(line), (raw, line)
+
+
+@pytest.mark.parametrize("reading", [b"heartrate/7\xff5", b"heartrate/7.5.5", b"battery/-75", b"heartrate/75x",
+                                     b"heartrate/", b"falldetect/OKAY", b"falldetect/Fallen!", b"status/Resp0nding"])
+def test_mangled_values_are_not_readings(reading):
+    line = parse_line(b"Got valid message: From SITE_A: /1/2/" + reading + b"\r\n")
+    assert line.kind != VALID
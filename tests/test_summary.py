@@ -0,0 +1,88 @@
+# /api/summary, kept up to date reading by reading, against a recount of
+# every record in the store (bench/bench_summary.py times both)
+
+import random
+
+import pytest
+
+import centralApp
+from floor_summary import FloorSummary
+from liveness import LIVE, OFFLINE, STALE
+from state_store import WorkerStateStore
+
+SITES, FLOORS, WORKERS = 3, 4, 10
+UPDATES = 20000
+CHECK = 500         # Updates between comparisons
+
+
+def recompute(store, low_battery):
+    # Brute force: the counts of every floor, site and overall, from scratch
+    def empty():
+        return {"workers": 0, "fallen": 0, "low_battery": 0, "stale": 0, "offline": 0, "bpm": []}
+
+    total = empty()
+    sites = {}
+    for record in store.records():
+        site = sites.setdefault(record.site, dict(empty(), floors={}))
+        floor = site["floors"].setdefault(record.floor, empty())
+        for counts in (total, site, floor):
+            counts["workers"] += 1
+            counts["fallen"] += bool(record.fallen)
+            counts["low_battery"] += record.battery is not None and record.battery < low_battery
+            counts["stale"] += record.liveness == STALE
+            counts["offline"] += record.liveness == OFFLINE
+            if record.heartrate is not None and record.liveness != OFFLINE:
+                counts["bpm"].append(record.heartrate)
+
+    def finish(counts):
+        bpm = counts.pop("bpm")
+        counts["heartrate_avg"] = round(sum(bpm) / len(bpm), 1) if bpm else None
+        for floor in counts.get("floors", {}).values():
+            finish(floor)
+        return counts
+
+    return {"total": finish(total), "sites": {name: finish(site) for name, site in sites.items()}}
+
+
+def random_reading(rng):
+    sensor = rng.choice(("heartrate", "heartrate", "battery", "falldetect"))
+    if sensor == "heartrate":
+        return sensor, str(rng.randint(55, 130))
+    if sensor == "battery":
+        return sensor, str(rng.randint(0, 100))
+    return sensor, rng.choice(("OK", "OK", "OK", "Fallen"))
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(centralApp, "store", WorkerStateStore())
+    monkeypatch.setattr(centralApp, "floor_summary", FloorSummary(centralApp.LOW_BATTERY))
+    monkeypatch.setitem(centralApp.app.config, "LOGIN_DISABLED", True)
+    return centralApp.app.test_client()
+
+
+def assert_consistent(client):
+    served = client.get("/api/summary").get_json()
+    served.pop("version")
+    assert served == recompute(centralApp.store, centralApp.LOW_BATTERY)
+
+
+def test_summary_matches_a_recount(client):
+    rng = random.Random(1)
+    keys = [("SITE_%02d" % site, str(floor), str(worker)) for site in range(SITES)
+            for floor in range(1, FLOORS + 1) for worker in range(1, WORKERS + 1)]
+    for key in keys:
+        centralApp.store_reading(*key, "heartrate", str(rng.randint(60, 100)))
+        centralApp.store_reading(*key, "battery", str(rng.randint(20, 100)))
+        centralApp.store_reading(*key, "falldetect", "OK")
+    assert_consistent(client)
+
+    for done in range(1, UPDATES + 1):
+        key = rng.choice(keys)
+        if done % 50 == 0:
+            centralApp.on_liveness_change(key, rng.choice((LIVE, STALE, OFFLINE)), ["heartrate"])
+        else:
+            centralApp.store_reading(*key, *random_reading(rng))
+        if done % CHECK == 0:
+            assert_consistent(client)
+    assert_consistent(client)
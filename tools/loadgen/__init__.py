@@ -0,0 +1,13 @@
+# Synthetic worker telemetry for load testing the Site A and Central apps,
+# see __main__.py for the command line
+
+from tools.loadgen.model import SiteModel, gateway_line, gateway_packet, readings
+from tools.loadgen.recorder import DashboardProbe, MetricsWatcher, Recorder
+from tools.loadgen.runner import parse_burst, run
+from tools.loadgen.targets import FakeMessage, FakeMqttClient, MqttTarget, PtyTarget, SerialTarget
+
+__all__ = [
+    "DashboardProbe", "FakeMessage", "FakeMqttClient", "MetricsWatcher", "MqttTarget", "PtyTarget",
+    "Recorder", "SerialTarget", "SiteModel", "gateway_line", "gateway_packet", "parse_burst",
+    "readings", "run",
+]
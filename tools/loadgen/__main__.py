@@ -0,0 +1,211 @@
+# Load generator for the Site A and Central apps
+#
+#   python -m tools.loadgen mqtt --in-process --workers 200
+#   python -m tools.loadgen mqtt --broker 127.0.0.1 --workers 200 --watch http://localhost:5000/metrics
+#   python -m tools.loadgen serial --central --sites 3 --workers 100 --frames
+#   python -m tools.loadgen serial --central --sites 4 --gateways 4 --workers 50
+#   python -m tools.loadgen serial --pty --workers 50
+#
+# Run from the repository root. --in-process and --central import the app
+# and drive it directly (no broker, radio or dashboard login needed) and
+# also report end-to-end latency, reading handed over to dashboard update.
+# Against a separately running app use --watch to read its /metrics.
+
+import argparse
+import json
+import logging
+import sys
+import time
+from frame_codec import encode_frames
+from log_setup import setup_logging
+from priority import lane_stats
+from tools.loadgen.model import SiteModel, gateway_packet, readings
+from tools.loadgen.recorder import DashboardProbe, MetricsWatcher, Recorder
+from tools.loadgen.runner import parse_burst, run
+from tools.loadgen.targets import FakeMqttClient, MqttTarget, PtyTarget, SerialTarget
+
+
+def site_names(count):
+    return ["SITE_" + chr(ord("A") + i) for i in range(count)]
+
+
+class Sites:
+    """One SiteModel per LoRa site, a round is [(site, readings)]."""
+
+    def __init__(self, names, workers, floors, fall_rate, seed):
+        self.models = [(name, SiteModel(workers, floors, fall_rate, seed=seed + i))
+                       for i, name in enumerate(names)]
+
+    @property
+    def falls(self):
+        return sum(model.falls for _, model in self.models)
+
+    def round(self):
+        return [(name, reading) for name, model in self.models for reading in readings(model.round())]
+
+
+def mqtt_sender(target, recorder, probe):
+    def send(messages):
+        for topic, payload in messages:
+            started = time.perf_counter()
+            if probe is not None and topic.endswith("/heartrate"):
+                _, floor, worker, _ = topic.split("/")
+                probe.expect(None, floor, worker, payload, started)
+            try:
+                target.publish(topic, payload)
+            except Exception:
+                recorder.errors += 1
+                continue
+            recorder.send_latency.record(time.perf_counter() - started)
+            recorder.sent += 1
+            if topic != "actl":
+                recorder.readings += 1
+    return send
+
+
+def serial_sender(target, recorder, probe, frames):
+    # `target` may also be a dict of site -> target, one gateway per site
+    def send(batch):
+        by_site = {}
+        for site, reading in batch:
+            by_site.setdefault(site, []).append(reading)
+        for site, site_readings in by_site.items():
+            if frames:
+                # Sorted by worker like the Site A forwarder, so frames share headers
+                site_readings.sort(key=lambda r: (r[0], r[1]))
+                payloads = encode_frames(site_readings)
+            else:
+                payloads = ["/%s/%s/%s/%s" % reading for reading in site_readings]
+            started = time.perf_counter()
+            if probe is not None:
+                for floor, worker, sensor, value in site_readings:
+                    if sensor == "heartrate":
+                        probe.expect(site, floor, worker, value, started)
+            site_target = target[site] if isinstance(target, dict) else target
+            for payload in payloads:
+                try:
+                    site_target.write(gateway_packet(site, payload))
+                except OSError:
+                    recorder.errors += 1
+                    continue
+                recorder.sent += 1
+            recorder.send_latency.record(time.perf_counter() - started)
+            recorder.readings += len(site_readings)
+    return send
+
+
+def drain(probe, wait):
+    # Give the app time to work through its queue before reading the probe
+    deadline = time.perf_counter() + wait
+    last = -1
+    while time.perf_counter() < deadline and probe.updates != last:
+        last = probe.updates
+        time.sleep(0.5)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m tools.loadgen")
+    parser.add_argument("mode", choices=("mqtt", "serial"))
+    parser.add_argument("--workers", type=int, default=20, help="workers per site")
+    parser.add_argument("--floors", type=int, default=5)
+    parser.add_argument("--interval", type=float, default=2.0, help="seconds between a worker's publishes")
+    parser.add_argument("--fall-rate", type=float, default=0.001, help="chance of a fall per worker and round")
+    parser.add_argument("--burst", help="FACTOR:ON:OFF, e.g. 5:2:8 is 5x the rate for 2 s in every 10 s")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--watch", help="/metrics URL of an app running elsewhere")
+    parser.add_argument("--log-level", default="WARNING", help="for the app when run in-process")
+
+    mqtt_group = parser.add_argument_group("mqtt")
+    mqtt_group.add_argument("--broker", help="broker host to publish to")
+    mqtt_group.add_argument("--port", type=int, default=1883)
+    mqtt_group.add_argument("--in-process", action="store_true", help="call app.on_message directly")
+
+    serial_group = parser.add_argument_group("serial")
+    serial_group.add_argument("--central", action="store_true", help="feed centralApp in-process over loop://")
+    serial_group.add_argument("--pty", action="store_true", help="write to a pty for a separately run centralApp")
+    serial_group.add_argument("--url", help="serial port or serial_for_url URL to write to")
+    serial_group.add_argument("--sites", type=int, default=1, help="LoRa sites sending to the gateway")
+    serial_group.add_argument("--gateways", type=int, default=1, help="with --central, RX gateways to spread sites over")
+    serial_group.add_argument("--frames", action="store_true", help="packed frame_codec payloads")
+    args = parser.parse_args(argv)
+
+    if args.workers < 1 or args.interval <= 0:
+        parser.error("--workers must be at least 1 and --interval positive")
+    if not 1 <= args.gateways <= args.sites:
+        parser.error("--gateways must be between 1 and --sites")
+    burst = parse_burst(args.burst)
+    setup_logging(args.log_level)
+    log = logging.getLogger("loadgen")
+
+    recorder = Recorder()
+    probe = None
+    app_stats = None
+    stop_app = None
+    if args.mode == "mqtt":
+        if args.in_process:
+            import app
+            target = FakeMqttClient(app.on_message)
+            probe = DashboardProbe(app.broker)
+            app_stats = lambda: {"store_latency": lane_stats(app.store_latency)}
+        elif args.broker:
+            target = MqttTarget(args.broker, args.port)
+        else:
+            parser.error("mqtt needs --broker or --in-process")
+        model = SiteModel(args.workers, args.floors, args.fall_rate, seed=args.seed)
+        send = mqtt_sender(target, recorder, probe)
+    else:
+        if args.central:
+            import serial
+            import centralApp
+            # Sites are spread over the gateways, each its own loop:// port
+            targets = []
+            for i in range(args.gateways):
+                port = serial.serial_for_url("loop://", timeout=1)
+                centralApp.start_serial_reader(f"loop://{i}", port=port)
+                targets.append(SerialTarget(port=port))
+            target = {name: targets[i % len(targets)] for i, name in enumerate(site_names(args.sites))}
+            probe = DashboardProbe(centralApp.broker)
+            app_stats = lambda: {"gateways": {url: gateway.stats() for url, gateway in centralApp.gateways.items()},
+                                 "store_latency": lane_stats(centralApp.store_latency),
+                                 "ingest_dropped": centralApp.ingest_queue.dropped}
+            stop_app = lambda: [gateway.reader.stop() for gateway in centralApp.gateways.values()]
+        elif args.pty:
+            target = PtyTarget()
+            print(f"Writing to {target.name}, put it in PORTS in centralApp.py and press Enter")
+            input()
+        elif args.url:
+            target = SerialTarget(args.url)
+        else:
+            parser.error("serial needs --central, --pty or --url")
+        model = Sites(site_names(args.sites), args.workers, args.floors, args.fall_rate, args.seed)
+        send = serial_sender(target, recorder, probe, args.frames)
+
+    watcher = MetricsWatcher(args.watch) if args.watch else None
+    if watcher is not None:
+        watcher.start()
+    if probe is not None:
+        probe.start()
+
+    log.info("Running %s load for %.0f s", args.mode, args.duration)
+    rounds = run(model, send, recorder, args.interval, args.duration, burst)
+
+    report = {"rounds": rounds, "falls": model.falls, "generator": recorder.stats()}
+    if probe is not None:
+        drain(probe, 10.0)
+        probe.stop()
+        report["dashboard"] = probe.stats()
+    if app_stats is not None:
+        report["app"] = app_stats()
+    if watcher is not None:
+        report["app_counters_per_s"] = watcher.stop()
+    if stop_app is not None:
+        stop_app()      # Before the port it reads goes away
+    for closing in set(target.values()) if isinstance(target, dict) else (target,):
+        closing.close()
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# Simulated workers publishing what the M5StickC sketches publish
+
+import json
+import random
+
+SENSORS = ("heartrate", "battery", "falldetect", "status")
+
+
+class Worker:
+    __slots__ = ("floor", "worker", "heartrate", "battery", "fallen_for", "responding_for")
+
+    def __init__(self, floor, worker, rng):
+        self.floor = floor
+        self.worker = worker
+        self.heartrate = float(rng.randint(65, 105))
+        self.battery = rng.randint(40, 100)
+        self.fallen_for = 0         # Rounds left on the ground
+        self.responding_for = 0     # Rounds left helping a fallen colleague
+
+
+class SiteModel:
+    """Workers spread over floors, each publishing every round.
+
+    Per worker and round: heartrate (a bounded random walk, printed like
+    the sketches' String(float), e.g. "75.00"), battery, falldetect
+    ("Fallen"/"OK"), status and the consolidated actl JSON. `fall_rate`
+    is the chance per worker and round of a fall; a fall lasts
+    `fall_rounds` rounds, and a worker on the same floor reports
+    "Responding" meanwhile.
+    """
+
+    def __init__(self, workers, floors=5, fall_rate=0.001, fall_rounds=5, seed=0):
+        self.rng = random.Random(seed)
+        self.fall_rate = fall_rate
+        self.fall_rounds = fall_rounds
+        self.falls = 0
+        self.workers = [Worker(1 + i % floors, 1 + i // floors, self.rng) for i in range(workers)]
+        self._by_floor = {}
+        for worker in self.workers:
+            self._by_floor.setdefault(worker.floor, []).append(worker)
+
+    def _step(self, worker):
+        rng = self.rng
+        # Never repeat the last value, so a latency probe can tell updates apart
+        step = rng.choice((-2.0, -1.0, 1.0, 2.0))
+        worker.heartrate = min(170.0, max(45.0, worker.heartrate + step))
+        if worker.fallen_for:
+            worker.fallen_for -= 1
+        elif rng.random() < self.fall_rate:
+            worker.fallen_for = self.fall_rounds
+            self.falls += 1
+            helpers = [w for w in self._by_floor[worker.floor] if w is not worker]
+            if helpers:
+                rng.choice(helpers).responding_for = self.fall_rounds
+        if worker.responding_for:
+            worker.responding_for -= 1
+        if rng.random() < 0.01:
+            worker.battery = max(0, worker.battery - 1)
+
+    def round(self):
+        """One publish round: [(topic, payload)] for every worker."""
+        messages = []
+        for worker in self.workers:
+            self._step(worker)
+            prefix = f"/{worker.floor}/{worker.worker}/"
+            fallen = worker.fallen_for > 0
+            status = "Fallen" if fallen else "Responding" if worker.responding_for else "OK"
+            messages.append((prefix + "heartrate", f"{worker.heartrate:.2f}"))
+            messages.append((prefix + "battery", str(worker.battery)))
+            messages.append((prefix + "falldetect", "Fallen" if fallen else "OK"))
+            messages.append((prefix + "status", "Responding" if worker.responding_for else "online"))
+            messages.append(("actl", json.dumps({
+                "status": status, "floor": worker.floor, "worker": worker.worker,
+                "heartRate": round(worker.heartrate, 2), "battery": worker.battery,
+            }, separators=(",", ":"))))
+        return messages
+
+
+def gateway_line(site, payload):
+    """A line as LORA_CENTRAL.INO prints it for a packet from `site`."""
+    return f"Got valid message: From {site}: {payload}\r\n"
+
+
+def gateway_packet(site, payload, rssi=-60, checksum=1234):
+    """Every line the gateway prints for one packet, in order."""
+    return ("Received Checksum: %d\r\n" % checksum
+            + "Calculated Checksum: %d\r\n" % checksum
+            + gateway_line(site, payload)
+            + "RSSI: %d\r\n" % rssi
+            + "Sending: From CENTRAL To %s: ACK\r\n" % site
+            + "With checksum: %d\r\n" % checksum
+            + "Sent a reply\r\n")
+
+
+def readings(messages):
+    """(floor, worker, sensor, value) for the per-sensor topics, as Site A forwards them."""
+    result = []
+    for topic, payload in messages:
+        parts = topic.split("/")
+        if len(parts) == 4:
+            result.append((parts[1], parts[2], parts[3], payload))
+    return result
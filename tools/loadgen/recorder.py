@@ -0,0 +1,149 @@
+# Throughput and end-to-end latency of a load run
+
+import json
+import queue
+import threading
+import time
+import urllib.request
+from priority import LatencyTracker
+
+PENDING_PER_WORKER = 8      # Heart rates awaiting their dashboard update, per worker
+
+
+class Recorder:
+    """What the generator managed to send, against what it was asked to."""
+
+    def __init__(self):
+        self.sent = 0               # Messages (MQTT) or gateway packets (serial)
+        self.readings = 0
+        self.errors = 0
+        self.late_rounds = 0        # Rounds started after their slot, the generator fell behind
+        self.started = None
+        self.finished = None
+        self.send_latency = LatencyTracker(10000)   # Time for one publish or write call
+
+    def start(self):
+        self.started = time.perf_counter()
+
+    def stop(self):
+        self.finished = time.perf_counter()
+
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def stats(self):
+        elapsed = self.elapsed()
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "sent": self.sent,
+            "sent_per_s": round(self.sent / elapsed, 1),
+            "readings": self.readings,
+            "readings_per_s": round(self.readings / elapsed, 1),
+            "errors": self.errors,
+            "late_rounds": self.late_rounds,
+            "send": self.send_latency.stats(),
+        }
+
+
+class DashboardProbe(threading.Thread):
+    """End-to-end latency, from handing a heart rate to the target to the
+    app pushing it to dashboards.
+
+    Subscribes to an app's EventBroker like a browser on /api/stream does
+    and matches each update's heart rate against those still in flight
+    for that worker. Only works in-process, where `broker` is the app's.
+    """
+
+    def __init__(self, broker):
+        super().__init__(daemon=True, name="loadgen-probe")
+        self.broker = broker
+        self.latency = LatencyTracker(10000)
+        self.updates = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._client = broker.subscribe()
+        self._stopped = False
+
+    def expect(self, site, floor, worker, heartrate, sent_at):
+        # The stores keep whole beats per minute
+        key = (site, floor, worker)
+        with self._lock:
+            values = self._pending.get(key)
+            if values is None:
+                values = self._pending[key] = {}
+            elif len(values) >= PENDING_PER_WORKER:
+                del values[next(iter(values))]
+            values[int(float(heartrate))] = sent_at
+
+    def stats(self):
+        return {
+            "end_to_end": self.latency.stats(),
+            "updates": self.updates,
+            "resyncs": self.broker.resyncs,
+        }
+
+    def stop(self):
+        self._stopped = True
+        self.broker.unsubscribe(self._client)
+
+    def run(self):
+        while not self._stopped:
+            try:
+                message = self._client.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            received = time.perf_counter()
+            if not isinstance(message, str) or not message.startswith("event: update"):
+                continue
+            update = json.loads(message.split("data: ", 1)[1])
+            self.updates += 1
+            heartrate = update["data"].get("heartrate")
+            if heartrate is None:
+                continue
+            key = (update.get("site"), update["floor"], update["worker"])
+            with self._lock:
+                values = self._pending.get(key)
+                sent_at = values.pop(int(heartrate), None) if values else None
+            # None for updates of other sensors, which repeat the heart rate
+            if sent_at is not None:
+                self.latency.record(received - sent_at)
+
+
+def scrape_counters(url):
+    """Sum of every counter sample on a /metrics page, by metric name."""
+    totals = {}
+    with urllib.request.urlopen(url, timeout=5) as response:
+        text = response.read().decode()
+    types = {}
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ", 3)
+            types[name] = kind
+        elif line and not line.startswith("#"):
+            sample, _, value = line.rpartition(" ")
+            name = sample.split("{", 1)[0]
+            if types.get(name) == "counter":
+                totals[name] = totals.get(name, 0) + float(value)
+    return totals
+
+
+class MetricsWatcher:
+    """Counter rates on a running app's /metrics between start() and stop(),
+    for when the app is a separate process."""
+
+    def __init__(self, url):
+        self.url = url
+        self._before = None
+        self._started = None
+        self.rates = {}
+
+    def start(self):
+        self._before = scrape_counters(self.url)
+        self._started = time.perf_counter()
+
+    def stop(self):
+        after = scrape_counters(self.url)
+        elapsed = time.perf_counter() - self._started
+        self.rates = {name: round((value - self._before.get(name, 0)) / elapsed, 1)
+                      for name, value in sorted(after.items())}
+        return self.rates
@@ -0,0 +1,53 @@
+# Paces generated rounds onto a target
+
+import time
+
+SLICES = 20                 # A round is spread over its interval in this many steps
+
+
+def parse_burst(text):
+    """'FACTOR:ON:OFF' -> (factor, on seconds, off seconds), e.g. '5:2:8'
+    runs five times the normal rate for 2 s out of every 10 s."""
+    if not text:
+        return None
+    factor, on, off = (float(part) for part in text.split(":"))
+    if factor <= 0 or on < 0 or off < 0 or on + off <= 0:
+        raise ValueError(f"Bad burst pattern: {text}")
+    return factor, on, off
+
+
+def rate_factor(burst, elapsed):
+    if burst is None:
+        return 1.0
+    factor, on, off = burst
+    return factor if elapsed % (on + off) < on else 1.0
+
+
+def run(model, send, recorder, interval=2.0, duration=10.0, burst=None, rounds=None):
+    """Generate rounds every `interval` seconds (the sketches publish every
+    2 s) for `duration` seconds, or `rounds` rounds, calling send(messages)
+    with a slice of each round at a time so the load is spread out.
+    """
+    recorder.start()
+    deadline = recorder.started + duration
+    due = recorder.started
+    count = 0
+    while True:
+        now = time.perf_counter()
+        if (rounds is not None and count >= rounds) or (rounds is None and now >= deadline):
+            break
+        if now > due + interval:
+            recorder.late_rounds += 1
+            due = now
+        messages = model.round()
+        count += 1
+        size = max(1, -(-len(messages) // SLICES))
+        step = interval / rate_factor(burst, now - recorder.started) / -(-len(messages) // size)
+        for start in range(0, len(messages), size):
+            send(messages[start:start + size])
+            due += step
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    recorder.stop()
+    return count
@@ -0,0 +1,114 @@
+# Where generated traffic goes: an MQTT broker, an app's on_message
+# called in-process, or a serial port read by centralApp
+
+import os
+import time
+
+MQTT_PORT = 1883
+MQTT_USER = "iot_proj"              # Same credentials as the worker sketches
+MQTT_PASSWORD = "1234"
+
+
+class FakeMessage:
+    """Stands in for paho's MQTTMessage: topic and payload bytes."""
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class FakeMqttClient:
+    """Delivers each publish straight to on_message(client, userdata, msg),
+    on the calling thread, the way paho's network loop would."""
+
+    def __init__(self, on_message):
+        self.on_message = on_message
+        self.sent = 0
+
+    def publish(self, topic, payload):
+        self.on_message(self, None, FakeMessage(topic, payload.encode()))
+        self.sent += 1
+
+    def close(self):
+        pass
+
+
+class MqttTarget:
+    """Publishes to a real broker, QoS 0 like the sketches.
+
+    With `echo` set the target also subscribes to what it publishes and
+    calls echo(topic, payload, seconds) with the broker's delivery delay,
+    which is the part of the latency the apps cannot see.
+    """
+
+    def __init__(self, host, port=MQTT_PORT, username=MQTT_USER, password=MQTT_PASSWORD, echo=None):
+        import paho.mqtt.client as mqtt
+        self.client = mqtt.Client()
+        self.client.username_pw_set(username, password)
+        self.sent = 0
+        self._published = {}
+        self._echo = echo
+        if echo is not None:
+            self.client.on_connect = lambda client, userdata, flags, rc: client.subscribe("#")
+            self.client.on_message = self._on_echo
+        self.client.connect(host, port, 60)
+        self.client.loop_start()
+
+    def _on_echo(self, client, userdata, msg):
+        sent_at = self._published.pop((msg.topic, msg.payload), None)
+        if sent_at is not None:
+            self._echo(msg.topic, msg.payload, time.perf_counter() - sent_at)
+
+    def publish(self, topic, payload):
+        payload = payload.encode()
+        if self._echo is not None:
+            if len(self._published) > 100000:
+                self._published.clear()     # Echoes that never came back
+            self._published[(topic, payload)] = time.perf_counter()
+        self.client.publish(topic, payload)
+        self.sent += 1
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+class SerialTarget:
+    """Writes gateway output to a serial port, anything serial_for_url opens."""
+
+    def __init__(self, url=None, port=None, baudrate=9600):
+        import serial
+        self.port = port if port is not None else serial.serial_for_url(url, baudrate, timeout=1)
+        self.sent = 0
+
+    def write(self, text):
+        self.port.write(text.encode())
+        self.sent += 1
+
+    def close(self):
+        self.port.close()
+
+
+class PtyTarget:
+    """A pseudo-terminal: put `name` in centralApp's PORTS, the generator
+    writes to the master side. POSIX only."""
+
+    def __init__(self):
+        import pty
+        import tty
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)           # No echo or newline translation on the app's side
+        self.name = os.ttyname(slave)
+        self._slave = slave         # Held open so writes do not fail before the app connects
+        self.sent = 0
+
+    def write(self, text):
+        data = text.encode()
+        while data:
+            data = data[os.write(self.master, data):]
+        self.sent += 1
+
+    def close(self):
+        os.close(self.master)
+        os.close(self._slave)